@@ -0,0 +1,295 @@
+"""Пакетная разрезка сканов без графического интерфейса.
+
+Прямоугольники задаются манифестом в координатах оригинального изображения:
+
+JSON - словарь {"имя_файла.tif": [[x1, y1, x2, y2], ...], ...}; для
+       многостраничного TIFF - {"имя_файла.tif": {"номер страницы": [[x1, y1, x2, y2], ...]}}
+CSV  - строки с колонками file,x1,y1,x2,y2 и необязательными page и angle
+       (одна строка на область)
+
+Пятое число области (колонка angle в CSV) - поворот фотографии в градусах
+против часовой стрелки: такая область выпрямляется при разрезке.
+
+Страницы нумеруются с 1; без номера области относятся к первой странице.
+Все страницы файла разрезаются за один проход, каждая читается один раз.
+С флагом --detect фотографии на файлах и страницах, которых нет в манифесте,
+ищутся автоматически (манифест в этом случае можно не указывать).
+
+Формат результатов задается профилем --profile (TIFF LZW, Deflate, ZSTD,
+без сжатия, JPEG, WebP); для каждого файла и в итоге выводятся скорость
+кодирования и степень сжатия.
+
+Повторный запуск сохраняет только области, которые изменились: сведения
+о сохраненных областях хранятся в папке результатов в файлах
+<имя_файла>_cutted.json. С флагом --force все области сохраняются заново.
+
+С --duplicates mark каждая область перед сохранением сравнивается по
+перцептивным хэшам с фотографиями других сканов в папке результатов
+(индекс photo_hashes.npz, см. duplicates.py), и найденные повторы выводятся;
+с --duplicates skip повторы к тому же не сохраняются.
+
+Время этапов разрезки каждого файла (декодирование, кодирование, запись
+и другие) и память рабочего процесса записываются в журнал замеров
+timings.jsonl (см. instrumentation.py); с флагом --trace каждый файл к тому
+же профилируется cProfile и tracemalloc.
+
+Пример:
+    python batch_cut.py scans/ manifest.json -o result/ -j 4
+    python batch_cut.py scans/ --detect -o result/ --profile zstd
+    python batch_cut.py scans/ --detect -o archive/ --duplicates skip
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cutting import DEFAULT_PROFILE, OUTPUT_PROFILES, TIFF_EXTENSIONS, ExportManifest, ExportStats
+from engine import cut
+from instrumentation import TIMINGS_LOG_NAME, default_log_dir, log_timings, set_trace, stage, traced
+from region_reader import scan_pages
+
+# Что делать с областями, похожими на уже вырезанные фотографии: отметить или не сохранять
+DUPLICATE_ACTIONS = ('mark', 'skip')
+
+
+def parse_box(values):
+    """Область (x1, y1, x2, y2[, угол]) из значений манифеста; нулевой угол отбрасывается"""
+    box = tuple(int(float(v)) for v in values[:4])
+    angle = float(values[4]) if len(values) > 4 and values[4] not in (None, '') else 0.0
+    return box + (angle,) if angle else box
+
+
+def load_manifest(manifest_path):
+    """Загружает манифест.
+
+    Возвращает словарь {имя файла: {номер страницы (с 1): [(x1, y1, x2, y2), ...]}}
+    """
+    manifest = {}
+    if manifest_path.lower().endswith('.csv'):
+        with open(manifest_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                box = parse_box([row[key] for key in ('x1', 'y1', 'x2', 'y2')] + [row.get('angle')])
+                page_number = int(row.get('page') or 1)
+                manifest.setdefault(row['file'], {}).setdefault(page_number, []).append(box)
+    else:
+        with open(manifest_path, encoding='utf-8') as f:
+            data = json.load(f)
+        for file_name, pages in data.items():
+            if not isinstance(pages, dict):
+                pages = {1: pages}
+            manifest[file_name] = {
+                int(page_number): [parse_box(box) for box in boxes]
+                for page_number, boxes in pages.items()
+            }
+    return manifest
+
+
+def list_scans(input_dir):
+    """Имена TIFF-файлов в папке"""
+    return sorted(name for name in os.listdir(input_dir) if name.lower().endswith(TIFF_EXTENSIONS))
+
+
+def cut_file(image_path, boxes, output_dir, profile=DEFAULT_PROFILE, detect=False, force=False, duplicates=None,
+             trace=False):
+    """Разрезает один файл (выполняется в рабочем процессе) и возвращает статистику.
+
+    boxes - словарь {номер страницы (с 1): области}. Если boxes равен None,
+    области всех страниц находятся автоматически; с detect=True - и области
+    страниц, которых нет в boxes. С force=True области, которые не изменились
+    с прошлой разрезки, тоже сохраняются заново. duplicates - одно из
+    DUPLICATE_ACTIONS или None: области проверяются на повторы по индексу
+    папки результатов на момент начала файла. Индекс записывает только
+    главный процесс, поэтому хэши сохраненных областей возвращаются в статистике.
+    Журнал замеров тоже пишет главный процесс: замеры этапов возвращаются
+    в статистике (timings); с trace=True файл профилируется.
+    """
+    started = time.perf_counter()
+    if trace:
+        set_trace(True)
+    export = ExportStats(profile, image_path)
+    boxes = boxes or {}
+    with stage(export.timings, 'scan'):
+        pages = scan_pages(image_path)
+    page_boxes = {
+        page: boxes.get(number)
+        for number, page in enumerate(pages, 1)
+        if number in boxes or detect
+    }
+    saved = 0
+    skipped = 0
+    index = None
+    if duplicates:
+        from duplicates import DuplicateIndex
+        index = DuplicateIndex(output_dir, skip=duplicates == 'skip')
+    # Параллельность обеспечивает пул процессов, поэтому внутри файла кодируем в одном потоке
+    with traced(export.timings):
+        for _, _, output_path in cut(image_path, page_boxes, output_dir, profile, export, workers=1,
+                                     incremental=not force, duplicates=index):
+            if output_path is None:
+                skipped += 1
+            else:
+                saved += 1
+    export.timings.extra.update(profile=profile, saved=saved, skipped=skipped, unchanged=export.unchanged,
+                                removed=export.removed, duplicates=export.duplicates, pid=os.getpid())
+    return {
+        'file': image_path,
+        'saved': saved,
+        'skipped': skipped,
+        'seconds': time.perf_counter() - started,
+        'megabytes': os.path.getsize(image_path) / (1024 * 1024),
+        'raw_bytes': export.raw_bytes,
+        'output_bytes': export.output_bytes,
+        'encode_seconds': export.seconds,
+        'unchanged': export.unchanged,
+        'removed': export.removed,
+        'duplicates': export.duplicates,
+        'substituted': export.substituted,
+        'matches': index.take_matches() if index else [],
+        'hashes': index.added() if index else [],
+        'timings': export.timings.finish().as_dict(),
+    }
+
+
+def export_stats(results, profile):
+    """Сводка кодирования по статистикам файлов из cut_file"""
+    export = ExportStats(profile)
+    for stats in results:
+        if stats['saved'] > stats['unchanged']:
+            export.add(stats['raw_bytes'], stats['output_bytes'], stats['encode_seconds'])
+        export.unchanged += stats['unchanged']
+        export.removed += stats['removed']
+        export.duplicates += stats['duplicates']
+        for compression, count in stats['substituted'].items():
+            export.substituted[compression] = export.substituted.get(compression, 0) + count
+    return export
+
+
+def create_pool(workers, tasks_per_child):
+    """Пул процессов; рабочий процесс перезапускается после tasks_per_child файлов,
+    чтобы память, занятая декодерами, не накапливалась"""
+    if tasks_per_child:
+        try:
+            return ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=tasks_per_child)
+        except TypeError:
+            pass  # Python < 3.11 не поддерживает max_tasks_per_child
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def merge_duplicates(index, stats):
+    """Добавляет в общий индекс хэши областей файла и возвращает все найденные для него повторы.
+
+    Рабочий процесс видит индекс на момент начала файла, поэтому повторы среди
+    файлов, которые разрезались одновременно, находятся здесь. С index.skip
+    такие повторы уже сохранены рабочим процессом: их файлы и записи в
+    манифесте разрезки удаляются, а в статистике они считаются пропущенными.
+    """
+    matches = dict(stats['matches'])
+    late = []
+    for name, phash, dhash in stats['hashes']:
+        match = index.check_hashes(name, phash, dhash)
+        if match is not None:
+            matches[name] = match
+            late.append(name)
+    if index.skip and late:
+        manifest = ExportManifest(stats['file'], index.directory)
+        manifest.remove(late)
+        manifest.save()
+        stats['saved'] -= len(late)
+        stats['skipped'] += len(late)
+    index.take_matches()
+    index.save()
+    return sorted(matches.items())
+
+
+def run_batch(input_dir, manifest, output_dir, workers=None, tasks_per_child=None, profile=DEFAULT_PROFILE,
+              detect=False, force=False, duplicates=None, trace=False):
+    """Разрезает все файлы манифеста. Возвращает список статистик и список ошибок"""
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    errors = []
+    index = None
+    if duplicates:
+        from duplicates import DuplicateIndex
+        index = DuplicateIndex(output_dir, skip=duplicates == 'skip')
+
+    with create_pool(workers, tasks_per_child) as pool:
+        futures = {
+            pool.submit(cut_file, os.path.join(input_dir, file_name), boxes, output_dir, profile, detect, force,
+                        duplicates, trace): file_name
+            for file_name, boxes in manifest.items()
+        }
+        for future in as_completed(futures):
+            file_name = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                errors.append((file_name, str(e)))
+                print(f"Ошибка: {file_name}: {e}", file=sys.stderr)
+                continue
+
+            if index is not None:
+                stats['matches'] = merge_duplicates(index, stats)
+                stats['duplicates'] = len(stats['matches'])
+                for name, match in stats['matches']:
+                    print(f"{name}: повтор {match}")
+                stats['timings'].update(saved=stats['saved'], skipped=stats['skipped'])
+            stats['timings']['duplicates'] = stats['duplicates']
+            log_timings(stats['timings'])
+            results.append(stats)
+            speed = stats['megabytes'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+            export = export_stats([stats], profile)
+            print(f"{file_name}: сохранено {stats['saved']}, пропущено {stats['skipped']}, "
+                  f"{stats['seconds']:.2f} с, {speed:.1f} МБ/с ({export.summary()})")
+    return results, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная разрезка сканированных TIFF-изображений")
+    parser.add_argument('input_dir', help="папка со сканами")
+    parser.add_argument('manifest', nargs='?', help="манифест областей (JSON или CSV)")
+    parser.add_argument('--detect', action='store_true',
+                        help="искать фотографии автоматически на файлах и страницах, которых нет в манифесте")
+    parser.add_argument('-o', '--output', help="папка для результатов (по умолчанию папка со сканами)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="число рабочих процессов (по умолчанию число ядер)")
+    parser.add_argument('--tasks-per-child', type=int, default=8,
+                        help="перезапускать рабочий процесс после указанного числа файлов (0 - не перезапускать)")
+    parser.add_argument('--profile', choices=list(OUTPUT_PROFILES), default=DEFAULT_PROFILE,
+                        help=f"формат и сжатие результатов (по умолчанию {DEFAULT_PROFILE})")
+    parser.add_argument('--force', action='store_true',
+                        help="сохранить заново и те области, которые не изменились с прошлого запуска")
+    parser.add_argument('--duplicates', choices=DUPLICATE_ACTIONS,
+                        help="искать повторы уже вырезанных фотографий: mark - только вывести, skip - не сохранять")
+    parser.add_argument('--trace', action='store_true',
+                        help="профилировать каждый файл (cProfile и tracemalloc) и записать итог в журнал замеров")
+    args = parser.parse_args(argv)
+
+    if not args.manifest and not args.detect:
+        parser.error("укажите манифест или флаг --detect")
+
+    manifest = load_manifest(args.manifest) if args.manifest else {}
+    if args.detect:
+        for file_name in list_scans(args.input_dir):
+            manifest.setdefault(file_name, None)
+    output_dir = args.output or args.input_dir
+
+    started = time.perf_counter()
+    results, errors = run_batch(args.input_dir, manifest, output_dir, args.workers, args.tasks_per_child,
+                                args.profile, args.detect, args.force, args.duplicates, args.trace)
+    elapsed = time.perf_counter() - started
+
+    saved = sum(stats['saved'] for stats in results)
+    megabytes = sum(stats['megabytes'] for stats in results)
+    export = export_stats(results, args.profile)
+    print(f"Готово: файлов {len(results)}, областей {saved}, ошибок {len(errors)}, "
+          f"{elapsed:.2f} с, {megabytes / elapsed if elapsed > 0 else 0.0:.1f} МБ/с")
+    print(f"Кодирование {export.summary()}")
+    print(f"Замеры этапов: {os.path.join(default_log_dir(), TIMINGS_LOG_NAME)}")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
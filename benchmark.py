@@ -0,0 +1,461 @@
+"""Замеры производительности загрузки, предпросмотра, поиска фотографий и разрезки.
+
+Работает без дисплея. Генерирует синтетические сканы разных размеров, режимов,
+раскладок (полосы/тайлы) и сжатия, замеряет время и пиковую память каждого
+этапа и сохраняет результаты в JSON, который можно сравнить с прошлым запуском.
+
+Каждый этап выполняется в отдельном процессе, поэтому пиковая память (RSS)
+относится только к нему. Этап export сохраняет все области заново, reexport -
+повторная разрезка без изменений, когда все файлы областей уже актуальны.
+Для предпросмотра и разрезки в результатах есть и разбивка времени по этапам
+(breakdown: декодирование, кодирование, запись и т. д., см. instrumentation.py).
+
+С --verify вместо замеров проверяется, что вырезанные области (в том числе
+повернутые, 1-битные и из файлов с порядком байт MM) совпадают с исходными пикселями
+байт в байт и сохраняют ICC-профиль, разрешение и теги.
+
+Пример:
+    python benchmark.py --sizes A4@300,A3@600 --modes RGB,L -o before.json
+    python benchmark.py --sizes A4@300,A3@600 --modes RGB,L -o after.json --compare before.json
+    python benchmark.py --verify --sizes A4@100 --modes RGB,L,1,I;16,I;16B,RGB;16,CMYK --compressions none,lzw,deflate
+    python benchmark.py --stages export --profiles lzw,deflate,zstd,none,fastest,jpeg,webp
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from instrumentation import StageTimings, peak_rss_mb
+
+# Размеры бумаги в миллиметрах (ширина, высота)
+PAPER_SIZES_MM = {
+    'A4': (210, 297),
+    'A3': (297, 420),
+}
+
+# I;16B - 16-битные оттенки серого с порядком байт MM (big-endian)
+MODES = ('RGB', 'L', '1', 'I;16', 'I;16B', 'RGB;16', 'CMYK')
+LAYOUTS = ('strip', 'tile')
+COMPRESSIONS = ('none', 'lzw', 'deflate')
+STAGES = ('load', 'preview', 'detect', 'export', 'reexport')
+
+# Этапы, которые сохраняют области и замеряются для каждого профиля
+EXPORT_STAGES = ('export', 'reexport')
+
+# Сжатие в терминах tifffile
+TIFFFILE_COMPRESSION = {
+    'none': None,
+    'lzw': 'lzw',
+    'deflate': 'zlib',
+}
+
+# Цвет фона сканера
+BACKGROUND = 235
+
+# Описательные теги синтетического скана: Make, Model, Software, DateTime, Artist
+SCAN_TAGS = {
+    271: 'EPSON',
+    272: 'Perfection V850',
+    305: 'EPSON Scan',
+    306: '2024:05:01 12:00:00',
+    315: 'Archive',
+}
+
+# Теги, которые должны перейти из оригинала в вырезанные области
+VERIFIED_TAGS = (282, 283, 296, 34675) + tuple(SCAN_TAGS)
+
+
+def scan_size(paper, dpi):
+    """Размер скана в пикселях для формата бумаги и разрешения"""
+    width_mm, height_mm = PAPER_SIZES_MM[paper]
+    return round(width_mm / 25.4 * dpi), round(height_mm / 25.4 * dpi)
+
+
+def photo_boxes(size):
+    """Четыре фотографии 2x2 с полями - как на типичном скане"""
+    width, height = size
+    margin_x, margin_y = width // 20, height // 20
+    cell_w, cell_h = (width - 3 * margin_x) // 2, (height - 3 * margin_y) // 2
+    return [
+        (margin_x + col * (cell_w + margin_x), margin_y + row * (cell_h + margin_y),
+         margin_x + col * (cell_w + margin_x) + cell_w, margin_y + row * (cell_h + margin_y) + cell_h)
+        for row in range(2) for col in range(2)
+    ]
+
+
+def synthetic_scan(size, seed=0):
+    """RGB-массив скана: светлый фон с шумом и плавные «фотографии»"""
+    import cv2
+    import numpy as np
+
+    width, height = size
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), BACKGROUND, dtype=np.uint8)
+    for x1, y1, x2, y2 in photo_boxes(size):
+        # Плавная текстура: растянутый мелкий шум плюс немного зерна
+        small = rng.integers(0, 256, (max(2, (y2 - y1) // 64), max(2, (x2 - x1) // 64), 3), dtype=np.uint8)
+        photo = cv2.resize(small, (x2 - x1, y2 - y1), interpolation=cv2.INTER_CUBIC)
+        grain = rng.integers(-8, 9, photo.shape[:2], dtype=np.int16)[..., np.newaxis]
+        image[y1:y2, x1:x2] = np.clip(photo.astype(np.int16) + grain, 0, 255).astype(np.uint8)
+    return image
+
+
+def scan_icc_profile():
+    """ICC-профиль sRGB для синтетических сканов"""
+    from PIL import ImageCms
+
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+
+
+def write_scan(path, size, mode, layout, compression, dpi=300):
+    """Создает синтетический скан в TIFF нужного режима, раскладки и сжатия"""
+    import numpy as np
+    import tifffile
+
+    rgb = synthetic_scan(size)
+    if mode == 'RGB':
+        data, photometric = rgb, 'rgb'
+    elif mode == 'L':
+        data, photometric = rgb.mean(axis=2).astype(np.uint8), 'minisblack'
+    elif mode == '1':
+        data, photometric = rgb.mean(axis=2) > 127, 'minisblack'
+    elif mode in ('I;16', 'I;16B'):
+        data, photometric = (rgb.mean(axis=2) * 257).astype(np.uint16), 'minisblack'
+    elif mode == 'RGB;16':
+        data, photometric = rgb.astype(np.uint16) * 257 + np.arange(3, dtype=np.uint16), 'rgb'
+    elif mode == 'CMYK':
+        cmy = 255 - rgb
+        black = cmy.min(axis=2, keepdims=True)
+        data, photometric = np.concatenate([cmy - black, black], axis=2), 'separated'
+    else:
+        raise ValueError(f"Неизвестный режим: {mode}")
+
+    icc_profile = scan_icc_profile()
+    if mode == '1' and compression != 'none':
+        # tifffile не сжимает 1-битные изображения: такие сканы пишет libtiff через PIL (только полосами)
+        write_bilevel_scan(path, data, compression, dpi, icc_profile)
+        return
+    options = {
+        'photometric': photometric,
+        'compression': TIFFFILE_COMPRESSION[compression],
+        'resolution': (dpi, dpi),
+        'resolutionunit': 'INCH',
+        'software': SCAN_TAGS[305],
+        'datetime': SCAN_TAGS[306],
+        'metadata': None,
+        'byteorder': '>' if mode == 'I;16B' else '<',
+        'extratags': [(tag, 's', 0, SCAN_TAGS[tag], True) for tag in (271, 272, 315)]
+                     + [(34675, 'B', len(icc_profile), icc_profile, True)],
+    }
+    if compression != 'none' and data.dtype == np.uint8:
+        options['predictor'] = False
+    if layout == 'tile':
+        options['tile'] = (256, 256)
+    else:
+        options['rowsperstrip'] = max(1, 65536 // (data.shape[1] * (data.shape[2] if data.ndim == 3 else 1) * data.itemsize))
+    tifffile.imwrite(path, data, **options)
+
+
+def write_bilevel_scan(path, data, compression, dpi, icc_profile):
+    """Сохраняет сжатый 1-битный скан через PIL с теми же тегами, что write_scan"""
+    from PIL import Image, TiffImagePlugin, TiffTags
+
+    tiffinfo = TiffImagePlugin.ImageFileDirectory_v2()
+    for tag, value in SCAN_TAGS.items():
+        tiffinfo[tag] = value
+    tiffinfo[34675] = icc_profile
+    tiffinfo.tagtype[34675] = TiffTags.UNDEFINED
+    Image.fromarray(data).save(path, format='TIFF', dpi=(dpi, dpi), tiffinfo=tiffinfo,
+                               compression={'lzw': 'tiff_lzw', 'deflate': 'tiff_adobe_deflate'}[compression])
+
+
+def in_subprocess(function, *args):
+    """Выполняет функцию в новом процессе.
+
+    Linux сохраняет пиковый RSS родителя в дочернем процессе, поэтому
+    основной процесс не держит больших массивов: сканы тоже создаются здесь.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(function, *args).result()
+
+
+def stage_key(stage, profile):
+    """Ключ этапа в результатах: разрезка с профилем не по умолчанию - export:<профиль>"""
+    from cutting import DEFAULT_PROFILE
+
+    return stage if stage not in EXPORT_STAGES or profile == DEFAULT_PROFILE else f"{stage}:{profile}"
+
+
+def run_stage(stage, path, boxes, output_dir, profile=None):
+    """Выполняет один этап в рабочем процессе и возвращает время и память"""
+    from cutting import DEFAULT_PROFILE, ExportStats
+    from detection import detect_photos
+    from engine import cut, load_page
+    from region_reader import RegionReader
+
+    # Для поиска фотографий нужен предпросмотр; его построение в замер не входит
+    preview = load_page(path, detect=False).preview if stage == 'detect' else None
+    if stage == 'reexport':
+        # Первая разрезка создает файлы областей и манифест; замеряется повторная
+        for _ in cut(path, boxes, output_dir, profile=profile or DEFAULT_PROFILE):
+            pass
+    rss_before = peak_rss_mb()
+    export = ExportStats(profile or DEFAULT_PROFILE, path)
+    timings = export.timings if stage in EXPORT_STAGES else StageTimings('load', path)
+
+    started = time.perf_counter()
+    if stage == 'load':
+        with RegionReader(path) as reader:
+            reader.size
+    elif stage == 'preview':
+        load_page(path, detect=False, timings=timings)
+    elif stage == 'detect':
+        detect_photos(preview)
+    elif stage in EXPORT_STAGES:
+        for _ in cut(path, boxes, output_dir, profile=export.profile, stats=export, incremental=stage == 'reexport'):
+            pass
+    seconds = time.perf_counter() - started
+
+    result = {'seconds': seconds, 'rss_before_mb': rss_before, 'peak_rss_mb': peak_rss_mb()}
+    if timings.stages:
+        result['breakdown'] = timings.as_dict()['stages']
+    if export.count or export.unchanged:
+        result.update({'encode_mb_s': export.megabytes_per_second, 'ratio': export.ratio,
+                       'summary': export.summary()})
+    return result
+
+
+def measure(stage, path, boxes, output_dir, repeat, profile=None):
+    """Лучшее время и наибольшая пиковая память за repeat запусков в отдельных процессах"""
+    runs = [in_subprocess(run_stage, stage, path, boxes, output_dir, profile) for _ in range(repeat)]
+    peaks = [run['peak_rss_mb'] for run in runs if run['peak_rss_mb'] is not None]
+    befores = [run['rss_before_mb'] for run in runs if run['rss_before_mb'] is not None]
+    best = min(runs, key=lambda run: run['seconds'])
+    result = {
+        'seconds': best['seconds'],
+        'peak_rss_mb': max(peaks) if peaks else None,
+        'stage_rss_mb': max(peak - before for peak, before in zip(peaks, befores)) if peaks and befores else None,
+    }
+    for key in ('encode_mb_s', 'ratio', 'summary', 'breakdown'):
+        if key in best:
+            result[key] = best[key]
+    return result
+
+
+def verify_case(path, boxes, output_dir, profile=None):
+    """Сравнивает вырезанные области с оригиналом; возвращает список расхождений"""
+    import numpy as np
+    import tifffile
+    from engine import cut
+
+    def short(value):
+        return f"<{len(value)} байт>" if isinstance(value, bytes) else repr(value)
+
+    def tag_values(tiff):
+        tags = tiff.pages[0].tags
+        return {code: tags[code].value for code in VERIFIED_TAGS if code in tags}
+
+    problems = []
+    with tifffile.TiffFile(path) as tiff:
+        source = tiff.asarray()
+        source_tags = tag_values(tiff)
+
+    for _, i, output_path in cut(path, boxes, output_dir, incremental=False,
+                                 **({'profile': profile} if profile else {})):
+        x1, y1, x2, y2 = boxes[i - 1][:4]
+        with tifffile.TiffFile(output_path) as tiff:
+            region = tiff.asarray()
+            region_tags = tag_values(tiff)
+
+        expected = source[y1:y2, x1:x2]
+        if boxes[i - 1][4:] == (180.0,):
+            # Выпрямленная область, повернутая на 180 градусов, - исходная область вверх ногами
+            expected = expected[::-1, ::-1]
+        if region.dtype != expected.dtype or region.shape != expected.shape:
+            problems.append(f"область {i}: {region.dtype}{region.shape} вместо {expected.dtype}{expected.shape}")
+        elif not np.array_equal(region, expected):
+            problems.append(f"область {i}: пиксели отличаются")
+        for code, value in source_tags.items():
+            if region_tags.get(code) != value:
+                problems.append(f"область {i}: тег {code} = {short(region_tags.get(code))} вместо {short(value)}")
+    return problems
+
+
+def run_verification(sizes, modes, layouts, compressions, profiles, workdir):
+    """Матрица проверок сохранения областей без изменений; возвращает число ошибок"""
+    failures = 0
+    for size_name in sizes:
+        paper, dpi = size_name.split('@')
+        size = scan_size(paper, int(dpi))
+        # Кроме фотографий - область, которая начинается и кончается внутри полос и тайлов,
+        # и повернутая на 180 градусов: ее выпрямление не должно сдвигать и интерполировать пиксели
+        boxes = photo_boxes(size) + [(13, 17, min(size[0], 13 + 301), min(size[1], 17 + 211)),
+                                     (41, 37, min(size[0], 41 + 257), min(size[1], 37 + 189), 180.0)]
+
+        for mode in modes:
+            for layout in layouts:
+                for compression in compressions:
+                    path = os.path.join(workdir, f"verify_{mode.replace(';', '')}_{layout}_{compression}.tif")
+                    write_scan(path, size, mode, layout, compression, dpi=int(dpi))
+                    output_dir = tempfile.mkdtemp(dir=workdir)
+
+                    # 1-битные области при выпрямлении переводятся в RGB (см. cutting.read_rotated_region)
+                    mode_boxes = [box for box in boxes if mode != '1' or not box[4:]]
+                    for profile in profiles:
+                        case = f"{size_name} {mode} {layout} {compression} -> {profile}"
+                        try:
+                            problems = verify_case(path, mode_boxes, output_dir, profile)
+                        except Exception as e:
+                            # Ошибка сохранения - тоже расхождение: остальные сочетания проверяются дальше
+                            problems = [f"не удалось сохранить: {e}"]
+                        print(f"{case:44} {'ошибка' if problems else 'ок'}")
+                        for problem in problems:
+                            print(f"    {problem}")
+                        failures += bool(problems)
+
+                    os.remove(path)
+                    shutil.rmtree(output_dir, ignore_errors=True)
+    return failures
+
+
+def code_version():
+    """Текущий коммит git, если он доступен"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, modes, layouts, compressions, stages, profiles, repeat, workdir):
+    results = []
+    for size_name in sizes:
+        paper, dpi = size_name.split('@')
+        size = scan_size(paper, int(dpi))
+        boxes = photo_boxes(size)
+
+        for mode in modes:
+            for layout in layouts:
+                for compression in compressions:
+                    case = f"{size_name} {mode} {layout} {compression}"
+                    path = os.path.join(workdir, f"scan_{paper}_{dpi}_{mode.replace(';', '')}_{layout}_{compression}.tif")
+                    in_subprocess(write_scan, path, size, mode, layout, compression)
+                    output_dir = tempfile.mkdtemp(dir=workdir)
+
+                    result = {
+                        'case': case, 'paper': paper, 'dpi': int(dpi), 'width': size[0], 'height': size[1],
+                        'mode': mode, 'layout': layout, 'compression': compression,
+                        'file_mb': os.path.getsize(path) / (1024 * 1024), 'stages': {},
+                    }
+                    for stage in stages:
+                        for profile in (profiles if stage in EXPORT_STAGES else [None]):
+                            key = stage_key(stage, profile) if profile else stage
+                            result['stages'][key] = stats = measure(stage, path, boxes, output_dir, repeat, profile)
+                            memory = f", пик {stats['peak_rss_mb']:.0f} МБ" if stats['peak_rss_mb'] is not None else ""
+                            summary = f", {stats['summary']}" if 'summary' in stats else ""
+                            print(f"{case:32} {key:14} {stats['seconds']:8.3f} с{memory}{summary}")
+
+                    results.append(result)
+                    os.remove(path)
+                    shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline_path):
+    """Печатает отношение времени к прошлому запуску (меньше 1 - быстрее)"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {result['case']: result for result in json.load(f)['results']}
+
+    print(f"\nСравнение с {baseline_path} (время сейчас / время раньше):")
+    for result in results:
+        old = baseline.get(result['case'])
+        if old is None:
+            continue
+        ratios = []
+        for stage, stats in result['stages'].items():
+            old_stats = old['stages'].get(stage)
+            if old_stats and old_stats['seconds'] > 0:
+                ratios.append(f"{stage} {stats['seconds'] / old_stats['seconds']:.2f}x")
+        print(f"{result['case']:32} " + ", ".join(ratios))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности на синтетических сканах")
+    parser.add_argument('--sizes', default='A4@300,A3@300',
+                        help="форматы и разрешения через запятую, например A4@300,A3@1200")
+    parser.add_argument('--modes', default='RGB,L', help=f"режимы через запятую ({', '.join(MODES)})")
+    parser.add_argument('--layouts', default='strip,tile', help=f"раскладки через запятую ({', '.join(LAYOUTS)})")
+    parser.add_argument('--compressions', default='none,lzw',
+                        help=f"сжатие через запятую ({', '.join(COMPRESSIONS)})")
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"этапы через запятую ({', '.join(STAGES)})")
+    parser.add_argument('--profiles', default='lzw',
+                        help="профили сохранения для этапа export и проверки через запятую (см. cutting.OUTPUT_PROFILES)")
+    parser.add_argument('--repeat', type=int, default=1, help="сколько раз повторять каждый замер")
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help="файл для результатов")
+    parser.add_argument('--compare', help="файл результатов прошлого запуска для сравнения")
+    parser.add_argument('--workdir', help="папка для временных файлов (по умолчанию системная)")
+    parser.add_argument('--verify', action='store_true',
+                        help="вместо замеров проверить, что области сохраняются без изменений пикселей и тегов")
+    args = parser.parse_args(argv)
+
+    def split(value, allowed=None):
+        items = [item.strip() for item in value.split(',') if item.strip()]
+        for item in items:
+            if allowed is not None and item not in allowed:
+                parser.error(f"недопустимое значение: {item}")
+        return items
+
+    sizes = split(args.sizes)
+    for size_name in sizes:
+        paper, _, dpi = size_name.partition('@')
+        if paper not in PAPER_SIZES_MM or not dpi.isdigit():
+            parser.error(f"недопустимый формат: {size_name}")
+
+    from cutting import OUTPUT_PROFILES
+
+    profiles = split(args.profiles, OUTPUT_PROFILES)
+    if args.verify and any(OUTPUT_PROFILES[profile]['format'] != 'TIFF' for profile in profiles):
+        parser.error("проверять можно только профили TIFF: JPEG и WebP сохраняют области с потерями")
+
+    workdir = tempfile.mkdtemp(prefix='photo_cutter_bench_', dir=args.workdir)
+    if args.verify:
+        try:
+            failures = run_verification(sizes, split(args.modes, MODES), split(args.layouts, LAYOUTS),
+                                        split(args.compressions, COMPRESSIONS), profiles, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        print(f"\nНе прошли проверку: {failures}" if failures else "\nВсе области совпадают с оригиналом")
+        sys.exit(1 if failures else 0)
+
+    try:
+        results = run_benchmarks(sizes, split(args.modes, MODES), split(args.layouts, LAYOUTS),
+                                 split(args.compressions, COMPRESSIONS), split(args.stages, STAGES),
+                                 profiles, args.repeat, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'version': code_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,839 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import nullcontext
+
+from instrumentation import StageTimings, TimedFile, stage
+
+# Расширения файлов сканов
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+
+# Области меньше этого размера (в пикселях оригинала) не сохраняются
+MIN_REGION_SIZE = 10
+
+# Повернутая область - (x1, y1, x2, y2, угол): прямоугольник (x1, y1, x2, y2),
+# повернутый на угол в градусах против часовой стрелки вокруг своего центра.
+# Интерполяция при выпрямлении повернутых областей (cv2.INTER_CUBIC)
+ROTATION_INTERPOLATION = 2
+
+# Теги TIFF, которые нужны для переноса метаданных
+TAG_IMAGE_DESCRIPTION = 270
+TAG_X_RESOLUTION = 282
+TAG_Y_RESOLUTION = 283
+TAG_RESOLUTION_UNIT = 296
+TAG_PREDICTOR = 317
+TAG_ICC_PROFILE = 34675
+
+# Теги, которые переносятся в области: описание, сканер, программа, дата,
+# автор, авторские права, разрешение, ориентация, XMP, ресурсы Photoshop и ICC.
+# Остальные относятся к раскладке файла или ко всему скану, а произвольные
+# теги (например, IPTC типа LONG) PIL с libtiff записывает с ошибками
+COPIED_TAGS = {
+    269, 270, 271, 272, 274, 282, 283, 285, 296, 305, 306, 315, 316,
+    700, 33432, 34377, 34675,
+}
+
+# Профили сохранения областей. Для TIFF compression - кодек tifffile, level - его уровень;
+# predictor - горизонтальный предиктор, который заметно улучшает сжатие фотографий.
+# JPEG и WebP - 8-битные копии для просмотра, modes - режимы, которые они принимают
+OUTPUT_PROFILES = {
+    'lzw': {'title': "TIFF LZW", 'format': 'TIFF', 'extension': '.tiff',
+            'compression': 'lzw', 'level': None, 'predictor': True},
+    'deflate': {'title': "TIFF Deflate", 'format': 'TIFF', 'extension': '.tiff',
+                'compression': 'zlib', 'level': 6, 'predictor': True},
+    'zstd': {'title': "TIFF ZSTD", 'format': 'TIFF', 'extension': '.tiff',
+             'compression': 'zstd', 'level': 5, 'predictor': True},
+    'none': {'title': "TIFF без сжатия", 'format': 'TIFF', 'extension': '.tiff',
+             'compression': None, 'level': None, 'predictor': False},
+    'fastest': {'title': "Самый быстрый (TIFF ZSTD 1)", 'format': 'TIFF', 'extension': '.tiff',
+                'compression': 'zstd', 'level': 1, 'predictor': True},
+    'jpeg': {'title': "JPEG (для просмотра)", 'format': 'JPEG', 'extension': '.jpg',
+             'modes': ('L', 'RGB', 'CMYK'), 'options': {'quality': 95, 'subsampling': 0}},
+    'webp': {'title': "WebP (для просмотра)", 'format': 'WEBP', 'extension': '.webp',
+             'modes': ('RGB', 'RGBA'), 'options': {'quality': 90, 'method': 4}},
+}
+
+DEFAULT_PROFILE = 'lzw'
+
+# Сжатие TIFF в PIL для кодеков tifffile
+PIL_COMPRESSION = {None: 'raw', 'lzw': 'tiff_lzw', 'zlib': 'tiff_adobe_deflate'}
+
+# Названия кодеков tifffile в сводке, когда область сжата не кодеком профиля
+COMPRESSION_TITLES = {None: "без сжатия", 'lzw': "LZW", 'zlib': "Deflate", 'zstd': "ZSTD"}
+
+# Раскладка режимов для tifffile: фотометрическая интерпретация и дополнительные каналы
+TIFFFILE_LAYOUTS = {
+    'L': ('minisblack', None),
+    'I;16': ('minisblack', None),
+    'RGB': ('rgb', None),
+    'RGB;16': ('rgb', None),
+    'RGBA': ('rgb', (2,)),
+    'CMYK': ('separated', None),
+}
+
+# Режимы PIL, для которых libtiff применяет горизонтальный предиктор: 8, 16 и 32 бита
+# на канал. У 1-битных изображений libtiff его не поддерживает, а у палитры он бесполезен
+PREDICTOR_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK', 'I;16', 'I;16B', 'I', 'F')
+
+# Байт на пиксель для режимов PIL, где это не число каналов
+MODE_BYTES = {'1': 1, 'I;16': 2, 'I;16B': 2, 'I': 4, 'F': 4}
+
+# Примерный размер полосы сжатого TIFF
+OUTPUT_STRIP_BYTES = 256 * 1024
+
+# Типы тегов TIFF (BYTE, ASCII, SHORT, LONG, UNDEFINED) в обозначениях tifffile
+TIFFFILE_DTYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 7: 'B'}
+
+# Файл в папке результатов, по которому повторная разрезка пропускает неизменившиеся области:
+# <название_оригинала>_cutted.json
+EXPORT_MANIFEST_SUFFIX = '_cutted.json'
+
+# Версия ключей областей; меняется, если меняется содержимое сохраняемых файлов
+EXPORT_MANIFEST_VERSION = 1
+
+
+def output_filename(image_path, index, profile=DEFAULT_PROFILE, page_number=None):
+    """Имя выходного файла для области с номером index (нумерация с 1).
+
+    page_number - номер страницы многостраничного TIFF (с 1); для
+    одностраничных файлов не указывается, и имя остается прежним.
+    """
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    if page_number is not None:
+        base_name = f"{base_name}_p{page_number}"
+    return f"{base_name}_cutted_{index}{OUTPUT_PROFILES[profile]['extension']}"
+
+
+def preview_to_original(box, original_size, preview_size):
+    """Переводит область из координат предпросмотра в координаты оригинала; угол не меняется"""
+    scale_x = original_size[0] / preview_size[0]
+    scale_y = original_size[1] / preview_size[1]
+    x1, y1, x2, y2 = box[:4]
+    return (int(x1 * scale_x), int(y1 * scale_y), int(x2 * scale_x), int(y2 * scale_y)) + tuple(box[4:])
+
+
+def original_to_preview(box, original_size, preview_size):
+    """Переводит область из координат оригинала в координаты предпросмотра; угол не меняется"""
+    scale_x = preview_size[0] / original_size[0]
+    scale_y = preview_size[1] / original_size[1]
+    x1, y1, x2, y2 = box[:4]
+    return (round(x1 * scale_x), round(y1 * scale_y), round(x2 * scale_x), round(y2 * scale_y)) + tuple(box[4:])
+
+
+def box_angle(box):
+    """Угол поворота области в градусах; 0 для обычной области (x1, y1, x2, y2)"""
+    return box[4] if len(box) > 4 else 0.0
+
+
+def rotated_corners(box):
+    """Углы повернутой области в координатах оригинала (по часовой стрелке от левого верхнего)"""
+    x1, y1, x2, y2 = box[:4]
+    angle = math.radians(box_angle(box))
+    cos, sin = math.cos(angle), math.sin(angle)
+    center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+    corners = []
+    for x, y in ((x1, y1), (x2, y1), (x2, y2), (x1, y2)):
+        dx, dy = x - center_x, y - center_y
+        # Ось y направлена вниз, поэтому поворот против часовой стрелки на экране
+        corners.append((center_x + dx * cos + dy * sin, center_y - dx * sin + dy * cos))
+    return corners
+
+
+def bounding_box(box):
+    """Наименьшая область (x1, y1, x2, y2) с целыми координатами, содержащая повернутую область"""
+    corners = rotated_corners(box)
+    xs = [x for x, _ in corners]
+    ys = [y for _, y in corners]
+    return (math.floor(min(xs)), math.floor(min(ys)), math.ceil(max(xs)), math.ceil(max(ys)))
+
+
+def clamp_box(box, size):
+    """Ограничивает область (x1, y1, x2, y2) размерами изображения.
+
+    Повернутая область не обрезается: выходящие за край скана углы
+    заполняются краевыми пикселями при выпрямлении. Она отбрасывается,
+    только если слишком мала или не пересекает изображение.
+    Возвращает None, если область получилась слишком маленькой.
+    """
+    if box_angle(box):
+        x1, y1, x2, y2 = box[:4]
+        if x2 - x1 < MIN_REGION_SIZE or y2 - y1 < MIN_REGION_SIZE:
+            return None
+        if clamp_box(bounding_box(box), size) is None:
+            return None
+        return tuple(box)
+
+    x1, y1, x2, y2 = box[:4]
+    width, height = size
+
+    x1 = max(0, min(x1, width - 1))
+    y1 = max(0, min(y1, height - 1))
+    x2 = max(0, min(x2, width))
+    y2 = max(0, min(y2, height))
+
+    if x2 - x1 < MIN_REGION_SIZE or y2 - y1 < MIN_REGION_SIZE:
+        return None
+    return (x1, y1, x2, y2)
+
+
+def is_layout_description(description):
+    """Описывает ли ImageDescription раскладку всего файла, а не снимок.
+
+    tifffile записывает туда по умолчанию JSON с формой массива
+    ({"shape": [...]}), ImageJ - число кадров и каналов. В области такое
+    описание не подходит: tifffile при чтении сверяет его с размером страницы.
+    """
+    text = str(description).strip()
+    if text.startswith('ImageJ='):
+        return True
+    if not text.startswith('{'):
+        return False
+    try:
+        metadata = json.loads(text)
+    except ValueError:
+        return False
+    return isinstance(metadata, dict) and 'shape' in metadata
+
+
+def source_tags(image):
+    """Теги оригинала, которые переносятся в вырезанные области.
+
+    Сохраняются ICC-профиль, разрешение и описательные теги TIFF (сканер,
+    программа, дата, автор и т.п.); служебное описание раскладки tifffile
+    и ImageJ не переносится. Для других форматов берутся ICC-профиль
+    и разрешение из image.info.
+    """
+    from PIL import TiffImagePlugin
+
+    tags = TiffImagePlugin.ImageFileDirectory_v2()
+    source = getattr(image, 'tag_v2', None)
+    if source is not None:
+        for tag, value in source.items():
+            if tag == TAG_IMAGE_DESCRIPTION and is_layout_description(value):
+                continue
+            if tag in COPIED_TAGS:
+                tags[tag] = value
+                tags.tagtype[tag] = source.tagtype[tag]
+        return tags
+
+    if image.info.get('icc_profile'):
+        tags[TAG_ICC_PROFILE] = image.info['icc_profile']
+    if 'dpi' in image.info:
+        tags[TAG_RESOLUTION_UNIT] = 2
+        tags[TAG_X_RESOLUTION], tags[TAG_Y_RESOLUTION] = image.info['dpi']
+    return tags
+
+
+def read_export_region(reader, box, timings=None, as_array=False):
+    """Область для сохранения в исходной разрядности: (область, режим).
+
+    Обычно это PIL-изображение в режиме оригинала; для режимов, которых нет
+    в PIL (RGB с 16 битами на канал), - массив с исходными значениями.
+    С as_array (область будет записана через tifffile, см. uses_tifffile)
+    массивом отдаются все режимы из TIFFFILE_LAYOUTS: у несжатого скана это
+    срез отображенного файла без копирования и без PIL.
+    Повернутые области выпрямляются (см. read_rotated_region).
+    В timings (StageTimings), если он передан, замеряется декодирование.
+    """
+    if box_angle(box):
+        return read_rotated_region(reader, box, timings, as_array)
+    with stage(timings, 'decode'):
+        region = None
+        if reader.file_mode != reader.mode or (as_array and reader.file_mode in TIFFFILE_LAYOUTS):
+            region = reader.read_array(box)
+        if region is None:
+            region = reader.read_region(box)
+    if timings is not None:
+        timings.count_bytes('decode', region_nbytes(region))
+    return region, region.mode if hasattr(region, 'save') else reader.file_mode
+
+
+def read_rotated_region(reader, box, timings=None, as_array=False):
+    """Выпрямленная повернутая область за одно аффинное преобразование.
+
+    Декодируется только описанный вокруг области прямоугольник, и
+    cv2.warpAffine сразу пишет выпрямленные пиксели в выходной буфер размером
+    с область. Разрядность и режим оригинала сохраняются; режимы, которые
+    OpenCV не поворачивает (палитра, 1 и 32 бита на пиксель), переводятся в RGB.
+    Возвращает (область, режим), как read_export_region.
+    """
+    import cv2
+    import numpy as np
+    from region_reader import array_to_image
+
+    x1, y1, x2, y2 = box[:4]
+    left, top, right, bottom = clamp_box(bounding_box(box), reader.size)
+
+    mode = reader.file_mode
+    with stage(timings, 'decode'):
+        array = reader.read_array((left, top, right, bottom))
+        if array is None:
+            region = reader.read_region((left, top, right, bottom))
+    if array is None:
+        mode = region.mode
+        if timings is not None:
+            timings.count_bytes('decode', region_nbytes(region))
+        with stage(timings, 'convert'):
+            if mode == 'I;16B':
+                # 16-битные оттенки серого с порядком байт MM: ниже массив переводится в родной порядок
+                mode = 'I;16'
+            elif mode not in ('L', 'LA', 'RGB', 'RGBA', 'CMYK', 'I;16'):
+                region, mode = region.convert('RGB'), 'RGB'
+            array = np.asarray(region)
+    elif timings is not None:
+        timings.count_bytes('decode', array.nbytes)
+    if not array.dtype.isnative:
+        with stage(timings, 'convert'):
+            array = array.astype(array.dtype.newbyteorder('='))
+
+    # Центр области переходит в центр выходного буфера, и она поворачивается обратно.
+    # У OpenCV координаты пикселя - его центр, поэтому центр области на полпикселя левее и выше
+    center = ((x1 + x2 - 1) / 2 - left, (y1 + y2 - 1) / 2 - top)
+    matrix = cv2.getRotationMatrix2D(center, -box_angle(box), 1.0)
+    matrix[0, 2] += (x2 - x1 - 1) / 2 - center[0]
+    matrix[1, 2] += (y2 - y1 - 1) / 2 - center[1]
+
+    output = np.empty((y2 - y1, x2 - x1) + array.shape[2:], dtype=array.dtype)
+    with stage(timings, 'rotate'):
+        cv2.warpAffine(array, matrix, (x2 - x1, y2 - y1), dst=output,
+                       flags=ROTATION_INTERPOLATION, borderMode=cv2.BORDER_REPLICATE)
+    if mode == 'RGB;16' or (as_array and mode in TIFFFILE_LAYOUTS):
+        return output, mode
+    return array_to_image(output, mode), mode
+
+
+def region_nbytes(region):
+    """Объем несжатых пикселей области в байтах"""
+    if not hasattr(region, 'save'):
+        return region.nbytes
+    return region.width * region.height * MODE_BYTES.get(region.mode, len(region.getbands()))
+
+
+def uses_tifffile(profile):
+    """Записываются ли области профиля profile через tifffile (массивы без PIL)"""
+    settings = OUTPUT_PROFILES[profile]
+    return settings['format'] == 'TIFF' and can_encode_with_tifffile(settings['compression'])
+
+
+def can_encode_with_tifffile(compression):
+    """Доступен ли tifffile и кодек сжатия для него (LZW и ZSTD - из imagecodecs)"""
+    from region_reader import import_tifffile
+
+    if import_tifffile() is None:
+        return False
+    if compression in (None, 'zlib'):
+        return True
+    try:
+        import imagecodecs  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def save_region(region, output_path, tags=None, profile=DEFAULT_PROFILE, timings=None, mode=None):
+    """Сохраняет вырезанную область в формате профиля profile.
+
+    region - PIL-изображение или массив из read_export_region, mode - режим
+    массива (по умолчанию RGB;16), tags - теги оригинала из source_tags. Профили TIFF сохраняют область без
+    преобразования режима и разрядности; JPEG и WebP - 8-битные копии.
+    Если передан timings (StageTimings), файл пишется через TimedFile, и время
+    делится на преобразование, кодирование и запись на диск.
+
+    Возвращает сжатие TIFF, которым область записана на самом деле (в
+    обозначениях tifffile); оно отличается от сжатия профиля, если кодека
+    профиля нет для этого режима. Для JPEG и WebP возвращает None.
+    """
+    if mode is None:
+        mode = region.mode if hasattr(region, 'save') else 'RGB;16'
+    if timings is None:
+        return _save_region(region, output_path, tags, profile, mode)
+    with TimedFile(output_path, timings) as output:
+        return _save_region(region, output, tags, profile, mode, timings)
+
+
+def _save_region(region, output, tags, profile, mode, timings=None):
+    settings = OUTPUT_PROFILES[profile]
+    if settings['format'] != 'TIFF':
+        save_viewing_copy(region, output, tags, settings, timings, mode)
+        return None
+
+    compression, level = settings['compression'], settings['level']
+    encoding = output.encoding() if timings is not None else nullcontext()
+    if mode in TIFFFILE_LAYOUTS and (can_encode_with_tifffile(compression) or mode == 'RGB;16'):
+        import numpy as np
+
+        if mode == 'RGB;16' and not can_encode_with_tifffile(compression):
+            # Без imagecodecs остается только встроенный в Python zlib
+            compression, level = 'zlib', 6
+        array = region
+        if hasattr(region, 'save'):
+            with stage(timings, 'convert'):
+                array = np.asarray(region)
+        with encoding:
+            save_array(array, output, tags, mode, compression, level, settings['predictor'])
+        return compression
+
+    # Запасной путь через libtiff в PIL (палитра, 1 бит, режимы без tifffile или его кодека).
+    # ZSTD в нем не поддерживается: такие области сжимаются Deflate, и это видно в сводке
+    from PIL import TiffImagePlugin
+
+    tiffinfo = TiffImagePlugin.ImageFileDirectory_v2()
+    if tags is not None:
+        for tag, value in tags.items():
+            tiffinfo[tag] = value
+            tiffinfo.tagtype[tag] = tags.tagtype[tag]
+    if settings['predictor'] and region.mode in PREDICTOR_MODES:
+        tiffinfo[TAG_PREDICTOR] = 2
+    if compression not in PIL_COMPRESSION:
+        compression = 'zlib'
+    with encoding:
+        region.save(output, format="TIFF", compression=PIL_COMPRESSION[compression], tiffinfo=tiffinfo)
+    return compression
+
+
+def save_array(array, output_path, tags=None, mode='RGB;16', compression='lzw', level=None, predictor=True):
+    """Сохраняет массив (высота, ширина[, каналы]) режима mode через tifffile с тегами оригинала.
+
+    output_path - путь или открытый для записи файл.
+    """
+    import tifffile
+
+    tags = tags if tags is not None else {}
+    options = {}
+    if TAG_X_RESOLUTION in tags and TAG_Y_RESOLUTION in tags:
+        options['resolution'] = (float(tags[TAG_X_RESOLUTION]), float(tags[TAG_Y_RESOLUTION]))
+        options['resolutionunit'] = tags.get(TAG_RESOLUTION_UNIT, 2)
+    extratags = []
+    for tag, value in tags.items():
+        dtype = TIFFFILE_DTYPES.get(tags.tagtype.get(tag))
+        if dtype is None or tag in (TAG_X_RESOLUTION, TAG_Y_RESOLUTION, TAG_RESOLUTION_UNIT):
+            continue
+        if dtype == 's':
+            # PIL читает строки TIFF как latin-1, tifffile принимает строки только в ASCII
+            extratags.append((tag, dtype, 0, str(value).encode('latin-1', 'replace'), True))
+        elif isinstance(value, bytes):
+            extratags.append((tag, dtype, len(value), value, True))
+        else:
+            values = tuple(value) if isinstance(value, tuple) else (value,)
+            extratags.append((tag, dtype, len(values), values, True))
+
+    photometric, extrasamples = TIFFFILE_LAYOUTS[mode]
+    if extrasamples:
+        options['extrasamples'] = extrasamples
+    if compression is not None:
+        options['compression'] = compression
+        options['predictor'] = predictor
+        if level is not None:
+            options['compressionargs'] = {'level': level}
+        # Небольшие полосы сжимаются быстрее и читаются по частям
+        options['rowsperstrip'] = max(1, OUTPUT_STRIP_BYTES // max(1, array.nbytes // array.shape[0]))
+
+    tifffile.imwrite(
+        output_path, array,
+        photometric=photometric,
+        software=False,
+        metadata=None,
+        extratags=extratags,
+        # Области и так сохраняются параллельно
+        maxworkers=1,
+        **options,
+    )
+
+
+def save_viewing_copy(region, output_path, tags, settings, timings=None, mode='RGB;16'):
+    """Сохраняет 8-битную копию области для просмотра (JPEG или WebP).
+
+    region - PIL-изображение или массив режима mode.
+    С timings output_path - TimedFile (см. save_region).
+    """
+    import numpy as np
+    from PIL import Image
+    from region_reader import array_to_image
+
+    with stage(timings, 'convert'):
+        if not hasattr(region, 'save'):
+            region = array_to_image(region, mode)
+        if region.mode == 'I;16':
+            region = Image.fromarray((np.asarray(region) >> 8).astype(np.uint8), 'L')
+
+        if region.mode not in settings['modes']:
+            region = region.convert('RGB')
+
+    options = dict(settings['options'])
+    tags = tags if tags is not None else {}
+    if tags.get(TAG_ICC_PROFILE) and region.mode != 'L':
+        options['icc_profile'] = bytes(tags[TAG_ICC_PROFILE])
+    if settings['format'] == 'JPEG' and TAG_X_RESOLUTION in tags and TAG_Y_RESOLUTION in tags:
+        options['dpi'] = (float(tags[TAG_X_RESOLUTION]), float(tags[TAG_Y_RESOLUTION]))
+    with output_path.encoding() if timings is not None else nullcontext():
+        region.save(output_path, format=settings['format'], **options)
+
+
+class ExportStats:
+    """Сводка сохранения областей: скорость кодирования и степень сжатия.
+
+    unchanged - сколько областей не сохранялось заново, потому что не изменились,
+    removed - сколько удалено устаревших файлов областей (см. ExportManifest),
+    duplicates - у скольких областей нашлась похожая фотография другого скана
+    (см. duplicates.DuplicateIndex), substituted - сколько областей сжато
+    другим кодеком, чем в профиле: {сжатие tifffile: число областей}.
+    В timings (StageTimings) замеряются этапы разрезки: декодирование,
+    выпрямление, кодирование, запись и другие.
+    """
+
+    def __init__(self, profile=DEFAULT_PROFILE, path=None):
+        self.profile = profile
+        self.timings = StageTimings('export', path)
+        self.count = 0
+        self.raw_bytes = 0
+        self.output_bytes = 0
+        self.seconds = 0.0
+        self.unchanged = 0
+        self.removed = 0
+        self.duplicates = 0
+        self.substituted = {}
+        self._lock = threading.Lock()
+
+    def add(self, raw_bytes, output_bytes, seconds):
+        with self._lock:
+            self.count += 1
+            self.raw_bytes += raw_bytes
+            self.output_bytes += output_bytes
+            self.seconds += seconds
+
+    def note_compression(self, compression):
+        """Учитывает сжатие, которым на самом деле записана область (результат save_region).
+
+        Замена кодека профиля попадает в сводку и в журнал замеров.
+        """
+        settings = OUTPUT_PROFILES[self.profile]
+        if settings['format'] != 'TIFF' or compression == settings['compression']:
+            return
+        with self._lock:
+            self.substituted[compression] = self.substituted.get(compression, 0) + 1
+            self.timings.extra['substituted'] = {COMPRESSION_TITLES[name]: count
+                                                 for name, count in self.substituted.items()}
+            self.timings.extra['substituted'] = {COMPRESSION_TITLES[name]: value
+                                                 for name, value in self.substituted.items()}
+
+    @property
+    def megabytes_per_second(self):
+        """Несжатых мегабайт в секунду одного потока кодирования"""
+        return self.raw_bytes / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    @property
+    def ratio(self):
+        """Во сколько раз файлы меньше несжатых пикселей"""
+        return self.raw_bytes / self.output_bytes if self.output_bytes else 0.0
+
+    def summary(self):
+        parts = []
+        if self.count or not (self.unchanged or self.removed or self.duplicates):
+            parts.append(f"{self.megabytes_per_second:.1f} МБ/с, сжатие {self.ratio:.2f}x")
+        if self.unchanged:
+            parts.append(f"без изменений {self.unchanged}")
+        if self.removed:
+            parts.append(f"удалено устаревших {self.removed}")
+        if self.duplicates:
+            parts.append(f"повторов {self.duplicates}")
+        for compression, count in self.substituted.items():
+            parts.append(f"{COMPRESSION_TITLES[compression]} вместо "
+                         f"{COMPRESSION_TITLES[OUTPUT_PROFILES[self.profile]['compression']]}: {count}")
+        return f"{OUTPUT_PROFILES[self.profile]['title']}: {', '.join(parts)}"
+
+
+class ExportManifest:
+    """Сведения о файлах областей одного скана в папке результатов.
+
+    Для каждого файла хранятся ключ области (идентичность исходного файла,
+    страница, координаты и настройки профиля), а также размер и время
+    изменения самого файла. Область, ключ которой совпадает, а файл не
+    менялся, заново не вырезается и не кодируется. Файлы, которые
+    разрезка создала раньше, но больше не создает, удаляются.
+    """
+
+    # Записи манифестов обновляются под блокировкой: одну папку могут писать несколько разрезок
+    _lock = threading.Lock()
+
+    def __init__(self, image_path, output_dir):
+        from preview_cache import file_identity
+
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        self.path = os.path.join(output_dir, base_name + EXPORT_MANIFEST_SUFFIX)
+        self.output_dir = output_dir
+        self.identity = file_identity(image_path)
+        self.outputs = self._load()
+        self._updated = {}   # Имя файла -> новая запись
+        self._removed = set()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != EXPORT_MANIFEST_VERSION:
+            return {}
+        return data.get('outputs', {})
+
+    def key(self, page, box, profile):
+        """Ключ области: меняется при изменении исходного файла, координат или настроек сохранения"""
+        settings = {name: value for name, value in OUTPUT_PROFILES[profile].items() if name != 'title'}
+        data = json.dumps([EXPORT_MANIFEST_VERSION, self.identity, page, list(box), settings], sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def is_current(self, name, key):
+        """Сохранен ли файл name для области с ключом key и не изменен ли он с тех пор"""
+        entry = self.outputs.get(name)
+        if entry is None or entry['key'] != key:
+            return False
+        try:
+            stat = os.stat(os.path.join(self.output_dir, name))
+        except OSError:
+            return False
+        return [stat.st_size, stat.st_mtime_ns] == [entry['size'], entry['mtime_ns']]
+
+    def record(self, name, key, page):
+        """Запоминает только что сохраненный файл области"""
+        stat = os.stat(os.path.join(self.output_dir, name))
+        self._updated[name] = {'key': key, 'page': page, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def remove_stale(self, page, produced, extension):
+        """Удаляет файлы страницы page с расширением extension, которых нет среди produced.
+
+        Файлы других форматов не трогаются: это отдельный набор результатов.
+        Возвращает число удаленных файлов.
+        """
+        removed = 0
+        for name, entry in self.outputs.items():
+            if entry['page'] != page or name in produced or not name.endswith(extension):
+                continue
+            try:
+                os.remove(os.path.join(self.output_dir, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+            self._removed.add(name)
+        return removed
+
+    def remove(self, names):
+        """Удаляет уже сохраненные файлы names вместе с их записями"""
+        for name in names:
+            try:
+                os.remove(os.path.join(self.output_dir, name))
+            except FileNotFoundError:
+                pass
+            self._updated.pop(name, None)
+            self._removed.add(name)
+
+    def save(self):
+        """Записывает изменения; записи, добавленные тем временем другими разрезками, сохраняются"""
+        if not self._updated and not self._removed:
+            return
+        with self._lock:
+            outputs = self._load()
+            for name in self._removed:
+                outputs.pop(name, None)
+            outputs.update(self._updated)
+            data = {'version': EXPORT_MANIFEST_VERSION, 'outputs': outputs}
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+        self.outputs = outputs
+        self._updated = {}
+        self._removed = set()
+
+
+def _save_numbered(i, region, output_path, tags=None, profile=DEFAULT_PROFILE, stats=None, mode=None):
+    started = time.perf_counter()
+    compression = save_region(region, output_path, tags, profile, stats.timings if stats is not None else None, mode)
+    if stats is not None:
+        stats.note_compression(compression)
+        stats.add(region_nbytes(region), os.path.getsize(output_path), time.perf_counter() - started)
+    return i, output_path
+
+
+def detect_boxes(reader, timings=None):
+    """Находит фотографии на странице открытого RegionReader и возвращает их области в координатах оригинала"""
+    from detection import detect_photos
+    from preview import reader_preview
+
+    preview, original_size, _ = reader_preview(reader, timings=timings)
+    with stage(timings, 'detect'):
+        found = detect_photos(preview)
+    return [preview_to_original(box, original_size, preview.size) for box in found]
+
+
+def cut_regions(image_path, boxes, output_dir, workers=None, profile=DEFAULT_PROFILE, stats=None,
+                page=0, page_number=None, incremental=True, duplicates=None):
+    """Вырезает области, заданные в координатах оригинала, и сохраняет их.
+
+    Области читаются последовательно, а кодируются и записываются параллельно
+    в workers потоках (по умолчанию по числу ядер): кодеры отпускают GIL.
+    profile - ключ OUTPUT_PROFILES; в stats (ExportStats), если он передан,
+    накапливаются объем и время кодирования. page - номер кадра страницы
+    многостраничного TIFF, page_number - ее номер в именах файлов.
+    С incremental=True области, которые уже сохранены с теми же координатами
+    и настройками, не сохраняются заново, а файлы удаленных областей
+    удаляются (см. ExportManifest). duplicates - DuplicateIndex папки
+    результатов: перед сохранением каждой области в нем ищется похожая
+    фотография (повторы с duplicates.skip не сохраняются).
+    Для каждой области по мере готовности выдает (номер, путь к файлу);
+    для пропущенных слишком маленьких областей и повторов путь равен None.
+    """
+    # Импорт здесь: графическому интерфейсу при запуске нужен только preview_to_original
+    from region_reader import RegionReader
+
+    manifest = ExportManifest(image_path, output_dir) if incremental else None
+    try:
+        with RegionReader(image_path, page) as reader:
+            yield from _cut_reader(reader, boxes, output_dir, workers, profile, stats, page_number, manifest,
+                                   duplicates)
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+
+def cut_pages(image_path, page_boxes, output_dir, workers=None, profile=DEFAULT_PROFILE, stats=None,
+              incremental=True, duplicates=None):
+    """Разрезает страницы многостраничного TIFF за один проход.
+
+    page_boxes - словарь {номер кадра: области}; страницы, которых в нем нет,
+    пропускаются, а для значения None фотографии ищутся автоматически.
+    Страницы открываются по очереди, каждая читается один раз, и в памяти
+    никогда не держится больше одной страницы. Если в файле больше одной
+    страницы, в имена результатов добавляется номер страницы.
+    Выдает (номер кадра, номер области, путь к файлу) так же, как cut_regions.
+    """
+    from region_reader import RegionReader, scan_pages
+
+    pages = scan_pages(image_path)
+    manifest = ExportManifest(image_path, output_dir) if incremental else None
+    try:
+        for number, page in enumerate(pages, 1):
+            if page not in page_boxes:
+                continue
+            with RegionReader(image_path, page) as reader:
+                boxes = page_boxes[page]
+                if boxes is None:
+                    boxes = detect_boxes(reader, stats.timings if stats is not None else None)
+                page_number = number if len(pages) > 1 else None
+                for i, output_path in _cut_reader(reader, boxes, output_dir, workers, profile, stats,
+                                                  page_number, manifest, duplicates):
+                    yield page, i, output_path
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+
+def _cut_reader(reader, boxes, output_dir, workers=None, profile=DEFAULT_PROFILE, stats=None, page_number=None,
+                manifest=None, duplicates=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    image_path = reader.path
+    tags = source_tags(reader.pil_image)
+    timings = stats.timings if stats is not None else None
+    # Для tifffile области берутся массивами: без PIL и без лишних копий
+    as_array = uses_tifffile(profile)
+    produced = set()
+    keys = {}
+
+    def unchanged(i, box):
+        # Файл области уже сохранен с теми же координатами и настройками
+        name = output_filename(image_path, i, profile, page_number)
+        produced.add(name)
+        if manifest is None:
+            return False
+        with stage(timings, 'manifest'):
+            keys[name] = manifest.key(reader.page, box, profile)
+            current = manifest.is_current(name, keys[name])
+        if not current:
+            return False
+        if stats is not None:
+            stats.unchanged += 1
+        return True
+
+    def duplicate(output_path, region, mode):
+        # Похожая фотография другого скана уже есть в папке результатов
+        if duplicates is None:
+            return False
+        name = os.path.basename(output_path)
+        with stage(timings, 'hash'):
+            match = duplicates.check(name, region, mode)
+        if match is None:
+            return False
+        if stats is not None:
+            stats.duplicates += 1
+        if not duplicates.skip:
+            return False
+        produced.discard(name)
+        return True
+
+    def saved(result):
+        i, output_path = result
+        if manifest is not None:
+            name = os.path.basename(output_path)
+            manifest.record(name, keys[name], reader.page)
+        return result
+
+    if workers <= 1:
+        for i, box in enumerate(boxes, 1):
+            box = clamp_box(box, reader.size)
+            if box is None:
+                yield i, None
+                continue
+
+            output_path = os.path.join(output_dir, output_filename(image_path, i, profile, page_number))
+            if unchanged(i, box):
+                yield i, output_path
+                continue
+            region, mode = read_export_region(reader, box, timings, as_array)
+            if duplicate(output_path, region, mode):
+                yield i, None
+                continue
+            yield saved(_save_numbered(i, region, output_path, tags, profile, stats, mode))
+    else:
+        # В памяти одновременно держим не больше двух вырезанных областей на поток
+        max_pending = workers * 2
+        pending = set()
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for i, box in enumerate(boxes, 1):
+                box = clamp_box(box, reader.size)
+                if box is None:
+                    yield i, None
+                    continue
+
+                output_path = os.path.join(output_dir, output_filename(image_path, i, profile, page_number))
+                if unchanged(i, box):
+                    yield i, output_path
+                    continue
+                region, mode = read_export_region(reader, box, timings, as_array)
+                if duplicate(output_path, region, mode):
+                    yield i, None
+                    continue
+                pending.add(pool.submit(_save_numbered, i, region, output_path, tags, profile, stats, mode))
+
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield saved(future.result())
+
+            for future in as_completed(pending):
+                yield saved(future.result())
+        finally:
+            # Если генератор закрыт досрочно (отмена), еще не начатые области не сохраняются
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    # Страница разрезана полностью: файлы областей, которых больше нет, устарели
+    if manifest is not None:
+        with stage(timings, 'manifest'):
+            removed = manifest.remove_stale(reader.page, produced, OUTPUT_PROFILES[profile]['extension'])
+        if stats is not None:
+            stats.removed += removed
@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+
+# Размер (по большей стороне), до которого уменьшается предпросмотр перед поиском
+DETECTION_MAX_SIDE = 600
+
+# Ширина рамки (доля размера), по которой оценивается цвет фона сканера
+BORDER_FRACTION = 0.02
+
+# Минимальное отличие от фона (0-255), которое считается фотографией
+MIN_THRESHOLD = 20
+
+# Минимальная площадь фотографии в долях площади скана
+MIN_AREA_FRACTION = 0.01
+
+# Размер ядра морфологии в долях большей стороны
+MORPH_FRACTION = 0.01
+
+# Фотографии, повернутые меньше чем на этот угол (в градусах), считаются ровными:
+# точность угла на уменьшенной копии - около десятой доли градуса
+MIN_SKEW_ANGLE = 0.3
+
+
+def border_pixels(image):
+    """Пиксели рамки по краю изображения в виде массива (N, каналы)"""
+    height, width = image.shape[:2]
+    border = max(1, int(min(height, width) * BORDER_FRACTION))
+    return np.concatenate([
+        image[:border].reshape(-1, image.shape[2]),
+        image[-border:].reshape(-1, image.shape[2]),
+        image[:, :border].reshape(-1, image.shape[2]),
+        image[:, -border:].reshape(-1, image.shape[2]),
+    ])
+
+
+def skew_angle(rotated):
+    """Наклон рамки cv2.minAreaRect в градусах против часовой стрелки, от -45 до 45"""
+    angle = -rotated[2] % 90
+    if angle > 45:
+        angle -= 90
+    return round(angle, 2)
+
+
+def detect_photos(preview):
+    """Находит фотографии на скане.
+
+    preview - RGB-массив (высота, ширина, 3) или PIL-изображение предпросмотра.
+    Возвращает список областей в координатах предпросмотра, упорядоченных
+    сверху вниз и слева направо: (x1, y1, x2, y2) для ровно лежащих фотографий
+    и (x1, y1, x2, y2, угол) для повернутых - прямоугольник фотографии,
+    повернутый на угол в градусах против часовой стрелки вокруг своего центра.
+    """
+    image = np.asarray(preview)
+    if image.ndim == 2:
+        image = image[..., np.newaxis]
+    height, width = image.shape[:2]
+
+    # Работаем с уменьшенной копией: контуры фотографий от этого не меняются
+    scale = min(1.0, DETECTION_MAX_SIDE / max(height, width))
+    if scale < 1.0:
+        small = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+        if small.ndim == 2:
+            small = small[..., np.newaxis]
+    else:
+        small = image
+
+    # Цвет фона сканера - медиана пикселей по краю изображения
+    background = np.median(border_pixels(small), axis=0).astype(np.int16)
+
+    # Отличие каждого пикселя от фона - максимум по каналам
+    difference = np.abs(small.astype(np.int16) - background).max(axis=2).astype(np.uint8)
+    difference = cv2.GaussianBlur(difference, (5, 5), 0)
+
+    # Порог выше шума фона: вдвое больше 99-го процентиля отличия на краях
+    noise = np.percentile(border_pixels(difference[..., np.newaxis]), 99)
+    threshold = max(MIN_THRESHOLD, 2 * noise)
+    _, mask = cv2.threshold(difference, threshold, 255, cv2.THRESH_BINARY)
+
+    # Закрытие заполняет светлые участки внутри фотографий, открытие убирает пыль
+    kernel_size = max(3, int(max(small.shape[:2]) * MORPH_FRACTION) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = MIN_AREA_FRACTION * small.shape[0] * small.shape[1]
+
+    boxes = []
+    for contour in contours:
+        rotated = cv2.minAreaRect(contour)
+        (_, _), (rect_w, rect_h), _ = rotated
+        if rect_w * rect_h < min_area:
+            continue
+
+        angle = skew_angle(rotated)
+        if abs(angle) < MIN_SKEW_ANGLE:
+            # Прямоугольник, описанный вокруг рамки фотографии
+            corners = cv2.boxPoints(rotated) / scale
+            x1 = max(0, int(np.floor(corners[:, 0].min())))
+            y1 = max(0, int(np.floor(corners[:, 1].min())))
+            x2 = min(width, int(np.ceil(corners[:, 0].max())))
+            y2 = min(height, int(np.ceil(corners[:, 1].max())))
+            if x2 > x1 and y2 > y1:
+                boxes.append((x1, y1, x2, y2))
+            continue
+
+        # Повернутая рамка: стороны берутся вдоль наклона фотографии
+        (center_x, center_y), (rect_w, rect_h), _ = rotated
+        # Ширина cv2.minAreaRect - сторона под углом rotated[2]; при сдвиге угла на 90 градусов стороны меняются местами
+        if round((angle + rotated[2]) / 90) % 2:
+            rect_w, rect_h = rect_h, rect_w
+        center_x, center_y, rect_w, rect_h = center_x / scale, center_y / scale, rect_w / scale, rect_h / scale
+        boxes.append((int(round(center_x - rect_w / 2)), int(round(center_y - rect_h / 2)),
+                      int(round(center_x + rect_w / 2)), int(round(center_y + rect_h / 2)), angle))
+
+    boxes.sort(key=lambda box: (box[1], box[0]))
+    return boxes
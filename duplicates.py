@@ -0,0 +1,421 @@
+"""Поиск повторов среди вырезанных фотографий по перцептивным хэшам.
+
+Одну и ту же фотографию часто сканируют и разрезают несколько раз. Для каждой
+вырезанной фотографии считаются pHash и dHash (по 64 бита) по уменьшенной
+копии; хэши хранятся в папке результатов в файле photo_hashes.npz. Перед
+сохранением области разрезка ищет в нем похожую фотографию другого скана.
+
+Фотографии, вырезанные до включения проверки повторов, добавляются в индекс
+запуском этого модуля для папки результатов; найденные при этом повторы
+выводятся на экран.
+
+Пример:
+    python duplicates.py result/
+    python duplicates.py result/ --phash-distance 6
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from region_reader import array_to_image
+
+# Файл индекса хэшей в папке результатов
+DUPLICATE_INDEX_NAME = 'photo_hashes.npz'
+
+# Версия хэшей; меняется, если меняется способ их расчета
+DUPLICATE_INDEX_VERSION = 1
+
+# Сторона уменьшенной копии, из которой считаются оба хэша
+THUMBNAIL_SIZE = 64
+# Сторона копии для pHash (по ней считается DCT) и число бит хэша по каждой оси
+PHASH_SIZE = 32
+HASH_BITS = 8
+
+# Наибольшее расстояние Хэмминга (из 64 бит), при котором фотографии считаются повтором.
+# pHash устойчив к пересжатию и небольшому сдвигу рамки, dHash отсекает случайные совпадения
+PHASH_DISTANCE = 8
+DHASH_DISTANCE = 12
+
+# На сколько 16-битных кусков делится хэш в индексе
+INDEX_CHUNKS = 4
+# Сколько хэшей добавляется без перестроения индекса; они проверяются перебором
+INDEX_TAIL = 4096
+
+# Сколько файлов уменьшается и хэшируется за один пакет при индексации папки
+HASH_BATCH = 256
+
+# Файлы папки результатов, которые индексируются
+IMAGE_EXTENSIONS = ('.tif', '.tiff', '.jpg', '.jpeg', '.webp', '.png')
+
+# Коэффициенты яркости каналов RGB
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# Число единичных бит каждого 16-битного значения
+POPCOUNT_16 = np.unpackbits(np.arange(1 << 16, dtype='>u2').view(np.uint8)).reshape(-1, 16).sum(axis=1).astype(np.uint8)
+
+
+def thumbnail(region, mode='RGB;16'):
+    """Уменьшенная копия области THUMBNAIL_SIZE x THUMBNAIL_SIZE в оттенках серого (float32, 0..1).
+
+    region - PIL-изображение или массив режима mode (см. cutting.read_export_region).
+    """
+    if not hasattr(region, 'save') and mode not in ('L', 'I;16', 'RGB', 'RGB;16', 'RGBA'):
+        # CMYK переводится в RGB так же, как у PIL-изображений
+        region = array_to_image(region, mode)
+    if hasattr(region, 'save'):
+        if region.mode not in ('L', 'I;16', 'RGB', 'RGBA'):
+            region = region.convert('RGB')
+        array = np.asarray(region)
+    else:
+        array = region
+    if not array.dtype.isnative:
+        array = array.astype(array.dtype.newbyteorder('='))
+    if array.dtype not in (np.uint8, np.uint16, np.float32):
+        array = array.astype(np.float32)
+    scale = np.iinfo(array.dtype).max if array.dtype != np.float32 else 1.0
+
+    small = cv2.resize(array, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    if small.ndim == 3:
+        small = small[..., :3] @ LUMA
+    return small / scale
+
+
+@lru_cache(maxsize=None)
+def dct_matrix(size):
+    """Матрица ортонормированного DCT-II: коэффициенты = D @ X @ D.T"""
+    k = np.arange(size)[:, np.newaxis]
+    n = np.arange(size)[np.newaxis, :]
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+def pack_bits(bits):
+    """Строки из 64 признаков -> 64-битные хэши"""
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def image_hashes(thumbnails):
+    """pHash и dHash пакета уменьшенных копий (N, THUMBNAIL_SIZE, THUMBNAIL_SIZE).
+
+    Оба хэша считаются сразу для всего пакета: уменьшение усреднением блоков,
+    DCT - двумя матричными умножениями.
+    """
+    count = len(thumbnails)
+    step = THUMBNAIL_SIZE // PHASH_SIZE
+    small = thumbnails.reshape(count, PHASH_SIZE, step, PHASH_SIZE, step).mean(axis=(2, 4))
+
+    # pHash: низкие частоты DCT больше или меньше их медианы (без постоянной составляющей)
+    matrix = dct_matrix(PHASH_SIZE)
+    low = (matrix @ small @ matrix.T)[:, :HASH_BITS, :HASH_BITS].reshape(count, -1)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    phash = pack_bits(low > median)
+
+    # dHash: растет ли яркость слева направо в копии 9x8
+    columns = np.linspace(0, PHASH_SIZE, HASH_BITS + 2).astype(int)
+    rows = small.reshape(count, HASH_BITS, PHASH_SIZE // HASH_BITS, PHASH_SIZE).mean(axis=2)
+    grid = np.add.reduceat(rows, columns[:-1], axis=2) / np.diff(columns)
+    dhash = pack_bits((grid[:, :, 1:] > grid[:, :, :-1]).reshape(count, -1))
+    return phash, dhash
+
+
+def hamming(hashes, value):
+    """Расстояния Хэмминга от массива 64-битных хэшей до value"""
+    diff = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(value))
+    return POPCOUNT_16[diff.view(np.uint16).reshape(-1, 4)].sum(axis=1, dtype=np.int32)
+
+
+@lru_cache(maxsize=None)
+def flip_masks(radius):
+    """16-битные маски, переворачивающие не больше radius бит"""
+    masks = [sum(1 << bit for bit in bits)
+             for count in range(radius + 1) for bits in itertools.combinations(range(16), count)]
+    return np.array(masks, dtype=np.uint16)
+
+
+def hash_chunks(hashes):
+    """Куски хэшей по 16 бит: (N, INDEX_CHUNKS)"""
+    shifts = np.arange(INDEX_CHUNKS, dtype=np.uint64) * np.uint64(16)
+    return ((hashes[:, np.newaxis] >> shifts) & np.uint64(0xFFFF)).astype(np.uint16)
+
+
+def scan_of(name):
+    """Скан (и страница), из которого вырезан файл: часть имени до _cutted_ (см. output_filename)"""
+    return name.rsplit('_cutted_', 1)[0]
+
+
+class HammingIndex:
+    """Поиск 64-битных хэшей по расстоянию Хэмминга (multi-index hashing).
+
+    Хэш делится на INDEX_CHUNKS кусков по 16 бит, и для каждого куска хранится
+    отсортированный массив значений. Если хэши отличаются не больше чем
+    в d битах, хотя бы один кусок отличается не больше чем в d // INDEX_CHUNKS
+    битах, поэтому кандидаты находятся двоичным поиском куска запроса и его
+    вариантов с перевернутыми битами, а точное расстояние считается только для
+    них. Хэши, добавленные после последнего построения (не больше INDEX_TAIL),
+    проверяются перебором.
+    """
+
+    def __init__(self, hashes=()):
+        self._hashes = np.asarray(hashes, dtype=np.uint64)
+        self._tail = []
+        self._build()
+
+    def __len__(self):
+        return len(self._hashes) + len(self._tail)
+
+    def add(self, value):
+        """Добавляет хэш и возвращает его номер"""
+        self._tail.append(value)
+        if len(self._tail) > INDEX_TAIL:
+            self._build()
+        return len(self) - 1
+
+    def hashes(self):
+        return np.concatenate([self._hashes, np.array(self._tail, dtype=np.uint64)])
+
+    def search(self, value, max_distance):
+        """Номера хэшей не дальше max_distance от value и расстояния до них"""
+        masks = flip_masks(max_distance // INDEX_CHUNKS)
+        query = hash_chunks(np.array([value], dtype=np.uint64))[0]
+        found = []
+        for chunk in range(INDEX_CHUNKS):
+            column = self._sorted[:, chunk]
+            probes = query[chunk] ^ masks
+            starts = np.searchsorted(column, probes, 'left')
+            ends = np.searchsorted(column, probes, 'right')
+            for start, end in zip(starts[starts < ends], ends[starts < ends]):
+                found.append(self._order[start:end, chunk])
+
+        ids = np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.intp)
+        distances = hamming(self._hashes[ids], value)
+        if self._tail:
+            tail_distances = hamming(self._tail, value)
+            ids = np.concatenate([ids, np.arange(len(self._hashes), len(self))])
+            distances = np.concatenate([distances, tail_distances])
+        keep = distances <= max_distance
+        return ids[keep], distances[keep]
+
+    def _build(self):
+        self._hashes = self.hashes() if self._tail else self._hashes
+        self._tail = []
+        chunks = hash_chunks(self._hashes)
+        self._order = np.argsort(chunks, axis=0, kind='stable')
+        self._sorted = np.take_along_axis(chunks, self._order, axis=0)
+
+
+class DuplicateIndex:
+    """Хэши вырезанных фотографий папки результатов и поиск повторов среди них.
+
+    Индекс загружается из файла DUPLICATE_INDEX_NAME при первой проверке.
+    check() ищет для новой области похожую фотографию (pHash и dHash не
+    дальше порогов) другого скана и добавляет область в индекс. Найденные
+    пары (имя нового файла, имя похожего) накапливаются в matches; с skip=True
+    повторы не сохраняются. Одним индексом могут пользоваться несколько потоков.
+    """
+
+    def __init__(self, directory, skip=False, phash_distance=PHASH_DISTANCE, dhash_distance=DHASH_DISTANCE):
+        self.directory = directory
+        self.path = os.path.join(directory, DUPLICATE_INDEX_NAME)
+        self.skip = skip
+        self.phash_distance = phash_distance
+        self.dhash_distance = dhash_distance
+        self.matches = []
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._changed = False
+
+    def check(self, name, region, mode='RGB;16'):
+        """Ищет повтор области, которая будет сохранена в файл name; возвращает имя похожего файла или None.
+
+        region и mode - как у cutting.read_export_region.
+        """
+        phash, dhash = image_hashes(thumbnail(region, mode)[np.newaxis])
+        return self.check_hashes(name, int(phash[0]), int(dhash[0]))
+
+    def check_hashes(self, name, phash, dhash):
+        with self._lock:
+            self._load()
+            # Файл перезаписывается: прежний хэш его больше не описывает
+            self._forget(name)
+            match = self._find(name, phash, dhash)
+            if match is not None:
+                self.matches.append((name, match))
+            if match is None or not self.skip:
+                self._add(name, phash, dhash)
+            return match
+
+    def take_matches(self):
+        """Пары повторов, найденные с прошлого вызова"""
+        with self._lock:
+            matches, self.matches = self.matches, []
+            return matches
+
+    def added(self):
+        """Записи, добавленные после загрузки индекса: [(имя, pHash, dHash), ...]"""
+        with self._lock:
+            self._load()
+            phashes = self._index.hashes()
+            return [(name, int(phashes[i]), int(self._dhashes[i]))
+                    for name, i in self._ids.items() if i >= self._loaded_count]
+
+    def update(self, batch=HASH_BATCH):
+        """Добавляет в индекс файлы папки, которых в нем нет, и убирает удаленные.
+
+        Уменьшенные копии файлов хэшируются пакетами по batch. Повторы среди
+        новых файлов попадают в matches. Возвращает число добавленных файлов.
+        """
+        with self._lock:
+            self._load()
+        names = sorted(name for name in os.listdir(self.directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+        existing = set(names)
+        with self._lock:
+            for name in [name for name in self._ids if name not in existing]:
+                self._forget(name)
+
+        new_names = [name for name in names if name not in self._ids]
+        for start in range(0, len(new_names), batch):
+            thumbnails, hashed = [], []
+            for name in new_names[start:start + batch]:
+                try:
+                    thumbnails.append(load_thumbnail(os.path.join(self.directory, name)))
+                    hashed.append(name)
+                except (OSError, ValueError) as e:
+                    print(f"Не удалось прочитать {name}: {e}", file=sys.stderr)
+            if not hashed:
+                continue
+            phashes, dhashes = image_hashes(np.stack(thumbnails))
+            for name, phash, dhash in zip(hashed, phashes, dhashes):
+                self.check_hashes(name, int(phash), int(dhash))
+        return len(new_names)
+
+    def save(self):
+        """Записывает индекс; записи, добавленные тем временем другими разрезками, сохраняются"""
+        with self._lock:
+            if not self._changed:
+                return
+            names, phashes, dhashes = self._read()
+            alive = self._alive()
+            known = set(self._ids) | self._removed
+            extra = [i for i, name in enumerate(names) if name not in known]
+            all_names = [self._names[i] for i in alive] + [names[i] for i in extra]
+            all_phashes = np.concatenate([self._index.hashes()[alive], phashes[extra]])
+            all_dhashes = np.concatenate([self._dhashes[:len(self._names)][alive], dhashes[extra]])
+
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                np.savez(f, version=DUPLICATE_INDEX_VERSION,
+                         names=np.frombuffer('\n'.join(all_names).encode('utf-8'), dtype=np.uint8),
+                         phash=all_phashes, dhash=all_dhashes)
+            os.replace(temp_path, self.path)
+            self._changed = False
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._ids)
+
+    def _read(self):
+        """Имена и хэши из файла индекса; пустые, если его нет или он другой версии"""
+        empty = ([], np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64))
+        try:
+            with np.load(self.path) as data:
+                if int(data['version']) != DUPLICATE_INDEX_VERSION:
+                    return empty
+                text = data['names'].tobytes().decode('utf-8')
+                return (text.split('\n') if text else []), data['phash'], data['dhash']
+        except (OSError, ValueError, KeyError):
+            return empty
+
+    def _load(self):
+        if self._loaded:
+            return
+        names, phashes, dhashes = self._read()
+        self._names = list(names)
+        self._ids = {name: i for i, name in enumerate(self._names)}
+        self._removed = set()
+        self._loaded_count = len(self._names)
+        self._index = HammingIndex(phashes)
+        self._dhashes = np.array(dhashes, dtype=np.uint64)
+        self._loaded = True
+
+    def _alive(self):
+        return np.array(sorted(self._ids.values()), dtype=np.intp)
+
+    def _add(self, name, phash, dhash):
+        i = self._index.add(phash)
+        if i >= len(self._dhashes):
+            # Массив dHash растет с запасом, как список
+            grown = np.zeros(max(16, 2 * len(self._dhashes)), dtype=np.uint64)
+            grown[:len(self._dhashes)] = self._dhashes
+            self._dhashes = grown
+        self._dhashes[i] = dhash
+        self._names.append(name)
+        self._ids[name] = i
+        self._removed.discard(name)
+        self._changed = True
+
+    def _forget(self, name):
+        # Запись остается в массивах, но больше не находится
+        if self._ids.pop(name, None) is not None:
+            self._removed.add(name)
+            self._changed = True
+
+    def _find(self, name, phash, dhash):
+        ids, distances = self._index.search(phash, self.phash_distance)
+        if not len(ids):
+            return None
+        close = hamming(self._dhashes[ids], dhash) <= self.dhash_distance
+        scan = scan_of(name)
+        for i in ids[close][np.argsort(distances[close], kind='stable')]:
+            other = self._names[i]
+            # Области одного скана - не повторы: их номера меняются при правке выделений
+            if self._ids.get(other) != i or scan_of(other) == scan:
+                continue
+            if not os.path.exists(os.path.join(self.directory, other)):
+                self._forget(other)
+                continue
+            return other
+        return None
+
+
+def load_thumbnail(path):
+    """Уменьшенная копия файла; JPEG декодируется сразу в уменьшенном размере"""
+    with Image.open(path) as image:
+        image.draft('RGB', (THUMBNAIL_SIZE * 2, THUMBNAIL_SIZE * 2))
+        return thumbnail(image)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Индексация вырезанных фотографий и поиск повторов")
+    parser.add_argument('directory', help="папка результатов")
+    parser.add_argument('--phash-distance', type=int, default=PHASH_DISTANCE,
+                        help=f"наибольшее расстояние pHash для повтора (по умолчанию {PHASH_DISTANCE})")
+    parser.add_argument('--dhash-distance', type=int, default=DHASH_DISTANCE,
+                        help=f"наибольшее расстояние dHash для повтора (по умолчанию {DHASH_DISTANCE})")
+    args = parser.parse_args(argv)
+
+    index = DuplicateIndex(args.directory, phash_distance=args.phash_distance, dhash_distance=args.dhash_distance)
+    started = time.perf_counter()
+    added = index.update()
+    elapsed = time.perf_counter() - started
+    index.save()
+
+    for name, match in index.matches:
+        print(f"{name}: повтор {match}")
+    per_file = elapsed / added * 1000 if added else 0.0
+    print(f"В индексе {len(index)} фотографий, добавлено {added} ({per_file:.1f} мс на файл), "
+          f"повторов {len(index.matches)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
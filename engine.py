@@ -0,0 +1,141 @@
+"""Ядро разрезки без Qt: загрузка страницы, пересчет координат и потоковая разрезка.
+
+Через этот модуль работают оба графических интерфейса (image_cutter_enhanced.py
+и main.py), пакетная разрезка и замеры производительности, поэтому любое
+ускорение загрузки или сохранения сразу доступно им всем и замеряется без
+дисплея. Тяжелые зависимости (numpy, PIL, OpenCV) импортируются только при
+загрузке и разрезке.
+
+Пример:
+    from engine import cut, load_page
+
+    page = load_page('scan.tif')
+    for frame, index, path in cut('scan.tif', page.boxes):
+        print(index, path)
+"""
+import os
+
+from cutting import DEFAULT_PROFILE, cut_pages, original_to_preview, preview_to_original
+from instrumentation import stage
+
+# Нарисованная мышью область меньше этого (сумма сторон в пикселях экрана)
+# считается случайным щелчком и не добавляется
+MIN_DRAWN_SIZE_PX = 10
+
+
+def is_drawn_box(box, zoom=1.0):
+    """Достаточно ли велика область, нарисованная при масштабе zoom, чтобы ее добавить"""
+    x1, y1, x2, y2 = box[:4]
+    return (abs(x2 - x1) + abs(y2 - y1)) * zoom > MIN_DRAWN_SIZE_PX
+
+
+class LoadedPage:
+    """Загруженная страница: RGB-предпросмотр и найденные на ней области.
+
+    pages - номера кадров всех страниц файла, original_size и mode - размер
+    и режим оригинала, scale_factor - масштаб предпросмотра, boxes - области
+    в координатах оригинала, from_cache - взята ли страница из кэша.
+    """
+
+    def __init__(self, path, page, pages, preview, original_size, mode, scale_factor, boxes, from_cache=False):
+        self.path = path
+        self.page = page
+        self.pages = pages
+        self.preview = preview
+        self.original_size = original_size
+        self.mode = mode
+        self.scale_factor = scale_factor
+        self.boxes = boxes
+        self.from_cache = from_cache
+
+    def to_original(self, box):
+        """Область предпросмотра в координатах оригинала"""
+        return preview_to_original(box, self.original_size, self.preview.size)
+
+    def to_preview(self, box):
+        """Область оригинала в координатах предпросмотра"""
+        return original_to_preview(box, self.original_size, self.preview.size)
+
+
+def load_page(path, page=None, cache=None, detect=True, timings=None, max_width=None, max_height=None):
+    """Строит предпросмотр страницы page и ищет на ней фотографии.
+
+    page - номер кадра; по умолчанию первая страница-скан (миниатюры
+    пропускаются, см. region_reader.scan_pages), та же, что режет cut()
+    со списком областей.
+
+    cache - PreviewCache: если страница уже открывалась, предпросмотр и
+    области берутся из него, а новые сохраняются в него (и с detect=False:
+    такая запись помечается, и фотографии на ней ищутся при следующей
+    загрузке с detect=True). С detect=False фотографии не ищутся, а boxes -
+    области из кэша, если они там есть. В timings (StageTimings) замеряются
+    этапы загрузки. max_width и max_height ограничивают размер предпросмотра
+    (по умолчанию см. preview.PREVIEW_MAX_WIDTH); предпросмотр из кэша
+    другого размера строится заново, а области записи сохраняются.
+    """
+    from PIL import Image
+    from preview import PREVIEW_MAX_HEIGHT, PREVIEW_MAX_WIDTH, build_preview, preview_geometry
+    from region_reader import scan_pages
+
+    max_width, max_height = max_width or PREVIEW_MAX_WIDTH, max_height or PREVIEW_MAX_HEIGHT
+    with stage(timings, 'scan'):
+        pages = scan_pages(path)
+    if page is None:
+        page = pages[0]
+    with stage(timings, 'cache'):
+        entry = cache.load(path, page) if cache else None
+    if entry is not None and entry['preview'].size == preview_geometry(entry['original_size'], max_width,
+                                                                       max_height)[1]:
+        boxes = entry['rectangles']
+        if detect and not entry['detected']:
+            boxes = _detect_boxes(entry['preview'], entry['original_size'], timings)
+            with stage(timings, 'cache'):
+                cache.store(path, entry['preview'], entry['original_size'], entry['mode'], entry['scale_factor'],
+                            boxes, page)
+        return LoadedPage(path, page, pages, entry['preview'], entry['original_size'], entry['mode'],
+                          entry['scale_factor'], boxes, from_cache=True)
+
+    preview, original_size, scale_factor = build_preview(path, max_width, max_height, page, timings)
+    with Image.open(path) as image:
+        image.seek(page)
+        mode = image.mode
+    # Запись с предпросмотром другого размера оставил другой клиент: ее области (возможно, исправленные) не теряются
+    boxes, detected = (entry['rectangles'], entry['detected']) if entry is not None else ([], False)
+    if detect and not detected:
+        boxes, detected = _detect_boxes(preview, original_size, timings), True
+    if cache:
+        with stage(timings, 'cache'):
+            cache.store(path, preview, original_size, mode, scale_factor, boxes, page, detected)
+    return LoadedPage(path, page, pages, preview, original_size, mode, scale_factor, boxes)
+
+
+def _detect_boxes(preview, original_size, timings=None):
+    """Фотографии на предпросмотре в координатах оригинала"""
+    from detection import detect_photos
+
+    with stage(timings, 'detect'):
+        return [preview_to_original(box, original_size, preview.size) for box in detect_photos(preview)]
+
+
+def cut(image_path, regions, output_dir=None, profile=DEFAULT_PROFILE, stats=None, workers=None, incremental=True,
+        duplicates=None):
+    """Вырезает и сохраняет области, выдавая результаты по мере готовности.
+
+    regions - области первой страницы в координатах оригинала или словарь
+    {номер кадра страницы: области} (для None фотографии ищутся
+    автоматически). output_dir по умолчанию - папка оригинала. Слишком
+    маленькие и выходящие за изображение области отбрасываются одинаково
+    для всех клиентов (см. cutting.clamp_box). Остальные параметры - как
+    у cutting.cut_pages.
+
+    Выдает (номер кадра, номер области, путь к файлу); для пропущенных
+    областей и повторов путь равен None. Закрытие генератора отменяет еще
+    не начатое сохранение.
+    """
+    if not isinstance(regions, dict):
+        from region_reader import scan_pages
+
+        regions = {scan_pages(image_path)[0]: list(regions)}
+    if output_dir is None:
+        output_dir = os.path.dirname(os.path.abspath(image_path))
+    return cut_pages(image_path, regions, output_dir, workers, profile, stats, incremental, duplicates)
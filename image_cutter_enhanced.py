@@ -1,53 +1,133 @@
+import time
+
+# Момент запуска: от него отсчитывается время до первой отрисовки окна
+LAUNCH_TIME = time.perf_counter()
+
 import sys
 import os
-import numpy as np
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QLabel, QPushButton, 
                             QVBoxLayout, QHBoxLayout, QWidget, QFileDialog, 
-                            QMessageBox, QScrollArea, QStatusBar)
-from PyQt5.QtGui import QPixmap, QPainter, QPen, QImage, QColor
-from PyQt5.QtCore import Qt, QPoint, QRect, QLine
-from PIL import Image, ImageDraw
-import cv2
-import uuid
-from shapely.geometry import LineString, Point
+                            QMessageBox, QScrollArea, QStatusBar, QProgressBar, QComboBox,
+                            QShortcut, QCheckBox)
+from PyQt5.QtGui import QPixmap, QPainter, QPen, QColor, QPolygonF, QKeySequence
+from PyQt5.QtCore import Qt, QPoint, QPointF, QRect, QRectF, QSize, QThreadPool, QTimer, pyqtSignal
+# Тяжелые зависимости (numpy, PIL, OpenCV, tifffile) импортируются
+# фоновыми задачами только тогда, когда они нужны
+from cutting import DEFAULT_PROFILE, OUTPUT_PROFILES, box_angle, bounding_box, rotated_corners
+from engine import is_drawn_box
+from preview_cache import PreviewCache
+from rect_store import MOVE, EditHistory, RectStore, dragged_box, make_box
+from tiles import TilePyramid
+from watch_folder import FolderWatcher, ScanQueue
+from workers import CutWorker, LoadWorker
 
-class Rectangle:
-    def __init__(self, start, end):
-        self.start = start
-        self.end = end
-    
-    def get_qrect(self):
-        """Возвращает QRect для отрисовки прямоугольника"""
-        return QRect(
-            min(self.start.x(), self.end.x()),
-            min(self.start.y(), self.end.y()),
-            abs(self.start.x() - self.end.x()),
-            abs(self.start.y() - self.end.y())
-        )
-    
-    def to_cv_coords(self, scale_factor):
-        """Преобразует координаты в формат OpenCV с учетом масштаба"""
-        x1 = min(self.start.x(), self.end.x()) / scale_factor
-        y1 = min(self.start.y(), self.end.y()) / scale_factor
-        x2 = max(self.start.x(), self.end.x()) / scale_factor
-        y2 = max(self.start.y(), self.end.y()) / scale_factor
-        return (int(x1), int(y1), int(x2), int(y2))
+# Допустимое время от запуска до первой отрисовки окна (проверяется с --startup-check)
+STARTUP_BUDGET_SECONDS = 1.0
+
+# Максимальный масштаб просмотра (1.0 - один пиксель оригинала на пиксель экрана)
+MAX_ZOOM = 2.0
+# Во сколько раз меняется масштаб за один шаг
+ZOOM_STEP = 1.25
+# На сколько градусов поворачивается прямоугольник за один шаг колеса мыши с Shift
+ROTATION_STEP = 0.5
+# На каком расстоянии от стороны прямоугольника (в пикселях экрана) ее можно захватить мышью
+HANDLE_TOLERANCE_PX = 6
+# Размер маркеров на углах и сторонах выделенного прямоугольника в пикселях экрана
+HANDLE_SIZE_PX = 7
+# С какого расстояния (в пикселях экрана) сторона притягивается к краю соседнего прямоугольника
+SNAP_DISTANCE_PX = 8
+
+# Курсор над стороной или углом прямоугольника: (левая, верхняя, правая, нижняя) -> форма
+HANDLE_CURSORS = {
+    MOVE: Qt.SizeAllCursor,
+    (True, False, False, False): Qt.SizeHorCursor,
+    (False, False, True, False): Qt.SizeHorCursor,
+    (False, True, False, False): Qt.SizeVerCursor,
+    (False, False, False, True): Qt.SizeVerCursor,
+    (True, True, False, False): Qt.SizeFDiagCursor,
+    (False, False, True, True): Qt.SizeFDiagCursor,
+    (False, True, True, False): Qt.SizeBDiagCursor,
+    (True, False, False, True): Qt.SizeBDiagCursor,
+}
+
+# Не чаще скольких миллисекунд обновляется строка состояния при движении мыши
+STATUS_UPDATE_INTERVAL_MS = 50
+# Через сколько миллисекунд после последней правки прямоугольники записываются в кэш
+RECTANGLES_SAVE_DELAY_MS = 500
+# Сколько найденных повторов перечисляется в подсказке строки состояния
+MATCHES_TOOLTIP_LINES = 20
+
+def box_polygon(box):
+    """Многоугольник области (x1, y1, x2, y2[, угол]) с учетом поворота"""
+    return QPolygonF([QPointF(x, y) for x, y in rotated_corners(box)])
 
 class ImageCutterAppEnhanced(QMainWindow):
+    # Время от запуска до первой отрисовки окна, в секундах
+    first_painted = pyqtSignal(float)
+    
     def __init__(self):
         super().__init__()
+        self.startup_time = None
         self.init_ui()
         
         # Переменные для работы с изображением
         self.image_path = None
+        self.page = 0              # Номер кадра открытой страницы многостраничного TIFF
+        self.pages = [0]           # Номера кадров всех страниц открытого файла
+        self.page_rectangles = {}  # Прямоугольники просмотренных страниц: {кадр: [(x1, y1, x2, y2), ...]}
         self.original_pixmap = None
         self.display_pixmap = None
-        self.rectangles = []  # Список прямоугольников вместо линий
+        self.rectangles = RectStore()  # Прямоугольники открытой страницы в координатах оригинала
+        self.history = EditHistory()   # Отмена и повтор правок прямоугольников страницы
+        self.selected = None       # Номер выделенного прямоугольника
+        self.editing = None        # Перетаскивание выделенного: (стороны, точка нажатия, исходная область)
+        self.edit_box = None       # Положение перетаскиваемого прямоугольника
+        self.rotated = None        # Прямоугольник, который поворачивается колесом: повороты подряд - одна правка
         self.drawing = False
         self.start_point = None
         self.current_point = None
         self.original_size = None  # Размер оригинального изображения
         self.scale_factor = 1.0    # Коэффициент масштабирования для предпросмотра
+        self.zoom = 1.0            # Текущий масштаб просмотра (пикселей экрана на пиксель оригинала)
+        self.tile_pyramid = None   # Тайлы оригинала для просмотра при увеличении
+        self.pan_start = None      # Начало перетаскивания изображения средней кнопкой
+        
+        # Слой с сохраненными прямоугольниками для видимой области: перерисовывается
+        # только при их изменении, смене масштаба или прокрутке, а не при каждом движении мыши
+        self.overlay = None
+        self.overlay_key = None
+        
+        # Отложенное сообщение строки состояния при движении мыши
+        self.pending_status = None
+        self.status_timer = QTimer(self)
+        self.status_timer.setSingleShot(True)
+        self.status_timer.setInterval(STATUS_UPDATE_INTERVAL_MS)
+        self.status_timer.timeout.connect(self.show_pending_status)
+        
+        # Отложенная запись прямоугольников в кэш: серия правок записывается один раз
+        self.pending_rectangles = {}   # (файл, страница) -> области
+        self.rectangles_timer = QTimer(self)
+        self.rectangles_timer.setSingleShot(True)
+        self.rectangles_timer.setInterval(RECTANGLES_SAVE_DELAY_MS)
+        self.rectangles_timer.timeout.connect(self.save_pending_rectangles)
+        
+        # Фоновые задачи загрузки и разрезки
+        self.thread_pool = QThreadPool.globalInstance()
+        self.loading_path = None   # Файл, загрузка которого запрошена последней
+        self.loading_page = 0      # и его страница
+        self.load_workers = []
+        self.cut_workers = []
+        self.duplicate_indexes = {}  # Индексы повторов папок результатов: {папка: DuplicateIndex}
+        
+        # Кэш предпросмотров и прямоугольников ранее открытых файлов
+        self.preview_cache = PreviewCache()
+        
+        # Наблюдение за папкой сканера: новые сканы готовятся заранее,
+        # разрезанные уходят в фоновую очередь, а следующий открывается сразу
+        self.folder_watcher = None
+        self.scan_queue = None
+        self.watch_output_dir = None
+        self.waiting_for_scan = False  # Открыть скан, как только он появится в папке
         
     def init_ui(self):
         self.setWindowTitle('Разрезка сканированных изображений')
@@ -58,13 +138,14 @@ class ImageCutterAppEnhanced(QMainWindow):
         main_layout = QVBoxLayout(main_widget)
         
         # Виджет для прокрутки изображения
+        # Размер виджета изображения задается масштабом, поэтому он не растягивается
         self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
+        self.scroll_area.setWidgetResizable(False)
         
         # Создание виджета для отображения изображения
         self.image_label = QLabel("Загрузите изображение (*.tif или *.tiff)")
         self.image_label.setAlignment(Qt.AlignCenter)
-        self.image_label.setMinimumSize(1000, 700)
+        self.image_label.resize(1000, 700)
         self.image_label.setStyleSheet("border: 1px solid gray; background-color: #f0f0f0;")
         
         # Переопределяем обработчики событий мыши
@@ -72,6 +153,9 @@ class ImageCutterAppEnhanced(QMainWindow):
         self.image_label.mouseMoveEvent = self.mouse_move_event
         self.image_label.mouseReleaseEvent = self.mouse_release_event
         self.image_label.paintEvent = self.paint_event
+        self.image_label.wheelEvent = self.wheel_event
+        # Курсор над прямоугольниками показывает, что их можно двигать и менять их размер
+        self.image_label.setMouseTracking(True)
         
         self.scroll_area.setWidget(self.image_label)
         main_layout.addWidget(self.scroll_area)
@@ -85,6 +169,19 @@ class ImageCutterAppEnhanced(QMainWindow):
         self.btn_open.setMinimumWidth(150)
         button_layout.addWidget(self.btn_open)
         
+        # Кнопки режима наблюдения за папкой сканера
+        self.btn_watch = QPushButton("Следить за папкой")
+        self.btn_watch.setCheckable(True)
+        self.btn_watch.toggled.connect(self.toggle_watch)
+        self.btn_watch.setMinimumWidth(150)
+        button_layout.addWidget(self.btn_watch)
+        
+        self.btn_next = QPushButton("Следующий скан")
+        self.btn_next.clicked.connect(self.next_scan)
+        self.btn_next.setMinimumWidth(150)
+        self.btn_next.setEnabled(False)
+        button_layout.addWidget(self.btn_next)
+        
         # Кнопка для очистки прямоугольников
         self.btn_clear = QPushButton("Очистить выделения")
         self.btn_clear.clicked.connect(self.clear_rectangles)
@@ -99,6 +196,51 @@ class ImageCutterAppEnhanced(QMainWindow):
         self.btn_cut.setEnabled(False)
         button_layout.addWidget(self.btn_cut)
         
+        # Формат и сжатие результатов
+        self.profile_combo = QComboBox()
+        for profile, settings in OUTPUT_PROFILES.items():
+            self.profile_combo.addItem(settings['title'], profile)
+        self.profile_combo.setCurrentIndex(self.profile_combo.findData(DEFAULT_PROFILE))
+        self.profile_combo.setToolTip("Формат и сжатие вырезанных областей")
+        button_layout.addWidget(self.profile_combo)
+        
+        # Проверка областей на повторы уже вырезанных фотографий
+        self.check_duplicates = QCheckBox("Искать повторы")
+        self.check_duplicates.setToolTip("Перед сохранением сравнивать области с фотографиями других сканов в папке результатов")
+        button_layout.addWidget(self.check_duplicates)
+        
+        # Страницы многостраничного TIFF: показываются, только если страниц больше одной
+        self.btn_prev_page = QPushButton("<")
+        self.btn_prev_page.clicked.connect(lambda: self.show_page(-1))
+        self.page_label = QLabel()
+        self.btn_next_page = QPushButton(">")
+        self.btn_next_page.clicked.connect(lambda: self.show_page(1))
+        self.btn_cut_all = QPushButton("Разрезать все страницы")
+        self.btn_cut_all.clicked.connect(self.cut_all_pages)
+        for widget in (self.btn_prev_page, self.page_label, self.btn_next_page, self.btn_cut_all):
+            widget.hide()
+            button_layout.addWidget(widget)
+        
+        # Кнопки масштаба
+        self.btn_zoom_fit = QPushButton("Вписать")
+        self.btn_zoom_fit.clicked.connect(lambda: self.set_zoom(self.scale_factor))
+        self.btn_zoom_actual = QPushButton("1:1")
+        self.btn_zoom_actual.clicked.connect(lambda: self.set_zoom(1.0))
+        self.btn_zoom_in = QPushButton("+")
+        self.btn_zoom_in.clicked.connect(lambda: self.set_zoom(self.zoom * ZOOM_STEP))
+        self.btn_zoom_out = QPushButton("-")
+        self.btn_zoom_out.clicked.connect(lambda: self.set_zoom(self.zoom / ZOOM_STEP))
+        for button in (self.btn_zoom_fit, self.btn_zoom_actual, self.btn_zoom_in, self.btn_zoom_out):
+            button.setEnabled(False)
+            button_layout.addWidget(button)
+        
+        # Кнопка для отмены выполняющейся разрезки
+        self.btn_cancel = QPushButton("Отменить разрезку")
+        self.btn_cancel.clicked.connect(self.cancel_cut)
+        self.btn_cancel.setMinimumWidth(150)
+        self.btn_cancel.setEnabled(False)
+        button_layout.addWidget(self.btn_cancel)
+        
         main_layout.addLayout(button_layout)
         
         # Добавление строки состояния
@@ -106,8 +248,24 @@ class ImageCutterAppEnhanced(QMainWindow):
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("Готово")
         
+        # Индикатор прогресса разрезки
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.hide()
+        self.status_bar.addPermanentWidget(self.progress_bar)
+        
+        # Время последней загрузки или разрезки; подробности по этапам - во всплывающей подсказке
+        self.timings_label = QLabel()
+        self.status_bar.addPermanentWidget(self.timings_label)
+        
         self.setCentralWidget(main_widget)
         
+        # Правка прямоугольников с клавиатуры
+        QShortcut(QKeySequence.Delete, self, self.delete_selected)
+        QShortcut(QKeySequence.Undo, self, self.undo)
+        QShortcut(QKeySequence.Redo, self, self.redo)
+        QShortcut(QKeySequence.Cancel, self, lambda: self.select(None))
+        
     def open_image(self):
         file_dialog = QFileDialog()
         file_path, _ = file_dialog.getOpenFileName(
@@ -115,119 +273,582 @@ class ImageCutterAppEnhanced(QMainWindow):
         )
         
         if file_path:
-            try:
-                self.status_bar.showMessage(f"Загрузка изображения: {file_path}")
-                self.image_path = file_path
-                
-                # Загружаем оригинальное изображение через PIL для поддержки TIFF
-                pil_image = Image.open(file_path)
-                # Сохраняем оригинальный размер
-                self.original_size = pil_image.size
-                
-                # Конвертируем в RGB, если нужно
-                if pil_image.mode != 'RGB':
-                    pil_image = pil_image.convert('RGB')
-                
-                # Преобразуем для отображения с уменьшенным размером для предпросмотра
-                # Максимальный размер для отображения
-                max_width = 1200
-                max_height = 800
-                width, height = pil_image.size
-                
-                self.scale_factor = min(max_width / width, max_height / height)
-                new_width = int(width * self.scale_factor)
-                new_height = int(height * self.scale_factor)
-                
-                # Уменьшаем для предпросмотра
-                pil_preview = pil_image.resize((new_width, new_height), Image.LANCZOS)
-                
-                # Конвертируем PIL изображение в QPixmap
-                img = pil_preview.convert("RGBA")
-                data = img.tobytes("raw", "RGBA")
-                qimg = QImage(data, img.width, img.height, QImage.Format_RGBA8888)
-                
-                self.original_pixmap = QPixmap.fromImage(qimg)
-                self.display_pixmap = self.original_pixmap.copy()
-                
-                # Устанавливаем изображение и размер метки
-                self.image_label.setPixmap(self.display_pixmap)
-                self.image_label.resize(self.display_pixmap.size())
-                
-                # Очищаем прямоугольники
-                self.rectangles = []
-                
-                # Устанавливаем размер виджета и обновляем интерфейс
-                self.btn_clear.setEnabled(True)
-                self.btn_cut.setEnabled(True)
-                
-                self.status_bar.showMessage(f"Изображение загружено: {width}x{height} пикселей")
-                
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Не удалось открыть изображение: {str(e)}")
-                self.status_bar.showMessage("Ошибка при загрузке изображения")
+            self.load_page(file_path)
+    
+    def load_page(self, file_path, page=0):
+        """Загружает страницу page файла; остальные страницы не читаются"""
+        self.expect_page(file_path, page)
+        
+        # Предпросмотр строится и фотографии ищутся в фоновом потоке
+        worker = LoadWorker(file_path, self.preview_cache, page)
+        worker.signals.loaded.connect(self.on_image_loaded)
+        worker.signals.failed.connect(self.on_image_load_failed)
+        self.load_workers.append(worker)
+        self.thread_pool.start(worker)
+    
+    def expect_page(self, file_path, page):
+        """Запоминает, какую страницу ждет окно: загрузки других страниц и файлов отбрасываются"""
+        # Загрузка может взять страницу из кэша: отложенные правки должны быть уже в нем
+        self.save_pending_rectangles()
+        self.status_bar.showMessage(f"Загрузка изображения: {file_path}")
+        self.loading_path = file_path
+        self.loading_page = page
+    
+    def show_page(self, step):
+        """Переходит на step страниц вперед или назад"""
+        index = self.pages.index(self.page) + step
+        if self.image_path and 0 <= index < len(self.pages):
+            self.load_page(self.image_path, self.pages[index])
+    
+    def on_image_loaded(self, file_path, page, pages, qimg, original_size, mode, scale_factor, boxes, from_cache,
+                        timings):
+        self.forget_worker(self.load_workers, file_path, page)
+        if (file_path, page) != (self.loading_path, self.loading_page):
+            return  # Пока страница загружалась, пользователь открыл другую
+        
+        self.show_timings(timings)
+        if file_path != self.image_path:
+            self.page_rectangles = {}
+        self.image_path = file_path
+        self.page = page
+        self.pages = pages
+        self.original_size = original_size
+        self.scale_factor = scale_factor
+        width, height = self.original_size
+        
+        self.original_pixmap = QPixmap.fromImage(qimg)
+        self.display_pixmap = self.original_pixmap.copy()
+        
+        # Тайлы в полном разрешении декодируются по мере увеличения
+        if self.tile_pyramid is not None:
+            self.tile_pyramid.close()
+        self.tile_pyramid = TilePyramid(file_path, original_size, page=page)
+        self.tile_pyramid.tile_ready.connect(self.on_tile_ready)
+        
+        # Начинаем с масштаба предпросмотра: изображение целиком помещается в окно
+        self.zoom = 0.0
+        self.set_zoom(self.scale_factor)
+        
+        # Прямоугольники уже просмотренной страницы, из кэша или найденные автоматически
+        boxes = self.page_rectangles.setdefault(page, boxes)
+        self.drawing = False
+        self.editing = None
+        self.selected = None
+        self.rotated = None
+        self.rectangles = RectStore(boxes)
+        self.history.clear()
+        self.invalidate_overlay()
+        
+        # Устанавливаем размер виджета и обновляем интерфейс
+        self.btn_clear.setEnabled(True)
+        self.btn_cut.setEnabled(True)
+        for button in (self.btn_zoom_fit, self.btn_zoom_actual, self.btn_zoom_in, self.btn_zoom_out):
+            button.setEnabled(True)
+        self.update_page_controls()
+        
+        page_info = f"Страница {pages.index(page) + 1} из {len(pages)}. " if len(pages) > 1 else ""
+        if from_cache:
+            self.status_bar.showMessage(f"{page_info}Изображение загружено из кэша: {width}x{height} пикселей, {mode}. Восстановлено выделений: {len(self.rectangles)}")
+        else:
+            self.status_bar.showMessage(f"{page_info}Изображение загружено: {width}x{height} пикселей, {mode}. Найдено фотографий: {len(self.rectangles)}")
+    
+    def update_page_controls(self):
+        index = self.pages.index(self.page)
+        multipage = len(self.pages) > 1
+        for widget in (self.btn_prev_page, self.page_label, self.btn_next_page, self.btn_cut_all):
+            widget.setVisible(multipage)
+        self.page_label.setText(f"Страница {index + 1} из {len(self.pages)}")
+        self.btn_prev_page.setEnabled(index > 0)
+        self.btn_next_page.setEnabled(index < len(self.pages) - 1)
+    
+    def on_image_load_failed(self, file_path, message):
+        self.forget_worker(self.load_workers, file_path)
+        if file_path != self.loading_path:
+            return
+        QMessageBox.critical(self, "Ошибка", f"Не удалось открыть изображение: {message}")
+        self.status_bar.showMessage("Ошибка при загрузке изображения")
+    
+    def toggle_watch(self, checked):
+        if checked:
+            self.start_watch()
+        elif self.folder_watcher is not None:
+            self.stop_watch()
+    
+    def start_watch(self):
+        """Включает наблюдение за папкой, в которую пишет сканер"""
+        input_dir = QFileDialog.getExistingDirectory(self, "Выберите папку, в которую пишет сканер")
+        output_dir = input_dir and QFileDialog.getExistingDirectory(self, "Выберите папку для сохранения результатов")
+        if not input_dir or not output_dir:
+            self.btn_watch.setChecked(False)
+            self.status_bar.showMessage("Операция отменена")
+            return
+        
+        self.watch_output_dir = output_dir
+        self.scan_queue = ScanQueue(self.preview_cache)
+        self.scan_queue.loaded.connect(self.on_image_loaded)
+        self.scan_queue.failed.connect(self.on_image_load_failed)
+        self.scan_queue.changed.connect(self.on_scan_queue_changed)
+        self.folder_watcher = FolderWatcher(input_dir)
+        self.folder_watcher.file_ready.connect(self.scan_queue.add)
+        
+        # Если скан еще не открыт, первый готовый файл открывается сам
+        self.waiting_for_scan = self.image_path is None
+        self.btn_watch.setText("Остановить наблюдение")
+        self.status_bar.showMessage(f"Наблюдение за папкой {input_dir}, результаты сохраняются в {output_dir}")
+        self.folder_watcher.start()
+    
+    def stop_watch(self):
+        self.folder_watcher.stop()
+        self.scan_queue.close()
+        self.folder_watcher = None
+        self.scan_queue = None
+        self.watch_output_dir = None
+        self.waiting_for_scan = False
+        self.btn_watch.setChecked(False)
+        self.btn_watch.setText("Следить за папкой")
+        self.btn_next.setText("Следующий скан")
+        self.btn_next.setEnabled(False)
+        self.status_bar.showMessage("Наблюдение за папкой остановлено")
+    
+    def on_scan_queue_changed(self, count, prepared):
+        self.btn_next.setText(f"Следующий скан ({count})" if count else "Следующий скан")
+        self.btn_next.setEnabled(count > 0)
+        self.btn_next.setToolTip(f"В очереди {count}, подготовлено {prepared}")
+        if count and self.waiting_for_scan:
+            self.next_scan()
+    
+    def next_scan(self):
+        """Открывает следующий скан из папки наблюдения"""
+        if self.scan_queue is None:
+            return
+        if not len(self.scan_queue):
+            # Текущий скан уже отправлен на разрезку: ждем, пока сканер запишет следующий
+            self.waiting_for_scan = True
+            self.btn_cut.setEnabled(False)
+            self.status_bar.showMessage("Ожидание новых сканов...")
+            return
+        
+        self.waiting_for_scan = False
+        file_path = self.scan_queue.take()
+        # Очередь сканов загружает первую страницу файла
+        self.expect_page(file_path, 0)
+        # Подготовленный скан показывается сразу, остальные - по готовности
+        self.scan_queue.activate(file_path)
+    
+    def forget_worker(self, workers, file_path, page=None):
+        """Удаляет завершившийся фоновый worker из списка активных"""
+        for worker in workers:
+            if worker.image_path == file_path and (page is None or worker.page == page):
+                workers.remove(worker)
+                break
+    
+    def view_to_original(self, pos):
+        """Переводит точку виджета изображения в координаты оригинала"""
+        width, height = self.original_size
+        x = min(max(int(pos.x() / self.zoom), 0), width)
+        y = min(max(int(pos.y() / self.zoom), 0), height)
+        return QPoint(x, y)
+    
+    def set_zoom(self, zoom, anchor=None):
+        """Меняет масштаб просмотра; точка anchor (в координатах виджета) остается на месте экрана"""
+        if not self.original_size:
+            return
+        zoom = min(max(zoom, self.scale_factor), max(MAX_ZOOM, self.scale_factor))
+        
+        h_bar = self.scroll_area.horizontalScrollBar()
+        v_bar = self.scroll_area.verticalScrollBar()
+        viewport = self.scroll_area.viewport()
+        if anchor is None:
+            anchor = QPoint(h_bar.value() + viewport.width() // 2, v_bar.value() + viewport.height() // 2)
+        offset_x = anchor.x() - h_bar.value()
+        offset_y = anchor.y() - v_bar.value()
+        old_zoom = self.zoom or zoom
+        original_x = anchor.x() / old_zoom
+        original_y = anchor.y() / old_zoom
+        
+        self.zoom = zoom
+        width, height = self.original_size
+        self.image_label.resize(QSize(int(width * zoom), int(height * zoom)))
+        h_bar.setValue(int(original_x * zoom - offset_x))
+        v_bar.setValue(int(original_y * zoom - offset_y))
+        
+        self.image_label.update()
+        self.status_bar.showMessage(f"Масштаб: {zoom * 100:.0f}%")
+    
+    def wheel_event(self, event):
+        if self.display_pixmap and event.modifiers() & Qt.ControlModifier:
+            step = ZOOM_STEP if event.angleDelta().y() > 0 else 1 / ZOOM_STEP
+            self.set_zoom(self.zoom * step, event.pos())
+            event.accept()
+        elif self.display_pixmap and event.modifiers() & Qt.ShiftModifier:
+            # Поворот прямоугольника под курсором; на некоторых системах Shift делает прокрутку горизонтальной
+            delta = event.angleDelta().y() or event.angleDelta().x()
+            index = self.rectangle_at(self.view_to_original(event.pos()))
+            if index is not None and delta and self.editing is None:
+                box = self.rectangles.box(index)
+                angle = box_angle(box) + (ROTATION_STEP if delta > 0 else -ROTATION_STEP)
+                angle = round((angle + 180) % 360 - 180, 2)
+                # Повороты одного прямоугольника подряд отменяются одним шагом
+                if self.rotated != index:
+                    self.history.record(self.rectangles)
+                    self.rotated = index
+                self.rectangles.update(index, make_box(*box[:4], angle))
+                self.rectangles_changed()
+                self.show_status_throttled(f"Поворот области: {angle:.1f}°")
+            event.accept()
+        else:
+            event.ignore()  # Обычную прокрутку выполняет QScrollArea
+    
+    def rectangle_at(self, point):
+        """Номер прямоугольника под точкой (в координатах оригинала) или None"""
+        hit = self.rectangles.hit(point.x(), point.y(), prefer=self.selected)
+        return hit[0] if hit else None
+    
+    def on_tile_ready(self, rect):
+        zoom = self.zoom
+        self.image_label.update(QRect(int(rect.x() * zoom), int(rect.y() * zoom),
+                                      int(rect.width() * zoom) + 2, int(rect.height() * zoom) + 2))
     
     def mouse_press_event(self, event):
-        if self.display_pixmap and event.button() == Qt.LeftButton:
+        if self.display_pixmap and event.button() == Qt.MiddleButton:
+            # Перетаскивание изображения средней кнопкой мыши
+            self.pan_start = (event.globalPos(), self.scroll_area.horizontalScrollBar().value(),
+                              self.scroll_area.verticalScrollBar().value())
+        elif self.display_pixmap and event.button() == Qt.LeftButton:
+            point = self.view_to_original(event.pos())
+            hit = self.rectangles.hit(point.x(), point.y(), HANDLE_TOLERANCE_PX / self.zoom, self.selected)
+            if hit is not None:
+                # Прямоугольник перетаскивается целиком или за сторону, угол
+                index, handle = hit
+                self.select(index)
+                box = self.rectangles.box(index)
+                self.editing = (handle, point, box)
+                self.edit_box = box
+                return
+            
+            self.select(None)
             self.drawing = True
-            self.start_point = event.pos()
-            self.current_point = event.pos()
+            self.start_point = point
+            self.current_point = self.start_point
             self.status_bar.showMessage(f"Начато выделение в точке ({self.start_point.x()}, {self.start_point.y()})")
     
     def mouse_move_event(self, event):
-        if self.drawing:
-            self.current_point = event.pos()
-            self.image_label.update()
-            self.status_bar.showMessage(f"Рисование прямоугольника: ({self.start_point.x()}, {self.start_point.y()}) -> ({self.current_point.x()}, {self.current_point.y()})")
+        if self.pan_start:
+            start, h_value, v_value = self.pan_start
+            delta = event.globalPos() - start
+            self.scroll_area.horizontalScrollBar().setValue(h_value - delta.x())
+            self.scroll_area.verticalScrollBar().setValue(v_value - delta.y())
+        elif self.drawing:
+            # Перерисовываем только объединение старого и нового положения рамки
+            old_rect = self.rubber_band_view_rect()
+            self.current_point = self.view_to_original(event.pos())
+            self.image_label.update(old_rect.united(self.rubber_band_view_rect()))
+            self.show_status_throttled(f"Рисование прямоугольника: ({self.start_point.x()}, {self.start_point.y()}) -> ({self.current_point.x()}, {self.current_point.y()})")
+        elif self.editing:
+            handle, start, box = self.editing
+            delta = self.view_to_original(event.pos()) - start
+            box = dragged_box(box, handle, delta.x(), delta.y())
+            box = self.rectangles.snap(box, handle, self.selected, SNAP_DISTANCE_PX / self.zoom)
+            if handle == MOVE:
+                box = self.keep_inside(box)
+            
+            # Перетаскиваемый прямоугольник рисуется поверх слоя, поэтому слой не перестраивается
+            old_rect = self.selection_view_rect()
+            self.edit_box = box
+            self.image_label.update(old_rect.united(self.selection_view_rect()))
+            x1, y1, x2, y2 = box[:4]
+            self.show_status_throttled(f"Прямоугольник: ({x1}, {y1}, {x2 - x1}x{y2 - y1})")
+        elif self.display_pixmap and not event.buttons():
+            point = self.view_to_original(event.pos())
+            hit = self.rectangles.hit(point.x(), point.y(), HANDLE_TOLERANCE_PX / self.zoom, self.selected)
+            if hit is not None:
+                self.image_label.setCursor(HANDLE_CURSORS[hit[1]])
+            else:
+                self.image_label.unsetCursor()
     
     def mouse_release_event(self, event):
-        if self.drawing and event.button() == Qt.LeftButton:
+        if self.pan_start and event.button() == Qt.MiddleButton:
+            self.pan_start = None
+        elif self.editing and event.button() == Qt.LeftButton:
+            box = self.edit_box
+            self.editing = None
+            self.edit_box = None
+            self.pending_status = None
+            x1, y1, x2, y2 = box[:4]
+            if box == self.rectangles.box(self.selected):
+                self.image_label.update(self.selection_view_rect())
+            elif min(x2 - x1, y2 - y1) * self.zoom < 5:
+                self.image_label.update()
+                self.status_bar.showMessage("Прямоугольник стал бы слишком маленьким и не был изменен")
+            else:
+                self.history.record(self.rectangles)
+                self.rotated = None
+                self.rectangles.update(self.selected, box)
+                self.rectangles_changed()
+                self.status_bar.showMessage(f"Прямоугольник изменен: ({x1}, {y1}, {x2 - x1}x{y2 - y1})")
+        elif self.drawing and event.button() == Qt.LeftButton:
             self.drawing = False
-            end_point = event.pos()
+            end_point = self.view_to_original(event.pos())
+            box = (self.start_point.x(), self.start_point.y(), end_point.x(), end_point.y())
             
-            # Добавляем прямоугольник только если его размер достаточно большой
-            if (self.start_point - end_point).manhattanLength() > 10:
-                self.rectangles.append(Rectangle(self.start_point, end_point))
-                rect = Rectangle(self.start_point, end_point).get_qrect()
-                self.status_bar.showMessage(f"Добавлен прямоугольник: ({rect.x()}, {rect.y()}, {rect.width()}x{rect.height()}). Всего областей: {len(self.rectangles)}")
+            # Добавляем прямоугольник только если его размер на экране достаточно большой
+            if is_drawn_box(box, self.zoom):
+                self.history.record(self.rectangles)
+                self.rotated = None
+                self.selected = self.rectangles.append(box)
+                x1, y1, x2, y2 = self.rectangles.box(self.selected)
+                self.status_bar.showMessage(f"Добавлен прямоугольник: ({x1}, {y1}, {x2 - x1}x{y2 - y1}). Всего областей: {len(self.rectangles)}")
             else:
                 self.status_bar.showMessage("Прямоугольник слишком маленький и не был добавлен")
+            self.pending_status = None
             
-            self.image_label.update()
+            self.rectangles_changed()
+    
+    def keep_inside(self, box):
+        """Сдвигает область внутрь изображения"""
+        width, height = self.original_size
+        left, top, right, bottom = bounding_box(box)
+        dx = -left if left < 0 else min(0, width - right)
+        dy = -top if top < 0 else min(0, height - bottom)
+        x1, y1, x2, y2 = box[:4]
+        return make_box(x1 + dx, y1 + dy, x2 + dx, y2 + dy, box_angle(box))
+    
+    def paint_image(self, painter, view_rect):
+        """Рисует видимую часть изображения: предпросмотр или тайлы нужного уровня"""
+        zoom = self.zoom
+        width, height = self.original_size
+        preview_zoom = self.display_pixmap.width() / width
+        
+        if zoom <= preview_zoom * 1.01 or self.tile_pyramid is None:
+            # Разрешения предпросмотра достаточно
+            painter.drawPixmap(QRectF(0, 0, width * zoom, height * zoom), self.display_pixmap,
+                               QRectF(self.display_pixmap.rect()))
+            return
+        
+        level = TilePyramid.level_for_zoom(zoom)
+        for key in self.tile_pyramid.tiles_in(self.view_rect_to_original(view_rect), level):
+            rect = self.tile_pyramid.tile_rect(key)
+            target = QRectF(rect.x() * zoom, rect.y() * zoom, rect.width() * zoom, rect.height() * zoom)
+            tile = self.tile_pyramid.tile(key)
+            if tile is not None:
+                painter.drawImage(target, tile, QRectF(tile.rect()))
+            else:
+                # Пока тайл декодируется, показываем растянутый предпросмотр
+                source = QRectF(rect.x() * preview_zoom, rect.y() * preview_zoom,
+                                rect.width() * preview_zoom, rect.height() * preview_zoom)
+                painter.drawPixmap(target, self.display_pixmap, source)
+        
+        # Запрашиваем тайлы всей видимой части окна, а не только перерисовываемой области
+        visible = self.visible_view_rect()
+        self.tile_pyramid.request(self.tile_pyramid.tiles_in(self.view_rect_to_original(visible), level))
+    
+    def visible_view_rect(self):
+        """Видимая в окне прокрутки часть виджета изображения"""
+        viewport = self.scroll_area.viewport()
+        visible = QRect(self.scroll_area.horizontalScrollBar().value(), self.scroll_area.verticalScrollBar().value(),
+                        viewport.width(), viewport.height())
+        return visible.intersected(self.image_label.rect())
+    
+    def rubber_band_view_rect(self):
+        """Область виджета под рисуемым прямоугольником с запасом на толщину пера"""
+        zoom = self.zoom
+        rect = self.rubber_band_rect()
+        return QRect(int(rect.x() * zoom), int(rect.y() * zoom),
+                     int(rect.width() * zoom) + 1, int(rect.height() * zoom) + 1).adjusted(-3, -3, 3, 3)
+    
+    def rubber_band_rect(self):
+        """Рисуемый прямоугольник в координатах оригинала"""
+        return QRect(
+            min(self.start_point.x(), self.current_point.x()),
+            min(self.start_point.y(), self.current_point.y()),
+            abs(self.start_point.x() - self.current_point.x()),
+            abs(self.start_point.y() - self.current_point.y())
+        )
+    
+    def selection_view_rect(self):
+        """Область виджета под выделенным прямоугольником с запасом на маркеры"""
+        if self.selected is None:
+            return QRect()
+        zoom = self.zoom
+        left, top, right, bottom = bounding_box(self.edit_box or self.rectangles.box(self.selected))
+        margin = HANDLE_SIZE_PX + 2
+        return QRect(int(left * zoom), int(top * zoom), int((right - left) * zoom) + 1,
+                     int((bottom - top) * zoom) + 1).adjusted(-margin, -margin, margin, margin)
+    
+    def invalidate_overlay(self):
+        self.overlay = None
+    
+    def rectangles_overlay(self, visible):
+        """Возвращает слой с сохраненными прямоугольниками для видимой области"""
+        dpr = self.image_label.devicePixelRatioF()
+        key = (visible.x(), visible.y(), visible.width(), visible.height(), self.zoom, dpr)
+        if self.overlay is not None and self.overlay_key == key:
+            return self.overlay
+        
+        overlay = QPixmap(max(1, int(visible.width() * dpr)), max(1, int(visible.height() * dpr)))
+        overlay.setDevicePixelRatio(dpr)
+        overlay.fill(Qt.transparent)
+        
+        painter = QPainter(overlay)
+        painter.translate(-visible.x(), -visible.y())
+        painter.scale(self.zoom, self.zoom)
+        self.setup_rectangle_pen(painter)
+        # Рисуются только прямоугольники видимой области; выделенный рисуется поверх слоя
+        area = self.view_rect_to_original(visible)
+        for index in self.rectangles.within(area.x(), area.y(), area.x() + area.width(), area.y() + area.height()):
+            if index != self.selected:
+                painter.drawPolygon(box_polygon(self.rectangles.box(index)))
+        painter.end()
+        
+        self.overlay = overlay
+        self.overlay_key = key
+        return overlay
+    
+    def setup_rectangle_pen(self, painter):
+        """Настройка пера и заливки для прямоугольников"""
+        pen = QPen(Qt.red, 2, Qt.SolidLine)
+        pen.setCosmetic(True)  # Толщина линии не зависит от масштаба
+        painter.setPen(pen)
+        painter.setBrush(QColor(255, 0, 0, 30))  # Полупрозрачная заливка
+    
+    def paint_selection(self, painter):
+        """Рисует выделенный прямоугольник с маркерами углов и сторон"""
+        box = self.edit_box or self.rectangles.box(self.selected)
+        pen = QPen(QColor(0, 120, 215), 2, Qt.SolidLine)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        painter.setBrush(QColor(0, 120, 215, 40))
+        painter.drawPolygon(box_polygon(box))
+        
+        corners = rotated_corners(box)
+        middles = [((x1 + x2) / 2, (y1 + y2) / 2) for (x1, y1), (x2, y2) in zip(corners, corners[1:] + corners[:1])]
+        size = HANDLE_SIZE_PX / self.zoom
+        pen.setWidth(1)
+        painter.setPen(pen)
+        painter.setBrush(Qt.white)
+        for x, y in corners + middles:
+            painter.drawRect(QRectF(x - size / 2, y - size / 2, size, size))
+    
+    def show_status_throttled(self, message):
+        """Показывает сообщение не чаще, чем раз в STATUS_UPDATE_INTERVAL_MS"""
+        self.pending_status = message
+        if not self.status_timer.isActive():
+            self.show_pending_status()
+            self.status_timer.start()
+    
+    def show_pending_status(self):
+        if self.pending_status is not None:
+            self.status_bar.showMessage(self.pending_status)
+            self.pending_status = None
+    
+    def view_rect_to_original(self, rect):
+        """Переводит область виджета в координаты оригинала"""
+        zoom = self.zoom
+        return QRect(int(rect.x() / zoom), int(rect.y() / zoom),
+                     int(rect.width() / zoom) + 1, int(rect.height() / zoom) + 1)
     
     def paint_event(self, event):
         if self.display_pixmap:
             painter = QPainter(self.image_label)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
             
             # Отрисовка изображения
-            painter.drawPixmap(0, 0, self.display_pixmap)
+            self.paint_image(painter, event.rect())
             
-            # Настройка пера для прямоугольников
-            pen = QPen(Qt.red, 2, Qt.SolidLine)
-            painter.setPen(pen)
-            painter.setBrush(QColor(255, 0, 0, 30))  # Полупрозрачная заливка
+            # Существующие прямоугольники берутся из готового слоя
+            visible = self.visible_view_rect()
+            target = event.rect().intersected(visible)
+            if not target.isEmpty():
+                overlay = self.rectangles_overlay(visible)
+                dpr = overlay.devicePixelRatio()
+                source = target.translated(-visible.topLeft())
+                painter.drawPixmap(QRectF(target), overlay,
+                                   QRectF(source.x() * dpr, source.y() * dpr, source.width() * dpr, source.height() * dpr))
             
-            # Отрисовка существующих прямоугольников
-            for rect in self.rectangles:
-                painter.drawRect(rect.get_qrect())
+            # Прямоугольники заданы в координатах оригинала
+            painter.scale(self.zoom, self.zoom)
+            self.setup_rectangle_pen(painter)
             
             # Отрисовка прямоугольника, который сейчас рисуется
             if self.drawing:
-                current_rect = QRect(
-                    min(self.start_point.x(), self.current_point.x()),
-                    min(self.start_point.y(), self.current_point.y()),
-                    abs(self.start_point.x() - self.current_point.x()),
-                    abs(self.start_point.y() - self.current_point.y())
-                )
-                painter.drawRect(current_rect)
+                painter.drawRect(self.rubber_band_rect())
+            
+            if self.selected is not None:
+                self.paint_selection(painter)
             
             painter.end()
     
-    def clear_rectangles(self):
-        """Очищает все прямоугольники"""
-        self.rectangles = []
+    def select(self, index):
+        """Выделяет прямоугольник с номером index (None - снять выделение)"""
+        if index != self.selected:
+            self.selected = index
+            self.invalidate_overlay()
+            self.image_label.update()
+    
+    def delete_selected(self):
+        """Удаляет выделенный прямоугольник"""
+        if self.selected is None or self.editing:
+            return
+        self.history.record(self.rectangles)
+        self.rectangles.remove(self.selected)
+        self.selected = None
+        self.rotated = None
+        self.rectangles_changed()
+        self.status_bar.showMessage(f"Прямоугольник удален. Всего областей: {len(self.rectangles)}")
+    
+    def undo(self):
+        if self.editing or self.drawing or not self.history.undo(self.rectangles):
+            return
+        self.after_history()
+        self.status_bar.showMessage(f"Правка отменена. Всего областей: {len(self.rectangles)}")
+    
+    def redo(self):
+        if self.editing or self.drawing or not self.history.redo(self.rectangles):
+            return
+        self.after_history()
+        self.status_bar.showMessage(f"Правка повторена. Всего областей: {len(self.rectangles)}")
+    
+    def after_history(self):
+        # Номера прямоугольников после отмены могли измениться
+        self.selected = None
+        self.rotated = None
+        self.rectangles_changed()
+    
+    def rectangles_changed(self):
+        """Перерисовывает прямоугольники после правки и запоминает их"""
+        self.invalidate_overlay()
+        self.remember_rectangles()
         self.image_label.update()
+    
+    def clear_rectangles(self):
+        """Очищает все прямоугольники; очистку можно отменить"""
+        if self.rectangles:
+            self.history.record(self.rectangles)
+        self.rectangles.clear()
+        self.selected = None
+        self.rotated = None
+        self.rectangles_changed()
         self.status_bar.showMessage("Все выделения очищены")
     
+    def remember_rectangles(self):
+        """Запоминает прямоугольники страницы и сохраняет их в кэш, чтобы восстановить при повторном открытии файла.
+
+        Запись в кэш откладывается до паузы в правках: при перетаскивании
+        и повороте колесом файл не перечитывается на каждый шаг.
+        """
+        if self.image_path:
+            boxes = self.rectangles.boxes()
+            self.page_rectangles[self.page] = boxes
+            self.pending_rectangles[(self.image_path, self.page)] = boxes
+            self.rectangles_timer.start()
+    
+    def save_pending_rectangles(self):
+        """Записывает в кэш отложенные прямоугольники"""
+        self.rectangles_timer.stop()
+        pending, self.pending_rectangles = self.pending_rectangles, {}
+        for (image_path, page), boxes in pending.items():
+            self.preview_cache.update_rectangles(image_path, boxes, page)
+    
     def cut_image(self):
         if not self.image_path:
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
@@ -237,85 +858,165 @@ class ImageCutterAppEnhanced(QMainWindow):
             QMessageBox.warning(self, "Предупреждение", "Выделите области перед разрезкой")
             return
         
-        try:
-            self.status_bar.showMessage("Выполняется разрезка изображения...")
-            
-            # Открываем исходное изображение с полным качеством
-            pil_image = Image.open(self.image_path)
-            original_mode = pil_image.mode
-            
-            if original_mode != 'RGB':
-                pil_image = pil_image.convert('RGB')
-            
-            # Получаем директорию и имя файла для сохранения результатов
-            output_dir = QFileDialog.getExistingDirectory(self, "Выберите папку для сохранения результатов")
-            if not output_dir:
-                self.status_bar.showMessage("Операция отменена")
-                return
-            
-            base_name = os.path.splitext(os.path.basename(self.image_path))[0]
-            
-            # Масштабируем координаты областей обратно к оригинальному размеру
-            orig_width, orig_height = self.original_size
-            preview_width = self.display_pixmap.width()
-            preview_height = self.display_pixmap.height()
-            scale_x = orig_width / preview_width
-            scale_y = orig_height / preview_height
-            
-            # Обрезаем и сохраняем каждую область
-            saved_count = 0
-            for i, rect in enumerate(self.rectangles, 1):
-                # Получаем координаты прямоугольника и масштабируем их к оригинальному размеру
-                x1, y1, x2, y2 = rect.to_cv_coords(1.0)  # Получаем координаты без масштабирования
-                
-                # Масштабируем координаты к оригинальному размеру
-                orig_x1 = int(x1 * scale_x)
-                orig_y1 = int(y1 * scale_y)
-                orig_x2 = int(x2 * scale_x)
-                orig_y2 = int(y2 * scale_y)
-                
-                # Обеспечиваем, чтобы координаты были в пределах изображения
-                orig_x1 = max(0, min(orig_x1, orig_width - 1))
-                orig_y1 = max(0, min(orig_y1, orig_height - 1))
-                orig_x2 = max(0, min(orig_x2, orig_width))
-                orig_y2 = max(0, min(orig_y2, orig_height))
-                
-                # Проверяем размер области
-                if orig_x2 - orig_x1 < 10 or orig_y2 - orig_y1 < 10:
-                    continue  # Пропускаем слишком маленькие области
-                
-                # Обрезаем изображение
-                cropped = pil_image.crop((orig_x1, orig_y1, orig_x2, orig_y2))
-                
-                # Формируем имя выходного файла
-                output_filename = f"{base_name}_cutted_{i}.tiff"
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # Возвращаем к оригинальному формату, если необходимо
-                if original_mode != 'RGB':
-                    cropped = cropped.convert(original_mode)
-                
-                # Сохраняем с оригинальным качеством
-                cropped.save(output_path, format="TIFF", compression="tiff_lzw")
-                saved_count += 1
-                
-                self.status_bar.showMessage(f"Сохранена область {i} из {len(self.rectangles)}: {output_filename}")
-            
-            if saved_count > 0:
-                QMessageBox.information(self, "Готово", f"Изображение успешно разрезано на {saved_count} частей и сохранено в:\n{output_dir}")
-                self.status_bar.showMessage(f"Готово: сохранено {saved_count} областей")
+        output_dir = self.choose_output_dir()
+        if not output_dir:
+            return
+        
+        # Координаты областей уже заданы в пикселях оригинала
+        boxes = self.rectangles.boxes()
+        self.start_cut({self.page: boxes}, output_dir)
+        
+        # В режиме наблюдения разрезка идет в очереди, а оператор сразу переходит
+        # к следующей странице или следующему скану
+        if self.scan_queue is not None:
+            if self.pages.index(self.page) < len(self.pages) - 1:
+                self.show_page(1)
             else:
-                QMessageBox.warning(self, "Предупреждение", "Не удалось сохранить ни одной области. Проверьте выделения.")
-                self.status_bar.showMessage("Не удалось сохранить ни одной области")
-            
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось разрезать изображение: {str(e)}")
-            self.status_bar.showMessage(f"Ошибка: {str(e)}")
-            print(f"Ошибка: {str(e)}")
+                self.next_scan()
+    
+    def cut_all_pages(self):
+        """Разрезает все страницы файла за один проход.
+        
+        Для просмотренных страниц используются их прямоугольники, для остальных -
+        сохраненные в кэше; если их нет, фотографии ищутся во время разрезки.
+        """
+        if not self.image_path:
+            QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
+            return
+        
+        output_dir = self.choose_output_dir()
+        if not output_dir:
+            return
+        
+        unseen = [page for page in self.pages if page not in self.page_rectangles]
+        page_boxes = self.preview_cache.rectangles(self.image_path, unseen) if unseen else {}
+        page_boxes.update(self.page_rectangles)
+        self.start_cut(page_boxes, output_dir)
+        
+        if self.scan_queue is not None:
+            self.next_scan()
+    
+    def choose_output_dir(self):
+        """Папка для результатов: папка режима наблюдения или выбранная пользователем"""
+        if self.scan_queue is not None:
+            return self.watch_output_dir
+        output_dir = QFileDialog.getExistingDirectory(self, "Выберите папку для сохранения результатов")
+        if not output_dir:
+            self.status_bar.showMessage("Операция отменена")
+        return output_dir
+    
+    def start_cut(self, page_boxes, output_dir):
+        # Разрезка идет в фоновом потоке: тем временем можно открыть следующий скан
+        duplicates = None
+        if self.check_duplicates.isChecked():
+            from duplicates import DuplicateIndex
+            # Индекс загружается при первой проверке в фоновом потоке и остается в памяти для следующих разрезок
+            duplicates = self.duplicate_indexes.get(output_dir)
+            if duplicates is None:
+                duplicates = self.duplicate_indexes[output_dir] = DuplicateIndex(output_dir)
+        worker = CutWorker(self.image_path, page_boxes, output_dir, self.profile_combo.currentData(), duplicates)
+        worker.signals.progress.connect(self.on_cut_progress)
+        worker.signals.finished.connect(self.on_cut_finished)
+        worker.signals.failed.connect(self.on_cut_failed)
+        self.cut_workers.append(worker)
+        self.thread_pool.start(worker)
+        
+        self.btn_cancel.setEnabled(True)
+        self.progress_bar.setRange(0, sum(len(boxes) for boxes in page_boxes.values() if boxes is not None))
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.status_bar.showMessage("Выполняется разрезка изображения...")
+    
+    def cancel_cut(self):
+        """Отменяет все выполняющиеся разрезки"""
+        for worker in self.cut_workers:
+            worker.cancel()
+        self.status_bar.showMessage("Отмена разрезки...")
+    
+    def on_cut_progress(self, image_path, processed, total, output_filename):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(processed)
+        if output_filename:
+            self.status_bar.showMessage(f"Сохранена область {processed} из {total}: {output_filename}")
+    
+    def on_cut_finished(self, image_path, saved_count, output_dir, cancelled, summary, timings, matches):
+        self.forget_worker(self.cut_workers, image_path)
+        self.update_cut_controls()
+        self.show_timings(timings)
+        self.show_matches(matches)
+        
+        summary = f" ({summary})" if summary else ""
+        if cancelled:
+            self.status_bar.showMessage(f"Разрезка отменена: сохранено {saved_count} областей{summary}")
+        elif saved_count > 0:
+            self.status_bar.showMessage(f"Готово: сохранено {saved_count} областей в {output_dir}{summary}")
+        else:
+            QMessageBox.warning(self, "Предупреждение", "Не удалось сохранить ни одной области. Проверьте выделения.")
+            self.status_bar.showMessage("Не удалось сохранить ни одной области")
+    
+    def on_cut_failed(self, image_path, message):
+        self.forget_worker(self.cut_workers, image_path)
+        self.update_cut_controls()
+        
+        QMessageBox.critical(self, "Ошибка", f"Не удалось разрезать изображение: {message}")
+        self.status_bar.showMessage(f"Ошибка: {message}")
+        print(f"Ошибка: {message}")
+    
+    def show_matches(self, matches):
+        """Показывает найденные при разрезке повторы в подсказке строки состояния"""
+        if not matches:
+            self.status_bar.setToolTip("")
+            return
+        lines = [f"{name}: повтор {match}" for name, match in matches[:MATCHES_TOOLTIP_LINES]]
+        if len(matches) > MATCHES_TOOLTIP_LINES:
+            lines.append(f"... и еще {len(matches) - MATCHES_TOOLTIP_LINES}")
+        self.status_bar.setToolTip("Найденные повторы:\n" + "\n".join(lines))
+    
+    def show_timings(self, timings):
+        """Показывает в строке состояния замеры последней операции (StageTimings)"""
+        from instrumentation import TIMINGS_LOG_NAME, default_log_dir
+        
+        self.timings_label.setText(timings.summary())
+        self.timings_label.setToolTip(f"{timings.details()}\n"
+                                      f"Журнал: {os.path.join(default_log_dir(), TIMINGS_LOG_NAME)}")
+    
+    def update_cut_controls(self):
+        """Скрывает индикатор прогресса, когда не осталось активных разрезок"""
+        if not self.cut_workers:
+            self.btn_cancel.setEnabled(False)
+            self.progress_bar.hide()
+    
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.startup_time is None:
+            self.startup_time = time.perf_counter() - LAUNCH_TIME
+            self.first_painted.emit(self.startup_time)
+    
+    def closeEvent(self, event):
+        # Дожидаемся завершения фоновых задач, чтобы не оставить недописанные файлы
+        if self.folder_watcher is not None:
+            self.stop_watch()
+        self.cancel_cut()
+        self.thread_pool.waitForDone()
+        self.save_pending_rectangles()
+        if self.tile_pyramid is not None:
+            self.tile_pyramid.close()
+        super().closeEvent(event)
+
+def report_startup(app, seconds):
+    """Выводит время запуска и завершает приложение с кодом 1 при превышении бюджета"""
+    within_budget = seconds <= STARTUP_BUDGET_SECONDS
+    print(f"Время до первой отрисовки: {seconds:.3f} с (бюджет {STARTUP_BUDGET_SECONDS:.3f} с)")
+    app.exit(0 if within_budget else 1)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     app.setStyle('Fusion')  # Устанавливаем стиль приложения
+    if '--trace' in sys.argv:
+        from instrumentation import set_trace
+        set_trace(True)
     window = ImageCutterAppEnhanced()
+    if '--startup-check' in sys.argv:
+        window.first_painted.connect(lambda seconds: report_startup(app, seconds))
     window.show()
     sys.exit(app.exec_()) 
\ No newline at end of file
@@ -0,0 +1,381 @@
+"""Замеры этапов загрузки и разрезки: время, объем данных и память.
+
+Каждая операция (загрузка страницы, разрезка файла) собирает StageTimings:
+время, число вызовов и объем данных по этапам, а в конце - текущий и пиковый
+RSS процесса. Итог показывается в строке состояния и записывается строкой
+JSON в журнал timings.jsonl с ротацией (папка PHOTO_CUTTER_LOG_DIR или
+стандартная папка кэша пользователя).
+
+С трассировкой (PHOTO_CUTTER_TRACE=1 или флаг --trace) операция дополнительно
+профилируется cProfile и tracemalloc: в журнал попадают самые долгие функции
+и места наибольших выделений памяти, а полный профиль сохраняется рядом
+в файл .prof (открывается python -m pstats или snakeviz).
+"""
+import io
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Журнал замеров и его ротация: при превышении размера файл переименовывается в .1, .2, ...
+TIMINGS_LOG_NAME = 'timings.jsonl'
+TIMINGS_LOG_MAX_BYTES = 5 * 1024 * 1024
+TIMINGS_LOG_BACKUPS = 3
+
+# Сколько функций и мест выделения памяти попадает в журнал при трассировке
+TRACE_TOP = 15
+# Сколько последних файлов профиля хранится в папке журнала
+TRACE_FILES_KEEP = 20
+
+# Сколько самых долгих этапов показывается в строке состояния
+SUMMARY_STAGES = 3
+
+OPERATION_TITLES = {'load': "Загрузка", 'export': "Разрезка"}
+
+STAGE_TITLES = {
+    'scan': "чтение структуры",
+    'cache': "кэш",
+    'decode': "декодирование",
+    'convert': "преобразование",
+    'resize': "уменьшение",
+    'rotate': "выпрямление",
+    'detect': "поиск фото",
+    'hash': "хэши",
+    'manifest': "манифест",
+    'encode': "кодирование",
+    'write': "запись",
+}
+
+MB = 1024 * 1024
+
+_trace = os.environ.get('PHOTO_CUTTER_TRACE') == '1'
+# cProfile может работать только в одном потоке одновременно
+_trace_lock = threading.Lock()
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def set_trace(enabled):
+    """Включает или выключает трассировку операций cProfile и tracemalloc"""
+    global _trace
+    _trace = enabled
+
+
+def trace_enabled():
+    return _trace
+
+
+def default_log_dir():
+    """Папка журнала: PHOTO_CUTTER_LOG_DIR или стандартная папка кэша пользователя"""
+    directory = os.environ.get('PHOTO_CUTTER_LOG_DIR')
+    if directory:
+        return directory
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'photo_cutter', 'logs')
+
+
+def peak_rss_mb():
+    """Пиковый RSS текущего процесса в МБ или None, если его нельзя узнать"""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / MB
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    return peak / MB if sys.platform == 'darwin' else peak / 1024
+
+
+def rss_mb():
+    """Текущий RSS процесса в МБ или None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / MB
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / MB
+
+
+def stage(timings, name):
+    """Замер этапа name, если timings передан"""
+    return timings.stage(name) if timings is not None else nullcontext()
+
+
+class StageTimings:
+    """Время, число вызовов и объем данных по этапам одной операции.
+
+    Этапы могут замеряться из нескольких потоков (кодирование идет
+    параллельно), поэтому сумма времени этапов бывает больше времени операции.
+    """
+
+    def __init__(self, operation, path=None):
+        self.operation = operation
+        self.path = path
+        self.stages = {}   # Этап -> [секунды, вызовы, байты]
+        self.extra = {}    # Прочие сведения для журнала
+        self.seconds = None
+        self.rss_mb = None
+        self.peak_rss_mb = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds=0.0, nbytes=0, calls=1):
+        with self._lock:
+            totals = self.stages.setdefault(name, [0.0, 0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+            totals[2] += nbytes
+
+    def count_bytes(self, name, nbytes):
+        """Объем данных этапа, который известен только после него"""
+        self.add(name, nbytes=nbytes, calls=0)
+
+    def finish(self):
+        """Завершает операцию: время целиком и память процесса"""
+        self.seconds = time.perf_counter() - self._started
+        self.rss_mb = rss_mb()
+        self.peak_rss_mb = peak_rss_mb()
+        return self
+
+    def as_dict(self):
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'operation': self.operation,
+            'path': self.path,
+            'seconds': round(self.seconds, 4) if self.seconds is not None else None,
+            'rss_mb': round(self.rss_mb, 1) if self.rss_mb is not None else None,
+            'peak_rss_mb': round(self.peak_rss_mb, 1) if self.peak_rss_mb is not None else None,
+            'stages': {
+                name: {'seconds': round(seconds, 4), 'calls': calls, 'mb': round(nbytes / MB, 2)}
+                for name, (seconds, calls, nbytes) in self.stages.items()
+            },
+        }
+        record.update(self.extra)
+        return record
+
+    def summary(self):
+        """Короткая строка для строки состояния: время операции и самые долгие этапы"""
+        title = OPERATION_TITLES.get(self.operation, self.operation)
+        longest = sorted(self.stages.items(), key=lambda item: -item[1][0])[:SUMMARY_STAGES]
+        parts = [f"{STAGE_TITLES.get(name, name)} {seconds:.2f}" for name, (seconds, _, _) in longest if seconds]
+        text = f"{title} {self.seconds or 0.0:.2f} с"
+        return f"{text} ({', '.join(parts)})" if parts else text
+
+    def details(self):
+        """Все этапы по строкам: время, вызовы, объем и скорость; в конце - память"""
+        lines = [self.summary()]
+        for name, (seconds, calls, nbytes) in sorted(self.stages.items(), key=lambda item: -item[1][0]):
+            line = f"{STAGE_TITLES.get(name, name)}: {seconds:.3f} с, вызовов {calls}"
+            if nbytes:
+                line += f", {nbytes / MB:.1f} МБ"
+                if seconds:
+                    line += f" ({nbytes / MB / seconds:.1f} МБ/с)"
+            lines.append(line)
+        if self.rss_mb is not None:
+            lines.append(f"Память: {self.rss_mb:.0f} МБ, пик {self.peak_rss_mb or 0.0:.0f} МБ")
+        if 'trace' in self.extra:
+            lines.append(f"Профиль: {self.extra['trace'].get('profile')}")
+        return '\n'.join(lines)
+
+
+class TimedFile:
+    """Файл для записи результата, который отделяет время записи на диск от кодирования.
+
+    Кодеры пишут в файл через write(); fileno() недоступен, поэтому запись не
+    уходит мимо замера. Время внутри encoding() без времени записи относится
+    к этапу encode, время записи - к этапу write.
+    """
+
+    def __init__(self, path, timings):
+        self.name = path
+        self.timings = timings
+        self.seconds = 0.0
+        self.nbytes = 0
+        self._file = open(path, 'wb')
+
+    def write(self, data):
+        started = time.perf_counter()
+        written = self._file.write(data)
+        self.seconds += time.perf_counter() - started
+        self.nbytes += written if written is not None else len(data)
+        return written
+
+    def flush(self):
+        started = time.perf_counter()
+        self._file.flush()
+        self.seconds += time.perf_counter() - started
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def seekable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return False
+
+    def fileno(self):
+        raise io.UnsupportedOperation('fileno')
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    @contextmanager
+    def encoding(self):
+        started, written = time.perf_counter(), self.seconds
+        try:
+            yield
+        finally:
+            self.timings.add('encode', time.perf_counter() - started - (self.seconds - written))
+
+    def close(self):
+        if self._file.closed:
+            return
+        started = time.perf_counter()
+        self._file.close()
+        self.seconds += time.perf_counter() - started
+        self.timings.add('write', self.seconds, self.nbytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@contextmanager
+def traced(timings):
+    """Профилирует операцию cProfile и tracemalloc, если включена трассировка.
+
+    Профилируется поток, в котором выполняется операция; потоки кодирования
+    видны в нем как ожидание. Если другая операция уже трассируется,
+    эта выполняется без трассировки.
+    """
+    if not _trace or not _trace_lock.acquire(blocking=False):
+        yield
+        return
+
+    import cProfile
+    import tracemalloc
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            timings.extra['trace'] = _trace_record(timings, profiler, snapshot, peak)
+    finally:
+        _trace_lock.release()
+
+
+def _trace_record(timings, profiler, snapshot, peak):
+    import pstats
+
+    stats = pstats.Stats(profiler)
+    functions = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:TRACE_TOP]
+    allocations = snapshot.statistics('lineno')[:TRACE_TOP]
+    record = {
+        'python_peak_mb': round(peak / MB, 2),
+        'functions': [
+            {'function': f"{name} ({os.path.basename(filename)}:{line})", 'calls': calls,
+             'seconds': round(own, 4), 'cumulative': round(cumulative, 4)}
+            for (filename, line, name), (_, calls, own, cumulative, _) in functions
+        ],
+        'allocations': [
+            {'where': f"{os.path.basename(item.traceback[0].filename)}:{item.traceback[0].lineno}",
+             'mb': round(item.size / MB, 2), 'blocks': item.count}
+            for item in allocations
+        ],
+    }
+
+    directory = default_log_dir()
+    name = f"{timings.operation}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}.prof"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        record['profile'] = os.path.join(directory, name)
+        stats.dump_stats(record['profile'])
+        _remove_old_profiles(directory)
+    except OSError as e:
+        print(f"Не удалось сохранить профиль: {e}")
+    return record
+
+
+def _remove_old_profiles(directory):
+    profiles = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.prof')),
+                      key=lambda entry: entry.stat().st_mtime)
+    for entry in profiles[:-TRACE_FILES_KEEP]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _timings_logger():
+    # logging импортируется здесь: модуль подключается при запуске окна
+    import logging
+    from logging.handlers import RotatingFileHandler
+
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            directory = default_log_dir()
+            os.makedirs(directory, exist_ok=True)
+            handler = RotatingFileHandler(os.path.join(directory, TIMINGS_LOG_NAME), maxBytes=TIMINGS_LOG_MAX_BYTES,
+                                          backupCount=TIMINGS_LOG_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger = logging.getLogger('photo_cutter.timings')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _logger = logger
+        return _logger
+
+
+def log_timings(record):
+    """Записывает замеры операции (StageTimings или его as_dict()) строкой JSON в журнал.
+
+    Журнал пишет только один процесс: рабочие процессы пакетной разрезки
+    возвращают замеры главному.
+    """
+    if isinstance(record, StageTimings):
+        record = record.as_dict()
+    try:
+        _timings_logger().info(json.dumps(record, ensure_ascii=False))
+    except OSError as e:
+        print(f"Не удалось записать журнал замеров: {e}")
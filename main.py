@@ -1,41 +1,42 @@
 import sys
 import os
-import numpy as np
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QLabel, QPushButton, 
-                            QVBoxLayout, QHBoxLayout, QWidget, QFileDialog, 
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QLabel, QPushButton,
+                            QVBoxLayout, QHBoxLayout, QWidget, QFileDialog,
                             QMessageBox, QScrollArea)
-from PyQt5.QtGui import QPixmap, QPainter, QPen, QImage, QColor
-from PyQt5.QtCore import Qt, QPoint, QRect, QLine
-from PIL import Image
+from PyQt5.QtGui import QPixmap, QPainter, QPen, QColor
+from PyQt5.QtCore import Qt, QRect
 
-class Rectangle:
-    def __init__(self, start, end):
-        self.start = start
-        self.end = end
-        
-    def get_qrect(self):
-        """Возвращает QRect для отрисовки прямоугольника"""
-        return QRect(
-            min(self.start.x(), self.end.x()),
-            min(self.start.y(), self.end.y()),
-            abs(self.start.x() - self.end.x()),
-            abs(self.start.y() - self.end.y())
-        )
+from engine import cut, is_drawn_box, load_page
+from preview_cache import PreviewCache
+from workers import to_qimage
+
+# Максимальный размер предпросмотра в окне
+PREVIEW_MAX_WIDTH = 1000
+PREVIEW_MAX_HEIGHT = 800
+
+def preview_qrect(box):
+    """QRect для отрисовки области (x1, y1, x2, y2) предпросмотра"""
+    x1, y1, x2, y2 = box[:4]
+    return QRect(min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1))
 
 class ImageCutterApp(QMainWindow):
+    """Простое окно разрезки: загрузка, пересчет координат и сохранение выполняются engine"""
+    
     def __init__(self):
         super().__init__()
         self.init_ui()
         
         # Переменные для работы с изображением
         self.image_path = None
+        self.page = None           # Загруженная страница (engine.LoadedPage)
         self.original_pixmap = None
         self.display_pixmap = None
-        self.rectangles = []
+        self.rectangles = []       # Области в координатах оригинала
+        self.preview_cache = PreviewCache()   # Общий с основным окном кэш предпросмотров
         self.drawing = False
         self.start_point = None
         self.current_point = None
-        
+    
     def init_ui(self):
         self.setWindowTitle('Разрезка сканированных изображений')
         self.setGeometry(100, 100, 1200, 800)
@@ -81,7 +82,7 @@ class ImageCutterApp(QMainWindow):
         main_layout.addLayout(button_layout)
         
         self.setCentralWidget(main_widget)
-        
+    
     def open_image(self):
         file_dialog = QFileDialog()
         file_path, _ = file_dialog.getOpenFileName(
@@ -90,32 +91,13 @@ class ImageCutterApp(QMainWindow):
         
         if file_path:
             try:
+                # Предпросмотр строится без декодирования всего оригинала (или берется из кэша);
+                # фотографии не ищутся
+                self.page = load_page(file_path, cache=self.preview_cache, detect=False,
+                                      max_width=PREVIEW_MAX_WIDTH, max_height=PREVIEW_MAX_HEIGHT)
                 self.image_path = file_path
-                # Загружаем оригинальное изображение через PIL для поддержки TIFF
-                pil_image = Image.open(file_path)
-                # Конвертируем в RGB, если нужно
-                if pil_image.mode != 'RGB':
-                    pil_image = pil_image.convert('RGB')
-                
-                # Преобразуем для отображения с уменьшенным размером для предпросмотра
-                # Максимальный размер для отображения
-                max_width = 1000
-                max_height = 800
-                width, height = pil_image.size
-                
-                scale = min(max_width / width, max_height / height)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                
-                # Уменьшаем для предпросмотра
-                pil_preview = pil_image.resize((new_width, new_height), Image.LANCZOS)
                 
-                # Конвертируем PIL изображение в QPixmap
-                img = pil_preview.convert("RGBA")
-                data = img.tobytes("raw", "RGBA")
-                qimg = QImage(data, img.width, img.height, QImage.Format_RGBA8888)
-                
-                self.original_pixmap = QPixmap.fromImage(qimg)
+                self.original_pixmap = QPixmap.fromImage(to_qimage(self.page.preview))
                 self.display_pixmap = self.original_pixmap.copy()
                 
                 # Устанавливаем изображение и размер метки
@@ -128,7 +110,7 @@ class ImageCutterApp(QMainWindow):
                 # Устанавливаем размер виджета и обновляем интерфейс
                 self.btn_clear.setEnabled(True)
                 self.btn_cut.setEnabled(True)
-                
+            
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", f"Не удалось открыть изображение: {str(e)}")
     
@@ -146,9 +128,11 @@ class ImageCutterApp(QMainWindow):
     def mouse_release_event(self, event):
         if self.drawing and event.button() == Qt.LeftButton:
             self.drawing = False
+            x1, x2 = sorted((self.start_point.x(), event.pos().x()))
+            y1, y2 = sorted((self.start_point.y(), event.pos().y()))
             # Добавляем прямоугольник только если его размер достаточно большой
-            if (self.start_point - event.pos()).manhattanLength() > 10:
-                self.rectangles.append(Rectangle(self.start_point, event.pos()))
+            if is_drawn_box((x1, y1, x2, y2)):
+                self.rectangles.append(self.page.to_original((x1, y1, x2, y2)))
             self.image_label.update()
     
     def paint_event(self, event):
@@ -164,18 +148,13 @@ class ImageCutterApp(QMainWindow):
             painter.setBrush(QColor(255, 0, 0, 30))  # Полупрозрачная заливка
             
             # Отрисовка существующих прямоугольников
-            for rect in self.rectangles:
-                painter.drawRect(rect.get_qrect())
+            for box in self.rectangles:
+                painter.drawRect(preview_qrect(self.page.to_preview(box)))
             
             # Отрисовка прямоугольника, который сейчас рисуется
             if self.drawing:
-                current_rect = QRect(
-                    min(self.start_point.x(), self.current_point.x()),
-                    min(self.start_point.y(), self.current_point.y()),
-                    abs(self.start_point.x() - self.current_point.x()),
-                    abs(self.start_point.y() - self.current_point.y())
-                )
-                painter.drawRect(current_rect)
+                painter.drawRect(preview_qrect((self.start_point.x(), self.start_point.y(),
+                                                self.current_point.x(), self.current_point.y())))
             
             painter.end()
     
@@ -189,47 +168,14 @@ class ImageCutterApp(QMainWindow):
             return
         
         try:
-            # Открываем исходное изображение с полным качеством
-            pil_image = Image.open(self.image_path)
-            if pil_image.mode != 'RGB':
-                pil_image = pil_image.convert('RGB')
-            
-            width, height = pil_image.size
-            
-            # Получаем директорию и имя файла для сохранения результатов
-            base_dir = os.path.dirname(self.image_path)
-            base_name = os.path.splitext(os.path.basename(self.image_path))[0]
-            
-            # Получаем масштаб для преобразования координат
-            scale_x = width / self.display_pixmap.width()
-            scale_y = height / self.display_pixmap.height()
-            
-            # Обрезаем по каждому прямоугольнику
-            for i, rect in enumerate(self.rectangles, 1):
-                # Получаем координаты прямоугольника
-                qrect = rect.get_qrect()
-                left = int(qrect.x() * scale_x)
-                top = int(qrect.y() * scale_y)
-                right = int((qrect.x() + qrect.width()) * scale_x)
-                bottom = int((qrect.y() + qrect.height()) * scale_y)
-                
-                # Обеспечиваем, чтобы координаты были в пределах изображения
-                left = max(0, min(left, width - 1))
-                top = max(0, min(top, height - 1))
-                right = max(0, min(right, width))
-                bottom = max(0, min(bottom, height))
-                
-                # Обрезаем изображение
-                cropped = pil_image.crop((left, top, right, bottom))
-                
-                # Формируем имя выходного файла
-                output_path = os.path.join(base_dir, f"{base_name}_cutted_{i}.tiff")
-                
-                # Сохраняем с оригинальным качеством
-                cropped.save(output_path, format="TIFF", compression="tiff_lzw")
-            
-            QMessageBox.information(self, "Готово", f"Изображение разрезано на {len(self.rectangles)} частей и сохранено в:\n{base_dir}")
+            # Результаты сохраняются рядом с оригиналом в полном качестве
+            base_dir = os.path.dirname(os.path.abspath(self.image_path))
+            # Режется та же страница, что показана в окне
+            saved = sum(1 for _, _, output_path in cut(self.image_path, {self.page.page: self.rectangles}, base_dir)
+                        if output_path is not None)
             
+            QMessageBox.information(self, "Готово", f"Изображение разрезано на {saved} частей и сохранено в:\n{base_dir}")
+        
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось разрезать изображение: {str(e)}")
 
@@ -237,4 +183,4 @@ if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = ImageCutterApp()
     window.show()
-    sys.exit(app.exec_()) 
\ No newline at end of file
+    sys.exit(app.exec_())
@@ -0,0 +1,92 @@
+from PIL import Image
+
+from cutting import region_nbytes
+from instrumentation import stage
+from region_reader import RegionReader
+
+# Максимальный размер предпросмотра
+PREVIEW_MAX_WIDTH = 1200
+PREVIEW_MAX_HEIGHT = 800
+
+# Промежуточное изображение должно быть не меньше чем в REDUCING_GAP раз
+# больше предпросмотра, чтобы финальный LANCZOS давал то же качество
+REDUCING_GAP = 2
+
+# Высота полосы (в строках), которая декодируется и уменьшается за один раз
+BAND_ROWS = 512
+
+# Режимы, которые поддерживает Image.reduce
+REDUCE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK', 'I', 'F')
+
+
+def preview_geometry(size, max_width=PREVIEW_MAX_WIDTH, max_height=PREVIEW_MAX_HEIGHT):
+    """Возвращает коэффициент масштабирования и размер предпросмотра"""
+    width, height = size
+    scale_factor = min(max_width / width, max_height / height)
+    return scale_factor, (int(width * scale_factor), int(height * scale_factor))
+
+
+def build_preview(path, max_width=PREVIEW_MAX_WIDTH, max_height=PREVIEW_MAX_HEIGHT, page=0, timings=None):
+    """Строит RGB-предпросмотр страницы page TIFF-файла.
+
+    Если в файле есть уменьшенная копия (reduced-resolution IFD или уровень
+    пирамиды), используется она. Иначе изображение декодируется полосами,
+    каждая из которых сразу уменьшается в целое число раз (Image.reduce),
+    и только затем выполняется финальный LANCZOS до размера предпросмотра.
+
+    В timings (StageTimings), если он передан, замеряются этапы чтения
+    структуры файла, декодирования, преобразования режима и уменьшения.
+
+    Возвращает (предпросмотр, оригинальный размер, коэффициент масштабирования).
+    """
+    with stage(timings, 'scan'):
+        reader = RegionReader(path, page)
+    with reader:
+        return reader_preview(reader, max_width, max_height, timings)
+
+
+def reader_preview(reader, max_width=PREVIEW_MAX_WIDTH, max_height=PREVIEW_MAX_HEIGHT, timings=None):
+    """Строит предпросмотр по уже открытому RegionReader (см. build_preview)"""
+    original_size = reader.size
+    scale_factor, preview_size = preview_geometry(original_size, max_width, max_height)
+    min_size = (preview_size[0] * REDUCING_GAP, preview_size[1] * REDUCING_GAP)
+
+    with stage(timings, 'decode'):
+        source = reader.read_level(min_size)
+    if source is None:
+        source = reduce_image(reader, min_size, timings)
+
+    if source.mode != 'RGB':
+        with stage(timings, 'convert'):
+            source = source.convert('RGB')
+    if source.size != preview_size:
+        with stage(timings, 'resize'):
+            source = source.resize(preview_size, Image.LANCZOS)
+    return source, original_size, scale_factor
+
+
+def reduce_image(reader, min_size, timings=None):
+    """Уменьшает изображение в целое число раз, но не меньше min_size, декодируя его полосами"""
+    width, height = reader.size
+    factor = max(1, min(width // max(min_size[0], 1), height // max(min_size[1], 1)))
+
+    # Высота полосы кратна коэффициенту, чтобы блоки reduce совпадали с цельным изображением
+    band_rows = factor * max(1, BAND_ROWS // factor)
+    reduced = None
+    for top in range(0, height, band_rows):
+        bottom = min(top + band_rows, height)
+        with stage(timings, 'decode'):
+            band = reader.read_region((0, top, width, bottom))
+        if timings is not None:
+            timings.count_bytes('decode', region_nbytes(band))
+        if band.mode not in REDUCE_MODES:
+            with stage(timings, 'convert'):
+                band = band.convert('RGB')
+        if factor > 1:
+            with stage(timings, 'resize'):
+                band = band.reduce(factor)
+
+        if reduced is None:
+            reduced = Image.new(band.mode, (-(-width // factor), -(-height // factor)))
+        reduced.paste(band, (0, top // factor))
+    return reduced
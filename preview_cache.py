@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# Максимальный размер кэша предпросмотров на диске
+PREVIEW_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Сколько байт с начала, середины и конца файла учитывается в ключе
+PARTIAL_HASH_CHUNK = 64 * 1024
+
+
+def default_cache_dir():
+    """Папка кэша: PHOTO_CUTTER_CACHE_DIR или стандартная папка кэша пользователя"""
+    directory = os.environ.get('PHOTO_CUTTER_CACHE_DIR')
+    if directory:
+        return directory
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'photo_cutter', 'previews')
+
+
+def file_identity(path):
+    """Ключ файла: путь, размер, время изменения и хэш части содержимого"""
+    stat = os.stat(path)
+    digest = hashlib.sha1()
+    digest.update(os.path.abspath(path).encode('utf-8'))
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode('ascii'))
+
+    with open(path, 'rb') as f:
+        for offset in (0, stat.st_size // 2, max(0, stat.st_size - PARTIAL_HASH_CHUNK)):
+            f.seek(offset)
+            digest.update(f.read(PARTIAL_HASH_CHUNK))
+    return digest.hexdigest()
+
+
+class PreviewCache:
+    """Кэш предпросмотров и метаданных сканов на диске.
+
+    Для каждого файла хранятся предпросмотр (PNG) и JSON с оригинальным
+    размером, режимом, коэффициентом масштабирования и прямоугольниками
+    (в координатах оригинала); detected - искались ли на странице фотографии. Страницы многостраничного TIFF хранятся
+    отдельными записями. При превышении max_bytes удаляются записи,
+    к которым дольше всего не обращались.
+    """
+
+    def __init__(self, directory=None, max_bytes=PREVIEW_CACHE_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _key(identity, page):
+        # Для первой страницы ключ прежний: записи, созданные до поддержки страниц, остаются в силе
+        return identity if not page else f"{identity}-{page}"
+
+    def _paths(self, key):
+        return (os.path.join(self.directory, key + '.png'),
+                os.path.join(self.directory, key + '.json'))
+
+    def load(self, image_path, page=0):
+        """Возвращает запись кэша для страницы page файла или None.
+
+        Запись - словарь с ключами preview (PIL-изображение), original_size,
+        mode, scale_factor, rectangles и detected.
+        """
+        from PIL import Image
+
+        try:
+            key = self._key(file_identity(image_path), page)
+            preview_path, meta_path = self._paths(key)
+            with open(meta_path, encoding='utf-8') as f:
+                entry = json.load(f)
+            with Image.open(preview_path) as preview:
+                entry['preview'] = preview.convert('RGB')
+        except (OSError, ValueError):
+            return None
+
+        # Время доступа для вытеснения давно не использованных записей
+        for path in (preview_path, meta_path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+        entry['original_size'] = tuple(entry['original_size'])
+        entry['rectangles'] = [tuple(box) for box in entry['rectangles']]
+        # Записи, сохраненные до появления флага, всегда создавались с поиском фотографий
+        entry['detected'] = entry.get('detected', True)
+        return entry
+
+    def store(self, image_path, preview, original_size, mode, scale_factor, rectangles, page=0, detected=True):
+        """Сохраняет предпросмотр и метаданные страницы файла"""
+        try:
+            key = self._key(file_identity(image_path), page)
+            os.makedirs(self.directory, exist_ok=True)
+            preview_path, meta_path = self._paths(key)
+
+            self._write_atomic(preview_path, lambda f: preview.save(f, format='PNG'), 'wb')
+            self._write_meta(meta_path, {
+                'path': os.path.abspath(image_path),
+                'original_size': list(original_size),
+                'mode': mode,
+                'scale_factor': scale_factor,
+                'rectangles': [list(box) for box in rectangles],
+                'detected': detected,
+            })
+            self.evict()
+        except OSError as e:
+            print(f"Не удалось сохранить предпросмотр в кэш: {e}")
+
+    def rectangles(self, image_path, pages):
+        """Прямоугольники страниц из кэша: {номер кадра: области или None}.
+
+        Читаются только метаданные, без предпросмотров. Для страниц, на
+        которых фотографии еще не искались, возвращается None.
+        """
+        result = dict.fromkeys(pages)
+        try:
+            identity = file_identity(image_path)
+        except OSError:
+            return result
+        for page in pages:
+            try:
+                with open(self._paths(self._key(identity, page))[1], encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta.get('detected', True):
+                    result[page] = [tuple(box) for box in meta['rectangles']]
+            except (OSError, ValueError, KeyError):
+                pass
+        return result
+
+    def update_rectangles(self, image_path, rectangles, page=0):
+        """Обновляет прямоугольники страницы файла, если для нее есть запись в кэше"""
+        try:
+            key = self._key(file_identity(image_path), page)
+            _, meta_path = self._paths(key)
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            meta['rectangles'] = [list(box) for box in rectangles]
+            self._write_meta(meta_path, meta)
+        except (OSError, ValueError):
+            pass
+
+    def evict(self):
+        """Удаляет давно не использованные записи, пока кэш больше max_bytes"""
+        entries = {}
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext not in ('.png', '.json'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            size, used = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+
+        total = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def _write_meta(self, path, meta):
+        self._write_atomic(path, lambda f: json.dump(meta, f, ensure_ascii=False), 'w')
+
+    def _write_atomic(self, path, write, mode):
+        """Записывает файл через временный, чтобы не оставить оборванную запись"""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode, **({'encoding': 'utf-8'} if 'b' not in mode else {})) as f:
+                write(f)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
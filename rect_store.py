@@ -0,0 +1,266 @@
+import math
+from array import array
+from collections import deque
+
+from cutting import box_angle, bounding_box
+
+# Чисел на одну область в хранилище: x1, y1, x2, y2, угол
+RECT_FIELDS = 5
+
+# Сторона ячейки сетки пространственного индекса в пикселях оригинала
+GRID_CELL_SIZE = 512
+
+# Сколько правок можно отменить
+UNDO_LIMIT = 100
+
+# Какие стороны области (левая, верхняя, правая, нижняя) двигаются, когда ее тянут
+# за середину: перемещение - это сдвиг всех четырех сторон
+MOVE = (True, True, True, True)
+
+
+def make_box(x1, y1, x2, y2, angle=0.0):
+    """Область с целыми координатами углов; угол добавляется, только если он не нулевой"""
+    box = (int(x1), int(y1), int(x2), int(y2))
+    return box + (angle,) if angle else box
+
+
+def to_local(box, x, y):
+    """Точка в системе координат области: от ее центра вдоль ее сторон"""
+    x1, y1, x2, y2 = box[:4]
+    angle = math.radians(box_angle(box))
+    cos, sin = math.cos(angle), math.sin(angle)
+    dx, dy = x - (x1 + x2) / 2, y - (y1 + y2) / 2
+    return dx * cos - dy * sin, dx * sin + dy * cos
+
+
+def handle_at(box, x, y, tolerance):
+    """За какие стороны область тянется из точки (x, y): кортеж из четырех признаков или None.
+
+    Точка в пределах tolerance от стороны захватывает эту сторону (у угла - две),
+    точка внутри области - всю область (MOVE).
+    """
+    x1, y1, x2, y2 = box[:4]
+    local_x, local_y = to_local(box, x, y)
+    half_w, half_h = (x2 - x1) / 2, (y2 - y1) / 2
+    if abs(local_x) > half_w + tolerance or abs(local_y) > half_h + tolerance:
+        return None
+    # У маленькой области стороны не должны занимать ее целиком, иначе ее нельзя будет передвинуть
+    tolerance_x = min(tolerance, half_w / 2)
+    tolerance_y = min(tolerance, half_h / 2)
+    left = abs(local_x + half_w) <= tolerance_x
+    right = not left and abs(local_x - half_w) <= tolerance_x
+    top = abs(local_y + half_h) <= tolerance_y
+    bottom = not top and abs(local_y - half_h) <= tolerance_y
+    if left or top or right or bottom:
+        return (left, top, right, bottom)
+    return MOVE
+
+
+def dragged_box(box, handle, dx, dy):
+    """Область после того, как стороны handle сдвинуты на (dx, dy) пикселей оригинала.
+
+    Сторона повернутой области движется только поперек себя, а противоположная
+    сторона остается на месте.
+    """
+    x1, y1, x2, y2 = box[:4]
+    angle = box_angle(box)
+    left, top, right, bottom = handle
+    radians = math.radians(angle)
+    cos, sin = math.cos(radians), math.sin(radians)
+    local_dx, local_dy = dx * cos - dy * sin, dx * sin + dy * cos
+
+    half_w, half_h = (x2 - x1) / 2, (y2 - y1) / 2
+    new_left = -half_w + (local_dx if left else 0)
+    new_right = half_w + (local_dx if right else 0)
+    new_top = -half_h + (local_dy if top else 0)
+    new_bottom = half_h + (local_dy if bottom else 0)
+
+    # Сдвиг центра переводится обратно в координаты оригинала
+    mid_x, mid_y = (new_left + new_right) / 2, (new_top + new_bottom) / 2
+    center_x = (x1 + x2) / 2 + mid_x * cos + mid_y * sin
+    center_y = (y1 + y2) / 2 - mid_x * sin + mid_y * cos
+    width, height = round(abs(new_right - new_left)), round(abs(new_bottom - new_top))
+    left_x, top_y = round(center_x - width / 2), round(center_y - height / 2)
+    return make_box(left_x, top_y, left_x + width, top_y + height, angle)
+
+
+def _snap_shift(values, edges, tolerance):
+    """Наименьший сдвиг, совмещающий одно из значений с ближайшим краем, или 0"""
+    best = 0
+    for value in values:
+        for edge in edges:
+            shift = edge - value
+            if abs(shift) <= tolerance and (not best or abs(shift) < abs(best)):
+                best = shift
+    return best
+
+
+class RectStore:
+    """Области страницы в одном массиве array('d') с пространственным индексом.
+
+    Каждая область занимает RECT_FIELDS чисел подряд (x1, y1, x2, y2, угол);
+    ее номер - порядок нумерации при разрезке. Сетка из ячеек cell_size
+    хранит номера областей, описанные прямоугольники которых задевают
+    ячейку, поэтому поиск под курсором и привязка к краям просматривают
+    только соседние области, а не все.
+    """
+
+    def __init__(self, boxes=(), cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self._data = array('d')
+        self._grid = {}  # (столбец, строка) -> номера областей
+        for box in boxes:
+            self.append(box)
+
+    def __len__(self):
+        return len(self._data) // RECT_FIELDS
+
+    def box(self, index):
+        start = index * RECT_FIELDS
+        return make_box(*self._data[start:start + RECT_FIELDS])
+
+    def boxes(self):
+        return [self.box(index) for index in range(len(self))]
+
+    def append(self, box):
+        """Добавляет область и возвращает ее номер"""
+        index = len(self)
+        self._data.extend(self._row(box))
+        self._index(index, self.box(index))
+        return index
+
+    def update(self, index, box):
+        self._unindex(index, self.box(index))
+        start = index * RECT_FIELDS
+        self._data[start:start + RECT_FIELDS] = array('d', self._row(box))
+        self._index(index, self.box(index))
+
+    def remove(self, index):
+        start = index * RECT_FIELDS
+        del self._data[start:start + RECT_FIELDS]
+        # Номера следующих областей сдвинулись: удаление редкое, индекс проще построить заново
+        self._rebuild()
+
+    def clear(self):
+        del self._data[:]
+        self._grid = {}
+
+    def snapshot(self):
+        """Копия массива областей для истории правок"""
+        return array('d', self._data)
+
+    def restore(self, snapshot):
+        self._data = array('d', snapshot)
+        self._rebuild()
+
+    def within(self, x1, y1, x2, y2):
+        """Номера областей, описанные прямоугольники которых пересекают (x1, y1, x2, y2), по возрастанию"""
+        found = set()
+        for cell in self._cells_in(x1, y1, x2, y2):
+            found.update(self._grid.get(cell, ()))
+        result = []
+        for index in sorted(found):
+            left, top, right, bottom = bounding_box(self.box(index))
+            if left <= x2 and x1 <= right and top <= y2 and y1 <= bottom:
+                result.append(index)
+        return result
+
+    def hit(self, x, y, tolerance=0, prefer=None):
+        """Область под точкой (x, y) и стороны, за которые ее можно тянуть: (номер, handle) или None.
+
+        Из нескольких областей под точкой выбирается prefer (обычно выделенная),
+        а иначе самая маленькая: вложенную область можно выбрать внутри большой.
+        """
+        best = None
+        for index in self.within(x - tolerance, y - tolerance, x + tolerance, y + tolerance):
+            box = self.box(index)
+            handle = handle_at(box, x, y, tolerance)
+            if handle is None:
+                continue
+            if index == prefer:
+                return index, handle
+            area = (box[2] - box[0]) * (box[3] - box[1])
+            if best is None or area < best[0]:
+                best = (area, index, handle)
+        return best and best[1:]
+
+    def snap(self, box, handle, exclude=None, tolerance=0):
+        """Подтягивает двигающиеся стороны неповернутой области к краям соседних областей"""
+        if box_angle(box) or not tolerance:
+            return box
+        x1, y1, x2, y2 = box
+        xs, ys = [], []
+        for index in self.within(x1 - tolerance, y1 - tolerance, x2 + tolerance, y2 + tolerance):
+            other = self.box(index)
+            if index != exclude and not box_angle(other):
+                xs += other[0], other[2]
+                ys += other[1], other[3]
+
+        left, top, right, bottom = handle
+        shift_x = _snap_shift([value for value, moving in ((x1, left), (x2, right)) if moving], xs, tolerance)
+        shift_y = _snap_shift([value for value, moving in ((y1, top), (y2, bottom)) if moving], ys, tolerance)
+        return make_box(x1 + shift_x * left, y1 + shift_y * top, x2 + shift_x * right, y2 + shift_y * bottom)
+
+    @staticmethod
+    def _row(box):
+        x1, y1, x2, y2 = box[:4]
+        return (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2), box_angle(box))
+
+    def _cells_in(self, x1, y1, x2, y2):
+        size = self.cell_size
+        return [(col, row)
+                for row in range(math.floor(y1 / size), math.floor(y2 / size) + 1)
+                for col in range(math.floor(x1 / size), math.floor(x2 / size) + 1)]
+
+    def _index(self, index, box):
+        for cell in self._cells_in(*bounding_box(box)):
+            self._grid.setdefault(cell, set()).add(index)
+
+    def _unindex(self, index, box):
+        for cell in self._cells_in(*bounding_box(box)):
+            indices = self._grid.get(cell)
+            if indices is not None:
+                indices.discard(index)
+                if not indices:
+                    del self._grid[cell]
+
+    def _rebuild(self):
+        self._grid = {}
+        for index in range(len(self)):
+            self._index(index, self.box(index))
+
+
+class EditHistory:
+    """История правок областей: снимки хранилища до каждой правки.
+
+    Снимок - копия массива RectStore (40 байт на область), поэтому история
+    из UNDO_LIMIT шагов занимает мало памяти даже на страницах с сотнями областей.
+    """
+
+    def __init__(self, limit=UNDO_LIMIT):
+        self._undo = deque(maxlen=limit)
+        self._redo = []
+
+    def record(self, store):
+        """Запоминает состояние перед правкой; после новой правки повтор невозможен"""
+        self._undo.append(store.snapshot())
+        self._redo.clear()
+
+    def undo(self, store):
+        """Возвращает хранилище к состоянию до последней правки; False, если отменять нечего"""
+        if not self._undo:
+            return False
+        self._redo.append(store.snapshot())
+        store.restore(self._undo.pop())
+        return True
+
+    def redo(self, store):
+        if not self._redo:
+            return False
+        self._undo.append(store.snapshot())
+        store.restore(self._redo.pop())
+        return True
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
@@ -0,0 +1,368 @@
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+def import_tifffile():
+    """Импортирует tifffile при первом обращении; без него работает запасной путь через PIL"""
+    try:
+        import tifffile
+    except ImportError:
+        return None
+    return tifffile
+
+
+# Сжатие TIFF: 1 - без сжатия
+COMPRESSION_NONE = 1
+
+# Фотометрическая интерпретация TIFF
+PHOTOMETRIC_MINISBLACK = 1
+PHOTOMETRIC_RGB = 2
+PHOTOMETRIC_SEPARATED = 5
+
+# ExtraSamples: 2 - неассоциированная альфа (режим RGBA в PIL)
+EXTRASAMPLE_UNASSALPHA = 2
+
+# NewSubfileType: бит 0 означает уменьшенную копию другой страницы
+TAG_NEW_SUBFILE_TYPE = 254
+SUBFILE_REDUCED = 1
+
+# Сколько байт декодированных полос/тайлов держать для соседних областей:
+# тайлы просмотра одной строки читают одни и те же полосы на всю ширину скана
+SEGMENT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def page_mode(page):
+    """Возвращает режим PIL для страницы tifffile или None, если раскладка не поддерживается"""
+    if page.planarconfig != 1 or page.is_subsampled:
+        return None
+    if page.is_tiled and page.tiledepth != 1:
+        return None
+
+    dtype = page.dtype
+    photometric = int(page.photometric)
+    samples = page.samplesperpixel
+
+    if dtype == np.uint8:
+        if photometric == PHOTOMETRIC_MINISBLACK and samples == 1:
+            return 'L'
+        if photometric == PHOTOMETRIC_RGB and samples == 3:
+            return 'RGB'
+        if (photometric == PHOTOMETRIC_RGB and samples == 4
+                and tuple(page.extrasamples) == (EXTRASAMPLE_UNASSALPHA,)):
+            return 'RGBA'
+        if photometric == PHOTOMETRIC_SEPARATED and samples == 4:
+            return 'CMYK'
+    elif dtype == np.uint16:
+        if photometric == PHOTOMETRIC_MINISBLACK and samples == 1:
+            return 'I;16'
+        if photometric == PHOTOMETRIC_RGB and samples == 3:
+            # В PIL такого режима нет: он открывает файл как RGB с 8 битами на канал
+            return 'RGB;16'
+    return None
+
+
+def array_to_image(array, mode):
+    """Создает PIL-изображение режима mode из массива (высота, ширина[, каналы])"""
+    if mode == 'RGB;16':
+        # Как PIL: старший байт каждого канала
+        array, mode = (array >> 8).astype(np.uint8), 'RGB'
+    if mode == 'I;16':
+        array = array.astype('<u2', copy=False)
+    array = np.ascontiguousarray(array)
+    height, width = array.shape[:2]
+    return Image.frombuffer(mode, (width, height), array, 'raw', mode, 0, 1)
+
+
+def scan_pages(path):
+    """Номера кадров TIFF, которые являются отдельными сканами.
+
+    Уменьшенные копии (миниатюры в основной цепочке IFD) пропускаются.
+    Читаются только каталоги IFD, пиксели страниц не декодируются.
+    """
+    pages = []
+    with Image.open(path) as image:
+        for frame in range(getattr(image, 'n_frames', 1)):
+            image.seek(frame)
+            tags = getattr(image, 'tag_v2', {})
+            if not tags.get(TAG_NEW_SUBFILE_TYPE, 0) & SUBFILE_REDUCED:
+                pages.append(frame)
+    return pages or [0]
+
+
+def is_mappable(page):
+    """Можно ли читать полосы или тайлы страницы прямо из файла, без декодирования"""
+    return (page.compression == COMPRESSION_NONE and page.predictor == 1 and page.fillorder == 1
+            and page.parent.filehandle.is_file)
+
+
+class RegionReader:
+    """Читает прямоугольные области TIFF в исходном режиме изображения.
+
+    Если установлен tifffile (и imagecodecs для сжатых файлов), декодируются
+    только те полосы (strips) или тайлы, которые пересекает область, поэтому
+    расход памяти зависит от размера области, а не от размера скана.
+    Несжатые файлы отображаются в память (numpy.memmap): пиксели области
+    берутся прямо из файла без декодирования, а если изображение записано
+    в файле одним куском, область для режимов L, RGBA, CMYK и I;16 вообще
+    не копируется. Так режутся сканы больше объема оперативной памяти.
+    В остальных случаях изображение один раз декодируется через PIL
+    и области вырезаются из него без преобразования в RGB.
+
+    mode - режим PIL-изображений областей, file_mode - режим пикселей в файле.
+    Они различаются только для RGB с 16 битами на канал: read_region отдает
+    8-битное RGB, как PIL, а read_array - исходные 16-битные значения.
+
+    page - номер кадра многостраничного TIFF (см. scan_pages); остальные
+    страницы не читаются.
+    """
+
+    def __init__(self, path, page=0):
+        self.path = path
+        self.page = page
+        self.pil_image = Image.open(path)
+        if page:
+            self.pil_image.seek(page)
+        self.size = self.pil_image.size
+        self.mode = self.pil_image.mode
+        self.file_mode = self.mode
+
+        self._tiff = None
+        self._page = None
+        self._mapped = None
+        self._segments = OrderedDict()
+        self._segments_bytes = 0
+        tifffile = import_tifffile()
+        if tifffile is not None:
+            try:
+                self._tiff = tifffile.TiffFile(path)
+                page = self._tiff.pages[page]
+                # Используем быстрый путь только если результат совпадет с PIL
+                mode = page_mode(page)
+                if ((mode == self.mode or (mode, self.mode) == ('RGB;16', 'RGB'))
+                        and (page.imagewidth, page.imagelength) == self.size):
+                    self._page = page
+                    self.file_mode = mode
+                    if is_mappable(page):
+                        self._mapped = np.memmap(path, dtype=np.uint8, mode='r')
+                        self._dtype = page.dtype.newbyteorder(self._tiff.byteorder)
+            except Exception:
+                self._page = None
+                self._mapped = None
+                self.file_mode = self.mode
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._tiff is not None:
+            self._tiff.close()
+            self._tiff = None
+        self._page = None
+        # Отображение закроется, когда не останется вырезанных из него областей
+        self._mapped = None
+        self._segments.clear()
+        self.pil_image.close()
+
+    def read_region(self, box):
+        """Возвращает PIL-изображение области box = (x1, y1, x2, y2)"""
+        if self._page is not None:
+            try:
+                image = self._map_contiguous(box)
+                if image is None:
+                    image = array_to_image(self._read_array(box), self.file_mode)
+                return image
+            except (ValueError, NotImplementedError):
+                self._disable_fast_path()
+        return self.pil_image.crop(box)
+
+    def read_array(self, box):
+        """Возвращает массив области в режиме файла (file_mode) или None без tifffile"""
+        if self._page is not None:
+            try:
+                return self._read_array(box)
+            except (ValueError, NotImplementedError):
+                self._disable_fast_path()
+        return None
+
+    def _disable_fast_path(self):
+        # Сжатие не поддерживается установленными кодеками или файл поврежден
+        self._page = None
+        self._mapped = None
+        self.file_mode = self.mode
+
+    def read_level(self, min_size):
+        """Возвращает наименьший уменьшенный уровень пирамиды не меньше min_size или None"""
+        if self._page is None:
+            return None
+        # Уровни пирамиды есть у серии, которая состоит из одной этой страницы
+        levels = []
+        for series in self._tiff.series:
+            if len(series.pages) == 1 and getattr(series.pages[0], 'offset', None) == self._page.offset:
+                levels = getattr(series, 'levels', [])[1:]
+                break
+
+        best = None
+        for level in levels:
+            page = level.keyframe
+            if page.imagewidth < min_size[0] or page.imagelength < min_size[1]:
+                continue
+            if page_mode(page) is None:
+                continue
+            if best is None or page.imagewidth < best.imagewidth:
+                best = page
+        if best is None:
+            return None
+
+        try:
+            array = best.asarray()
+        except (ValueError, NotImplementedError):
+            return None
+        return array_to_image(array, page_mode(best))
+
+    def _segment_indices(self, box):
+        """Индексы полос или тайлов, пересекающих область"""
+        page = self._page
+        x1, y1, x2, y2 = box
+        width, height = self.size
+
+        if page.is_tiled:
+            tile_w, tile_h = page.tilewidth, page.tilelength
+            tiles_across = -(-width // tile_w)
+            return [
+                row * tiles_across + col
+                for row in range(y1 // tile_h, -(-y2 // tile_h))
+                for col in range(x1 // tile_w, -(-x2 // tile_w))
+            ]
+
+        rows_per_strip = min(page.rowsperstrip or height, height)
+        return list(range(y1 // rows_per_strip, -(-y2 // rows_per_strip)))
+
+    def _map_contiguous(self, box):
+        """PIL-изображение поверх отображенного файла без копирования или None.
+
+        PIL отображает буфер с шагом строки, если изображение записано в файле
+        одним куском, режим совпадает с раскладкой в файле и после области
+        хватает байт на полную строку.
+        """
+        if self._mapped is None or not self._page.is_contiguous:
+            return None
+        if self.file_mode not in ('L', 'RGBA', 'CMYK', 'I;16'):
+            return None
+        if self.file_mode == 'I;16' and self._dtype.byteorder == '>':
+            return None
+
+        x1, y1, x2, y2 = box
+        pixel = self._dtype.itemsize * self._page.samplesperpixel
+        stride = self.size[0] * pixel
+        start = self._page.dataoffsets[0] + y1 * stride + x1 * pixel
+        end = start + (y2 - y1) * stride
+        if end > len(self._mapped):
+            return None
+        return Image.frombuffer(self.mode, (x2 - x1, y2 - y1), self._mapped[start:end],
+                                'raw', self.mode, stride, 1)
+
+    def _read_array(self, box):
+        """Массив области; для несжатого изображения одним куском - срез отображения"""
+        if self._mapped is not None and self._page.is_contiguous:
+            x1, y1, x2, y2 = box
+            width, height = self.size
+            samples = self._page.samplesperpixel
+            shape = (height, width, samples) if samples > 1 else (height, width)
+            image = np.ndarray(shape, dtype=self._dtype, buffer=self._mapped, offset=self._page.dataoffsets[0])
+            return image[y1:y2, x1:x2]
+        return self._read_segments(box)
+
+    def _read_segments(self, box):
+        page = self._page
+        x1, y1, x2, y2 = box
+        samples = page.samplesperpixel
+
+        shape = (y2 - y1, x2 - x1, samples) if samples > 1 else (y2 - y1, x2 - x1)
+        region = np.zeros(shape, dtype=page.dtype)
+
+        for segment, position in self._decoded_segments(self._segment_indices(box)):
+            if segment is None:
+                continue  # Пустой сегмент - остаются нули
+            seg_y, seg_x = position[2], position[3]
+            segment = segment[0]  # (длина, ширина, каналы)
+
+            # Пересечение сегмента с областью
+            top = max(y1, seg_y)
+            left = max(x1, seg_x)
+            bottom = min(y2, seg_y + segment.shape[0])
+            right = min(x2, seg_x + segment.shape[1])
+            if top >= bottom or left >= right:
+                continue
+
+            part = segment[top - seg_y:bottom - seg_y, left - seg_x:right - seg_x]
+            if samples == 1:
+                part = part[..., 0]
+            region[top - y1:bottom - y1, left - x1:right - x1] = part
+
+        return region
+
+    def _decoded_segments(self, indices):
+        """Выдает (сегмент, положение) для индексов; недавно декодированные берутся из кэша"""
+        page = self._page
+        if self._mapped is not None:
+            for index in indices:
+                yield self._mapped_segment(index)
+            return
+
+        missing = []
+        for index in indices:
+            if index in self._segments:
+                self._segments.move_to_end(index)
+                yield self._segments[index]
+            else:
+                missing.append(index)
+        if not missing:
+            return
+
+        offsets = [page.dataoffsets[i] for i in missing]
+        bytecounts = [page.databytecounts[i] for i in missing]
+        # Индексы сегментов не передаются в read_segments: для одного сегмента
+        # tifffile ищет по ним в offsets, а не в полном списке страницы
+        for data, i in self._tiff.filehandle.read_segments(offsets, bytecounts):
+            index = missing[i]
+            segment, position, _ = page.decode(data, index, jpegtables=page.jpegtables)
+            self._remember_segment(index, segment, position)
+            yield segment, position
+
+    def _mapped_segment(self, index):
+        """Несжатая полоса или тайл как массив, отображенный на файл, в раскладке page.decode"""
+        page = self._page
+        width, height = self.size
+        if page.is_tiled:
+            tiles_across = -(-width // page.tilewidth)
+            row, col = divmod(index, tiles_across)
+            seg_h, seg_w = page.tilelength, page.tilewidth
+            seg_y, seg_x = row * seg_h, col * seg_w
+        else:
+            rows_per_strip = min(page.rowsperstrip or height, height)
+            seg_y, seg_x = index * rows_per_strip, 0
+            seg_h, seg_w = min(rows_per_strip, height - seg_y), width
+
+        position = (0, 0, seg_y, seg_x, 0)
+        bytecount = page.databytecounts[index]
+        if bytecount == 0:
+            return None, position  # Пустой сегмент
+        shape = (1, seg_h, seg_w, page.samplesperpixel)
+        if bytecount < seg_h * seg_w * page.samplesperpixel * self._dtype.itemsize:
+            raise ValueError(f"Сегмент {index} короче, чем нужно")
+        return np.ndarray(shape, dtype=self._dtype, buffer=self._mapped, offset=page.dataoffsets[index]), position
+
+    def _remember_segment(self, index, segment, position):
+        size = segment.nbytes if segment is not None else 0
+        if size > SEGMENT_CACHE_BYTES:
+            return
+        self._segments[index] = (segment, position)
+        self._segments_bytes += size
+        while self._segments_bytes > SEGMENT_CACHE_BYTES:
+            old_segment, _ = self._segments.popitem(last=False)[1]
+            self._segments_bytes -= old_segment.nbytes if old_segment is not None else 0
@@ -0,0 +1,167 @@
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QRect, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage
+
+# Размер тайла в пикселях уровня пирамиды
+TILE_SIZE = 256
+
+# Сколько тайлов держать в кэше (тайл RGB 256x256 занимает около 200 КБ)
+TILE_CACHE_TILES = 512
+
+# Сколько потоков декодируют тайлы
+TILE_THREADS = 2
+
+
+class TileCache:
+    """LRU-кэш декодированных тайлов"""
+
+    def __init__(self, capacity=TILE_CACHE_TILES):
+        self.capacity = capacity
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+            return tile
+
+    def put(self, key, tile):
+        with self._lock:
+            self._tiles[key] = tile
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.capacity:
+                self._tiles.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+
+
+class TileWorker(QRunnable):
+    """Декодирует один тайл в фоновом потоке"""
+
+    def __init__(self, pyramid, key):
+        super().__init__()
+        self.pyramid = pyramid
+        self.key = key
+        self.started = False
+
+    def run(self):
+        self.started = True
+        self.pyramid.decode_tile(self.key)
+
+
+class TilePyramid(QObject):
+    """Ленивая пирамида тайлов исходного TIFF.
+
+    Уровень пирамиды задается коэффициентом уменьшения (1, 2, 4, ...).
+    Тайлы декодируются из исходного файла по запросу в фоновых потоках
+    и хранятся в LRU-кэше; полное изображение в памяти не держится.
+    Координаты тайлов и областей - в пикселях оригинала; page - номер
+    кадра страницы многостраничного TIFF.
+    """
+
+    # Область тайла в координатах оригинала, который только что стал доступен
+    tile_ready = pyqtSignal(QRect)
+
+    def __init__(self, image_path, original_size, cache=None, page=0):
+        super().__init__()
+        self.image_path = image_path
+        self.page = page
+        self.original_size = original_size
+        self.cache = cache or TileCache()
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(TILE_THREADS)
+
+        self._reader = None
+        self._reader_lock = threading.Lock()
+        self._closed = False
+        self._pending = {}
+
+    @staticmethod
+    def level_for_zoom(zoom):
+        """Наибольший коэффициент уменьшения, при котором тайлы не хуже экрана"""
+        level = 1
+        while level * 2 <= 1 / zoom:
+            level *= 2
+        return level
+
+    def tile_rect(self, key):
+        """Область тайла в координатах оригинала"""
+        level, col, row = key
+        span = TILE_SIZE * level
+        width, height = self.original_size
+        x, y = col * span, row * span
+        return QRect(x, y, min(span, width - x), min(span, height - y))
+
+    def tiles_in(self, rect, level):
+        """Ключи тайлов уровня level, пересекающих область rect (в координатах оригинала)"""
+        span = TILE_SIZE * level
+        width, height = self.original_size
+        left = max(0, rect.left()) // span
+        top = max(0, rect.top()) // span
+        right = min(width - 1, rect.right()) // span
+        bottom = min(height - 1, rect.bottom()) // span
+        return [(level, col, row) for row in range(top, bottom + 1) for col in range(left, right + 1)]
+
+    def tile(self, key):
+        """Возвращает QImage тайла или None, если он еще не декодирован"""
+        return self.cache.get((self.image_path, self.page) + key)
+
+    def request(self, keys):
+        """Ставит в очередь декодирование недостающих тайлов.
+
+        Тайлы из прошлых запросов, которые еще не начали декодироваться,
+        снимаются с очереди: они больше не видны на экране.
+        """
+        if self._closed:
+            return
+        self.thread_pool.clear()
+        self._pending = {key: worker for key, worker in self._pending.items() if worker.started}
+
+        for key in keys:
+            if key in self._pending or self.tile(key) is not None:
+                continue
+            worker = TileWorker(self, key)
+            self._pending[key] = worker
+            self.thread_pool.start(worker)
+
+    def decode_tile(self, key):
+        from region_reader import RegionReader
+        from preview import REDUCE_MODES
+
+        rect = self.tile_rect(key)
+        box = (rect.left(), rect.top(), rect.left() + rect.width(), rect.top() + rect.height())
+        with self._reader_lock:
+            if self._closed:
+                return
+            if self._reader is None:
+                self._reader = RegionReader(self.image_path, self.page)
+            region = self._reader.read_region(box)
+
+        level = key[0]
+        if region.mode not in REDUCE_MODES:
+            region = region.convert('RGB')
+        if level > 1:
+            region = region.reduce(level)
+        if region.mode != 'RGB':
+            region = region.convert('RGB')
+
+        data = region.tobytes("raw", "RGB")
+        tile = QImage(data, region.width, region.height, region.width * 3, QImage.Format_RGB888).copy()
+        self.cache.put((self.image_path, self.page) + key, tile)
+        self.tile_ready.emit(rect)
+
+    def close(self):
+        """Останавливает декодирование и закрывает исходный файл"""
+        self._closed = True
+        self.thread_pool.clear()
+        self.thread_pool.waitForDone()
+        with self._reader_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
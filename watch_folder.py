@@ -0,0 +1,174 @@
+import os
+
+from PyQt5.QtCore import QObject, QThreadPool, QTimer, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from cutting import TIFF_EXTENSIONS
+from workers import LoadWorker
+
+# Интервал опроса папки в миллисекундах. Папка опрашивается, а не отслеживается
+# уведомлениями системы: на сетевых папках они приходят не всегда
+POLL_INTERVAL_MS = 1000
+
+# Сколько следующих сканов очереди готовится заранее
+PREFETCH_COUNT = 3
+
+# Сколько потоков готовят сканы: подготовка не должна мешать разрезке и тайлам
+PREFETCH_THREADS = 1
+
+
+class FolderWatcher(QObject):
+    """Следит за папкой и сообщает о новых TIFF, запись которых закончена.
+
+    Сканер записывает файл постепенно, поэтому файл считается готовым, когда
+    его размер и время изменения не поменялись между двумя опросами.
+    Файлы, которые уже лежали в папке, тоже выдаются - в порядке имен.
+    """
+
+    # Путь к готовому файлу
+    file_ready = pyqtSignal(str)
+
+    def __init__(self, directory, interval_ms=POLL_INTERVAL_MS):
+        super().__init__()
+        self.directory = directory
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.poll)
+
+        self._seen = set()      # Файлы, о которых уже сообщено
+        self._growing = {}      # Файл -> (размер, время изменения) на прошлом опросе
+
+    def start(self):
+        self.poll()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def poll(self):
+        try:
+            entries = sorted(os.scandir(self.directory), key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Не удалось прочитать папку {self.directory}: {e}")
+            return
+
+        growing = {}
+        for entry in entries:
+            if entry.path in self._seen or not entry.name.lower().endswith(TIFF_EXTENSIONS):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # Файл удален или переименован между листингом и проверкой
+            state = (stat.st_size, stat.st_mtime_ns)
+            if stat.st_size > 0 and self._growing.get(entry.path) == state:
+                self._seen.add(entry.path)
+                self.file_ready.emit(entry.path)
+            else:
+                growing[entry.path] = state
+        self._growing = growing
+
+
+class ScanQueue(QObject):
+    """Очередь сканов, которые заранее готовятся в фоне.
+
+    Для первой страницы первых prefetch_count файлов очереди LoadWorker
+    строит предпросмотр и ищет фотографии; результаты держатся в памяти, поэтому переход к
+    следующему скану не требует загрузки. Готовый скан выдается сигналами
+    loaded и failed с теми же аргументами, что и у LoadWorker.
+    """
+
+    loaded = pyqtSignal(str, int, object, QImage, object, str, float, object, bool, object)
+    failed = pyqtSignal(str, str)
+    # Сканов в очереди, из них подготовлено
+    changed = pyqtSignal(int, int)
+
+    def __init__(self, cache=None, prefetch_count=PREFETCH_COUNT):
+        super().__init__()
+        self.cache = cache
+        self.prefetch_count = prefetch_count
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(PREFETCH_THREADS)
+
+        self.pending = []       # Пути сканов в порядке поступления
+        self.current = None     # Скан, снятый с очереди и еще не выданный
+        self._results = {}      # Путь -> (сигнал, аргументы) подготовленного скана
+        self._workers = {}      # Путь -> LoadWorker, который его готовит
+
+    def __len__(self):
+        return len(self.pending)
+
+    def prepared_count(self):
+        return sum(1 for path in self.pending if path in self._results)
+
+    def add(self, path):
+        if path in self.pending or path == self.current:
+            return
+        self.pending.append(path)
+        self.prefetch()
+        self._changed()
+
+    def take(self):
+        """Снимает с очереди первый скан и возвращает его путь.
+
+        Скан выдается вызовом activate, когда получатель готов его принять.
+        """
+        path = self.pending.pop(0)
+        self.current = path
+        self.prefetch()
+        self._changed()
+        return path
+
+    def activate(self, path):
+        """Выдает снятый с очереди скан: сразу, если он подготовлен, иначе по готовности"""
+        if path != self.current:
+            return
+        if path in self._results:
+            self._deliver(path)
+        elif path not in self._workers:
+            self._start(path)
+
+    def prefetch(self):
+        """Запускает подготовку первых prefetch_count сканов очереди"""
+        for path in self.pending[:self.prefetch_count]:
+            if path not in self._results and path not in self._workers:
+                self._start(path)
+
+    def close(self):
+        self.thread_pool.clear()
+        self.thread_pool.waitForDone()
+        self.pending.clear()
+        self._results.clear()
+        self._workers.clear()
+        self.current = None
+
+    def _start(self, path):
+        worker = LoadWorker(path, self.cache)
+        worker.signals.loaded.connect(self._on_loaded)
+        worker.signals.failed.connect(self._on_failed)
+        self._workers[path] = worker
+        self.thread_pool.start(worker)
+
+    def _on_loaded(self, path, *args):
+        self._store(path, self.loaded, args)
+
+    def _on_failed(self, path, message):
+        self._store(path, self.failed, (message,))
+
+    def _store(self, path, signal, args):
+        self._workers.pop(path, None)
+        if path != self.current and path not in self.pending:
+            return  # Очередь закрыта или скан уже открыт другим способом
+        self._results[path] = (signal, args)
+        if path == self.current:
+            self._deliver(path)
+        else:
+            self._changed()
+
+    def _deliver(self, path):
+        signal, args = self._results.pop(path)
+        self.current = None
+        signal.emit(path, *args)
+
+    def _changed(self):
+        self.changed.emit(len(self.pending), self.prepared_count())
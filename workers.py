@@ -0,0 +1,142 @@
+import os
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+from PyQt5.QtGui import QImage
+
+from cutting import DEFAULT_PROFILE
+
+
+def to_qimage(image):
+    """Копия PIL-изображения в QImage; ее можно создавать и вне главного потока"""
+    image = image.convert("RGBA")
+    data = image.tobytes("raw", "RGBA")
+    return QImage(data, image.width, image.height, QImage.Format_RGBA8888).copy()
+
+
+class LoadSignals(QObject):
+    # путь, номер кадра страницы, номера кадров всех страниц файла, предпросмотр,
+    # оригинальный размер, режим, коэффициент масштабирования,
+    # области (в координатах оригинала), признак того, что они взяты из кэша,
+    # и замеры этапов загрузки (StageTimings)
+    loaded = pyqtSignal(str, int, object, QImage, object, str, float, object, bool, object)
+    # путь, текст ошибки
+    failed = pyqtSignal(str, str)
+
+
+class LoadWorker(QRunnable):
+    """Строит предпросмотр страницы page и ищет на ней фотографии в фоновом потоке.
+
+    Если страница уже открывалась, предпросмотр и прямоугольники берутся из кэша.
+    Время этапов загрузки и память записываются в журнал замеров.
+    """
+
+    def __init__(self, image_path, cache=None, page=0):
+        super().__init__()
+        self.image_path = image_path
+        self.page = page
+        self.cache = cache
+        self.signals = LoadSignals()
+
+    def run(self):
+        # Импорт здесь, а не в начале модуля: numpy, PIL и OpenCV не замедляют запуск окна
+        from engine import load_page
+        from instrumentation import StageTimings, log_timings, stage, traced
+        
+        timings = StageTimings('load', self.image_path)
+        try:
+            with traced(timings):
+                page = load_page(self.image_path, self.page, self.cache, timings=timings)
+                # QImage можно создавать вне главного потока, QPixmap - нельзя
+                with stage(timings, 'convert'):
+                    qimg = to_qimage(page.preview)
+        except Exception as e:
+            self.signals.failed.emit(self.image_path, str(e))
+            return
+
+        timings.extra.update(page=self.page, cached=page.from_cache, rectangles=len(page.boxes))
+        log_timings(timings.finish())
+        self.signals.loaded.emit(self.image_path, self.page, page.pages, qimg, page.original_size, page.mode,
+                                 page.scale_factor, page.boxes, page.from_cache, timings)
+
+
+class CutSignals(QObject):
+    # путь, обработано областей, всего областей, имя сохраненного файла (пусто для пропущенных)
+    progress = pyqtSignal(str, int, int, str)
+    # путь, сохранено областей, папка результатов, отменено ли,
+    # сводка кодирования (скорость и степень сжатия), замеры этапов (StageTimings),
+    # найденные повторы - список пар (имя нового файла, имя похожего)
+    finished = pyqtSignal(str, int, str, bool, str, object, object)
+    # путь, текст ошибки
+    failed = pyqtSignal(str, str)
+
+
+class CutWorker(QRunnable):
+    """Вырезает и сохраняет области в фоновом потоке; может быть отменен между областями.
+
+    page_boxes - словарь {номер кадра страницы: области}; для значения None
+    фотографии на странице ищутся автоматически. Все страницы сохраняются
+    за один проход по файлу. Если передан duplicates (DuplicateIndex папки
+    результатов), каждая область перед сохранением проверяется на повтор,
+    а найденные пары передаются в сигнале finished и пишутся в журнал замеров.
+    Время этапов разрезки и память записываются в журнал замеров.
+    """
+
+    def __init__(self, image_path, page_boxes, output_dir, profile=DEFAULT_PROFILE, duplicates=None):
+        super().__init__()
+        self.image_path = image_path
+        self.page_boxes = page_boxes
+        self.output_dir = output_dir
+        self.profile = profile
+        self.duplicates = duplicates
+        self.signals = CutSignals()
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def run(self):
+        from cutting import ExportStats
+        from engine import cut
+        from instrumentation import log_timings, traced
+        
+        saved_count = 0
+        processed = 0
+        matches = []
+        # Области страниц, которые ищутся при разрезке, добавляются к итогу по мере обработки
+        total = sum(len(boxes) for boxes in self.page_boxes.values() if boxes is not None)
+        stats = ExportStats(self.profile, self.image_path)
+        try:
+            with traced(stats.timings):
+                regions = cut(self.image_path, self.page_boxes, self.output_dir, profile=self.profile, stats=stats,
+                              duplicates=self.duplicates)
+                try:
+                    for _, _, output_path in regions:
+                        processed += 1
+                        total = max(total, processed)
+                        if output_path is not None:
+                            saved_count += 1
+                        name = os.path.basename(output_path) if output_path else ""
+                        self.signals.progress.emit(self.image_path, processed, total, name)
+
+                        if self._cancel_event.is_set():
+                            break
+                finally:
+                    # Закрытие генератора отменяет еще не начатое кодирование
+                    regions.close()
+                if self.duplicates is not None:
+                    self.duplicates.save()
+                    matches = self.duplicates.take_matches()
+        except Exception as e:
+            self.signals.failed.emit(self.image_path, str(e))
+            return
+
+        cancelled = self._cancel_event.is_set()
+        stats.timings.extra.update(profile=self.profile, saved=saved_count, unchanged=stats.unchanged,
+                                   removed=stats.removed, duplicates=stats.duplicates, cancelled=cancelled)
+        if matches:
+            stats.timings.extra['matches'] = [list(pair) for pair in matches]
+        log_timings(stats.timings.finish())
+        self.signals.finished.emit(self.image_path, saved_count, self.output_dir, cancelled,
+                                   stats.summary() if stats.count or stats.unchanged or stats.removed or stats.duplicates else "",
+                                   stats.timings, matches)